@@ -0,0 +1,741 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import chess
+
+# This program measures how fast the chess program runs. Each benchmark
+#  uses randomly generated (but seeded) boards, so runs are repeatable.
+#
+#  movegen: moves generated per second for each piece type, through the
+#   bitboard API (calculate_moves) and the list API (calculate_possible_moves).
+#  target: Target mode searches (BFS) per second for each piece type, from a
+#   random start to a random target square past 8 random pawns.
+#  vector: distance maps per second for chess.distance_map, one board at a
+#   time, and for chess_numpy.batch_distance_maps over all boards at once
+#   (needs NumPy).
+#  batch: scenarios per second through batch mode (run_batch) with 1, 2, 4, ...
+#   up to --workers worker processes, on a mix of collect and target scenarios.
+#  memory: peak memory (measured with tracemalloc) of Knight Collector mode
+#   runs for each solver.
+#  serve: a load generator for the solver server (chess.py --serve). Several
+#   connections send scenarios one after another, and the 50th and 99th
+#   percentile time to get each result back is reported for each mode.
+#   Without --address, a server is started for the run.
+#  perft: move sequences counted per second (perft) from positions with
+#   several friendly pieces and pawns in the way, for each move generator
+#   (the move tables, and the list API through legacy_moves). The counts are
+#   checked against known-good values, and the run fails if one differs.
+#  suite: every case above (perft with the move tables only) plus Collector
+#   mode for each solver and number of pawns (and the heuristic solver with
+#   32 pawns), with the median and 95th percentile time of a call and nodes
+#   per second. Results are written to JSON (--output) and compared with a
+#   stored baseline (--baseline); the run fails if any median grew by more
+#   than --threshold. Each median is compared relative to a calibration
+#   timed right before its case, so a baseline from another machine (or a
+#   busier one) still works.
+#
+# Example:
+# $ bench_chess.py movegen --boards 2000
+# $ bench_chess.py target --boards 2000
+# $ bench_chess.py batch --workers 8
+# $ bench_chess.py memory --pawns 3
+# $ bench_chess.py serve --requests 5000 --connections 16
+# $ bench_chess.py perft --depth 4 --generators tables
+# $ bench_chess.py suite --baseline bench_baseline.json --output bench_results.json
+
+
+# This method generates the boards used by the move generation benchmark.
+#  Each board is a start square and a bitboard of 8 pawns (not on the start).
+def movegen_boards(count, seed):
+    return list( chess.generate_scenarios(count, 8, seed) )
+
+
+# This method times move generation for one piece type over the given
+#  boards and returns a dictionary of results for both APIs.
+def bench_movegen(piece_class, boards):
+
+    pieces = [ piece_class( chess.square_name(square) ) for square, occupancy in boards ]
+    pawn_lists = [ chess.bitboard_to_positions(occupancy) for square, occupancy in boards ]
+
+    # bitboard API
+    moves = 0
+    start = time.perf_counter()
+    for piece, (square, occupancy) in zip(pieces, boards):
+        moves += bin( piece.calculate_moves(occupancy) ).count('1')
+    bitboard_seconds = time.perf_counter() - start
+
+    # list API
+    start = time.perf_counter()
+    for piece, pawns in zip(pieces, pawn_lists):
+        piece.calculate_possible_moves(pawns)
+    list_seconds = time.perf_counter() - start
+
+    return {'piece': piece_class.piece_type,
+            'calls': len(boards),
+            'moves': moves,
+            'bitboard_moves_per_sec': moves / bitboard_seconds,
+            'list_moves_per_sec': moves / list_seconds
+           }
+
+
+# This method runs the move generation benchmark and prints its results.
+def run_movegen(args):
+
+    boards = movegen_boards(args.boards, args.seed)
+
+    # build the sliding tables up front so they aren't timed as move generation
+    start = time.perf_counter()
+    chess.load_sliding_tables(args.table_cache)
+    print('Sliding tables ready in {:.3f}s'.format(time.perf_counter() - start))
+
+    print('{:8} {:>8} {:>10} {:>18} {:>18}'.format('piece', 'calls', 'moves', 'bitboard moves/s', 'list moves/s'))
+    for piece_class in (chess.Queen, chess.Rook, chess.Knight):
+        result = bench_movegen(piece_class, boards)
+        print('{:8} {:>8} {:>10} {:>18,.0f} {:>18,.0f}'.format(result['piece'], result['calls'], result['moves'],
+                                                              result['bitboard_moves_per_sec'],
+                                                              result['list_moves_per_sec']))
+
+
+# This method times BFS for one piece type over the given boards and returns
+#  a dictionary of results. Each board also gets a random target square.
+def bench_target(piece_type, boards, seed):
+
+    rng = random.Random(seed)
+    searches = []
+    for square, occupancy in boards:
+        target = rng.randrange(64)
+        searches.append( ( chess.Space(square % 8 + 1, square // 8 + 1, 0),
+                           chess.Space(target % 8 + 1, target // 8 + 1, -1),
+                           chess.bitboard_to_positions(occupancy) ) )
+
+    moves = 0
+    start = time.perf_counter()
+    for start_space, target_space, pawns in searches:
+        moves += chess.BFS(start_space, target_space, piece_type, pawns)
+    seconds = time.perf_counter() - start
+
+    return {'piece': piece_type,
+            'searches': len(searches),
+            'moves': moves,
+            'seconds': seconds,
+            'searches_per_sec': len(searches) / seconds
+           }
+
+
+# This method runs the Target mode benchmark and prints its results.
+def run_target(args):
+
+    boards = movegen_boards(args.boards, args.seed)
+    chess.load_sliding_tables()
+
+    print('{:8} {:>8} {:>10} {:>10} {:>14}'.format('piece', 'searches', 'moves', 'seconds', 'searches/s'))
+    for piece_type in ('QUEEN', 'ROOK', 'KNIGHT'):
+        result = bench_target(piece_type, boards, args.seed)
+        print('{:8} {:>8} {:>10} {:>10.3f} {:>14,.0f}'.format(result['piece'], result['searches'], result['moves'],
+                                                            result['seconds'], result['searches_per_sec']))
+
+
+# This method runs the vectorized search benchmark and prints its results.
+def run_vector(args):
+
+    import chess_numpy
+
+    boards = movegen_boards(args.boards, args.seed)
+    starts = [square for square, occupancy in boards]
+    occupancies = [occupancy for square, occupancy in boards]
+    occupancy_array = chess_numpy.np.array(occupancies, dtype=chess_numpy.np.uint64)
+    chess.load_sliding_tables()
+
+    print('{:8} {:>8} {:>18} {:>18}'.format('piece', 'boards', 'python maps/s', 'numpy maps/s'))
+    for piece_type in ('QUEEN', 'ROOK', 'KNIGHT'):
+        start = time.perf_counter()
+        for square, occupancy in boards:
+            chess.distance_map(piece_type, square, occupancy)
+        python_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        chess_numpy.batch_distance_maps(piece_type, starts, occupancy_array)
+        numpy_seconds = time.perf_counter() - start
+
+        print('{:8} {:>8} {:>18,.0f} {:>18,.0f}'.format(piece_type, len(boards), len(boards) / python_seconds,
+                                                      len(boards) / numpy_seconds))
+
+
+# This method returns the JSON lines of the batch benchmark's scenarios.
+def batch_scenarios(count, seed):
+
+    rng = random.Random(seed)
+    lines = []
+
+    for square, pawn_mask in chess.generate_scenarios(count, 8, seed):
+        scenario = {'piece': rng.choice(['QUEEN', 'ROOK', 'KNIGHT']),
+                    'position': chess.square_name(square),
+                    'mode': rng.choice(['collect', 'target']),
+                    'pawn_mask': pawn_mask}
+        lines.append( json.dumps(scenario) )
+
+    return lines
+
+
+# This method runs the batch benchmark with a growing number of workers and
+#  prints the throughput and speedup of each run.
+def run_batch_scaling(args):
+
+    text = '\n'.join( batch_scenarios(args.scenarios, args.seed) )
+
+    # 1, 2, 4, ... workers, ending with the requested number
+    worker_counts = [1]
+    while worker_counts[-1] * 2 < args.workers:
+        worker_counts.append(worker_counts[-1] * 2)
+    if args.workers > 1:
+        worker_counts.append(args.workers)
+
+    print('{} CPUs available'.format(os.cpu_count()))
+    print('{:>8} {:>10} {:>14} {:>8}'.format('workers', 'seconds', 'scenarios/s', 'speedup'))
+
+    first = None
+    with open(os.devnull, 'w') as output:
+        for workers in worker_counts:
+            start = time.perf_counter()
+            count = chess.run_batch(io.StringIO(text), output, workers=workers, chunk_size=args.chunk_size)
+            seconds = time.perf_counter() - start
+            first = first or seconds
+            print('{:>8} {:>10.3f} {:>14,.0f} {:>7.2f}x'.format(workers, seconds, count / seconds, first / seconds))
+
+
+# This method runs the memory benchmark: for each solver, the peak memory
+#  and time of Knight Collector mode runs, on boards with --pawns pawns.
+def run_memory(args):
+
+    boards = list( chess.generate_scenarios(args.boards, args.pawns, args.seed) )
+
+    print('{:10} {:>8} {:>16} {:>16} {:>10}'.format('solver', 'boards', 'mean peak KiB', 'max peak KiB', 'seconds'))
+    for solver in args.solvers:
+        peaks = []
+        start = time.perf_counter()
+        for square, pawn_mask in boards:
+            tracemalloc.start()
+            collect_moves(solver, 'KNIGHT', square, pawn_mask)
+            peaks.append( tracemalloc.get_traced_memory()[1] )
+            tracemalloc.stop()
+        seconds = time.perf_counter() - start
+
+        print('{:10} {:>8} {:>16,.0f} {:>16,.0f} {:>10.3f}'.format(solver, len(boards), sum(peaks) / len(peaks) / 1024,
+                                                                 max(peaks) / 1024, seconds))
+
+
+# This method returns the JSON lines of the server benchmark's scenarios:
+#  a mix of standard and target mode scenarios with collect_share of collect
+#  mode scenarios, all with their pawns given.
+def serve_scenarios(count, collect_share, seed):
+
+    rng = random.Random(seed)
+    lines = []
+
+    for square, pawn_mask in chess.generate_scenarios(count, 8, seed):
+        mode = 'collect' if rng.random() < collect_share else rng.choice(['standard', 'target'])
+        scenario = {'piece': rng.choice(['QUEEN', 'ROOK', 'KNIGHT']),
+                    'position': chess.square_name(square),
+                    'mode': mode,
+                    'pawn_mask': pawn_mask}
+        lines.append( json.dumps(scenario) )
+
+    return lines
+
+
+# This method sends lines to the server at address over connections
+#  connections, each sending a line and waiting for its result before sending
+#  the next one. It returns a list of (mode, seconds, error) per line, and
+#  the total time taken.
+async def send_load(address, lines, connections):
+
+    address = chess.parse_address(address)
+    queue = asyncio.Queue()
+    for line in lines:
+        queue.put_nowait(line)
+    results = []
+
+    async def client():
+        if address[0] == 'tcp':
+            reader, writer = await asyncio.open_connection(address[1], address[2], limit=2 ** 24)
+        else:
+            reader, writer = await asyncio.open_unix_connection(address[1], limit=2 ** 24)
+        try:
+            while not queue.empty():
+                line = queue.get_nowait()
+                start = time.perf_counter()
+                writer.write(line.encode() + b'\n')
+                await writer.drain()
+                result = json.loads( await reader.readline() )
+                results.append( (json.loads(line)['mode'], time.perf_counter() - start, 'error' in result) )
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather( *[client() for i in range(connections)] )
+
+    return (results, time.perf_counter() - start)
+
+
+# This method starts a solver server on a Unix socket in directory, and
+#  returns the process and the socket's address once it is listening.
+def start_server(directory, workers):
+
+    address = os.path.join(directory, 'chess.sock')
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chess.py')
+    process = subprocess.Popen([sys.executable, script, '--serve', address, '--workers', str(workers)])
+
+    while not os.path.exists(address):
+        if process.poll() is not None:
+            raise RuntimeError('The server stopped before it started listening.')
+        time.sleep(0.05)
+
+    return (process, address)
+
+
+# This method runs the server benchmark and prints the latency percentiles
+#  for each mode and for all requests.
+def run_serve(args):
+
+    lines = serve_scenarios(args.requests, args.collect_share, args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        process = None
+        address = args.address
+        if address is None:
+            process, address = start_server(directory, args.workers)
+
+        try:
+            results, seconds = asyncio.run( send_load(address, lines, args.connections) )
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    print('{} requests over {} connections in {:.3f} s ({:,.0f} requests/s)'.format(len(results), args.connections,
+                                                                                    seconds, len(results) / seconds))
+    print('{:10} {:>8} {:>8} {:>10} {:>10}'.format('mode', 'requests', 'errors', 'p50 ms', 'p99 ms'))
+
+    for mode in ('standard', 'target', 'collect', 'all'):
+        latencies = [ latency for kind, latency, error in results if mode in (kind, 'all') ]
+        if latencies:
+            errors = sum( error for kind, latency, error in results if mode in (kind, 'all') )
+            print('{:10} {:>8} {:>8} {:>10.3f} {:>10.3f}'.format(mode, len(latencies), errors,
+                                                                 percentile(latencies, 0.5) * 1000,
+                                                                 percentile(latencies, 0.99) * 1000))
+
+    return 0
+
+
+# collector solvers in the benchmark suite, with the most pawns each one is
+#  benchmarked with: the original priority queue search (pq) grows
+#  exponentially with the number of pawns, so it stops at 2
+SUITE_SOLVERS = ( ('astar', 8), ('heldkarp', 8), ('pq', 2) )
+
+# number of pawns the heuristic collector is benchmarked with in the suite
+HEURISTIC_PAWNS = 32
+
+
+# perft positions: name, friendly pieces as (piece type, position), pawn
+#  positions, and the known-good number of move sequences at depth 1, 2, ...
+#  (checked against a separate, plain move generator)
+PERFT_POSITIONS = [
+    ('rooks', [('ROOK', 'a1'), ('ROOK', 'h1')], [],
+     [26, 662, 17786, 480314]),
+    ('minor', [('KNIGHT', 'b1'), ('BISHOP', 'c1'), ('KING', 'e1')], ['d3', 'c4', 'e4', 'f5'],
+     [15, 238, 4101, 74038]),
+    ('mixed', [('QUEEN', 'd1'), ('ROOK', 'a1'), ('KNIGHT', 'g1'), ('BISHOP', 'f1')],
+     ['a6', 'c5', 'd5', 'e4', 'g6', 'h3', 'b3', 'f7'],
+     [30, 954, 31777, 1092330]),
+    ('fairy', [('AMAZON', 'd4'), ('CHANCELLOR', 'a1'), ('ARCHBISHOP', 'h8'), ('CAMEL', 'e2')],
+     ['b6', 'c2', 'f3', 'g5', 'd7', 'h4'],
+     [57, 3160, 173520, 9522724]),
+]
+
+# move generators perft can measure, by name
+PERFT_GENERATORS = {'tables': chess.generate_moves, 'legacy': chess.legacy_moves}
+
+
+# This method returns the arguments of chess.perft (pieces as (piece type,
+#  square) and a pawn bitboard) for a position given with positions.
+def perft_arguments(pieces, pawns):
+    return ( [ (piece_type, chess.square_index(position)) for piece_type, position in pieces ],
+             chess.positions_to_bitboard(pawns) )
+
+
+# This method reads a list of friendly pieces given as text, such as
+#  'QUEEN:d1,KNIGHT:g1', into a list of (piece type, position).
+def parse_pieces(text):
+
+    pieces = []
+    for item in text.split(','):
+        piece_type, separator, position = item.partition(':')
+        if piece_type.upper() not in chess.PIECE_CLASSES or not chess.is_valid_position(position):
+            raise ValueError('Piece "{}" not accepted (use TYPE:position, ex: QUEEN:d1).'.format(item))
+        pieces.append( (piece_type.upper(), position.lower()) )
+
+    return pieces
+
+
+# This method runs the perft benchmark and prints its results. It returns
+#  1 if any count differs from its known-good value, else 0.
+def run_perft(args):
+
+    chess.load_sliding_tables()
+
+    positions = PERFT_POSITIONS
+    if args.pieces:
+        pawns = [position.lower() for position in args.pawns.split(',')] if args.pawns else []
+        try:
+            positions = [ ('custom', parse_pieces(args.pieces), pawns, []) ]
+            if not all(chess.is_valid_position(position) for position in pawns):
+                raise ValueError('Pawn positions {} not accepted.'.format(args.pawns))
+            chess.perft( *perft_arguments(positions[0][1], pawns), depth=0 )
+        except ValueError as error:
+            print(error, file=sys.stderr)
+            return 2
+
+    mismatches = 0
+    print('{:8} {:8} {:>5} {:>12} {:>10} {:>14}  {}'.format('position', 'generator', 'depth', 'nodes', 'seconds',
+                                                            'nodes/s', 'check'))
+    for name, pieces, pawns, counts in positions:
+        pieces, pawn_mask = perft_arguments(pieces, pawns)
+        for generator in args.generators:
+            for depth in range(1, args.depth + 1):
+
+                start = time.perf_counter()
+                nodes = chess.perft(pieces, pawn_mask, depth, PERFT_GENERATORS[generator])
+                seconds = time.perf_counter() - start
+
+                if depth > len(counts):
+                    check = '-'
+                elif nodes == counts[depth - 1]:
+                    check = 'ok'
+                else:
+                    check = 'MISMATCH (expected {})'.format(counts[depth - 1])
+                    mismatches += 1
+
+                print('{:8} {:8} {:>5} {:>12} {:>10.3f} {:>14,.0f}  {}'.format(name, generator, depth, nodes, seconds,
+                                                                              nodes / seconds, check))
+
+    return 1 if mismatches else 0
+
+
+# This method returns the value at fraction (0 to 1) of the way through the
+#  sorted list of samples, interpolating between neighbouring samples.
+def percentile(samples, fraction):
+
+    samples = sorted(samples)
+    position = (len(samples) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(samples) - 1)
+
+    return samples[lower] + (samples[upper] - samples[lower]) * (position - lower)
+
+
+# This method times call() for each of the given arguments and returns a
+#  dictionary with the median and 95th percentile time of a call (in seconds)
+#  and the calls and nodes per second. call returns the number of nodes (for
+#  example moves generated) it worked through, unless count is given: then
+#  count is called once more, untimed, with the same arguments to get the
+#  number of nodes. Each call is timed repeat times and the fastest time is
+#  kept, which filters out most of the noise from other programs running at
+#  the same time.
+def time_case(call, arguments, repeat=3, count=None):
+
+    samples = []
+    nodes = 0
+    for argument in arguments:
+        fastest = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            call_nodes = call(*argument)
+            seconds = time.perf_counter() - start
+            fastest = seconds if fastest is None else min(fastest, seconds)
+        nodes += call_nodes if count is None else count(*argument)
+        samples.append(fastest)
+
+    seconds = sum(samples)
+    return {'calls': len(samples),
+            'median': percentile(samples, 0.5),
+            'p95': percentile(samples, 0.95),
+            'calls_per_sec': len(samples) / seconds,
+            'nodes_per_sec': nodes / seconds
+           }
+
+
+# This method does a fixed amount of plain Python work like the searches do
+#  (integer bit operations, dictionary and list updates) and returns the
+#  fastest of repeat timings of it in seconds. The suite times it before each
+#  case to measure how fast the machine is running at that moment.
+def calibrate(repeat=5, steps=5000):
+
+    fastest = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        counts = {}
+        queue = []
+        for step in range(steps):
+            bits = (step * 2654435761) & 0xFFFFFFFF
+            counts[bits & 1023] = counts.get(bits & 1023, 0) + bin(bits).count('1')
+            queue.append(bits >> 3)
+            if len(queue) > 64:
+                queue.pop(0)
+        seconds = time.perf_counter() - start
+        fastest = seconds if fastest is None else min(fastest, seconds)
+
+    return fastest
+
+
+# This method returns the benchmark suite's cases as (name, call, arguments,
+#  count) tuples for time_case. Every case uses its own seeded scenarios, so
+#  the suite times the same work on every run.
+def suite_cases(scenarios, max_pawns, seed):
+
+    cases = []
+    boards = movegen_boards(scenarios * 100, seed)
+
+    # move generation, timed 100 boards per call since one board takes less
+    #  than a microsecond: nodes are moves generated
+    board_groups = [ (boards[i:i+100],) for i in range(0, len(boards), 100) ]
+    for piece_type in ('QUEEN', 'ROOK', 'KNIGHT'):
+        cases.append( ('movegen/' + piece_type,
+                       lambda group, moves_from=chess.move_function(piece_type):
+                           sum( bin( moves_from(square, occupancy) ).count('1') for square, occupancy in group ),
+                       board_groups, None) )
+
+    # Target mode searches: nodes are squares expanded (the searches'
+    #  'popped' counter)
+    rng = random.Random(seed)
+    searches = [ ( chess.Space(square % 8 + 1, square // 8 + 1, 0),
+                   chess.Space(target % 8 + 1, target // 8 + 1, -1),
+                   chess.bitboard_to_positions(occupancy) )
+                 for (square, occupancy), target in zip(boards[:scenarios * 10], iter(lambda: rng.randrange(64), None)) ]
+    for piece_type in ('QUEEN', 'ROOK', 'KNIGHT'):
+        cases.append( ('bfs/' + piece_type,
+                       lambda start, target, pawns, piece_type=piece_type: chess.BFS(start, target, piece_type, pawns),
+                       searches,
+                       lambda start, target, pawns, piece_type=piece_type:
+                           search_nodes(chess.BFS, start, target, piece_type, pawns)) )
+
+    # perft to depth 3 from each perft position: nodes are move sequences
+    for name, pieces, pawns, counts in PERFT_POSITIONS:
+        cases.append( ('perft/' + name,
+                       lambda pieces, pawn_mask: chess.perft(pieces, pawn_mask, 3),
+                       [perft_arguments(pieces, pawns)], None) )
+
+    # Collector mode for every solver and number of pawns: nodes are squares
+    #  (or spaces, for pq) expanded by all of the solver's searches
+    for solver, solver_max_pawns in SUITE_SOLVERS:
+        for piece_type in ('QUEEN', 'ROOK', 'KNIGHT'):
+            for pawns in range(1, min(max_pawns, solver_max_pawns) + 1):
+                count = scenarios if solver != 'pq' else max(1, scenarios // 4)
+                boards = list( chess.generate_scenarios(count, pawns, seed) )
+                cases.append( ('collect/{}/{}/{}'.format(solver, piece_type, pawns),
+                               lambda square, pawn_mask, solver=solver, piece_type=piece_type: collect_moves(solver, piece_type, square, pawn_mask),
+                               boards,
+                               lambda square, pawn_mask, solver=solver, piece_type=piece_type:
+                                   search_nodes(collect_moves, solver, piece_type, square, pawn_mask)) )
+
+    # the heuristic solver is meant for many pawns, more than the exact ones
+    #  can take
+    for piece_type in ('QUEEN', 'ROOK', 'KNIGHT'):
+        boards = list( chess.generate_scenarios(scenarios, HEURISTIC_PAWNS, seed) )
+        cases.append( ('collect/heuristic/{}/{}'.format(piece_type, HEURISTIC_PAWNS),
+                       lambda square, pawn_mask, piece_type=piece_type: collect_moves('heuristic', piece_type, square, pawn_mask),
+                       boards,
+                       lambda square, pawn_mask, piece_type=piece_type:
+                           search_nodes(collect_moves, 'heuristic', piece_type, square, pawn_mask)) )
+
+    return cases
+
+
+# This method runs search(*arguments) with search counters on and returns
+#  the number of nodes it expanded.
+def search_nodes(search, *arguments):
+    stats = chess.new_stats()
+    search(*arguments, stats=stats)
+    return stats['popped']
+
+
+# This method solves one Collector mode board with the given solver and
+#  returns the number of moves. stats is passed to the solver.
+def collect_moves(solver, piece_type, square, pawn_mask, stats=None):
+
+    if solver == 'pq':
+        start = chess.Space(square % 8 + 1, square // 8 + 1, 0, [], chess.bitboard_to_positions(pawn_mask))
+        return chess.BFS_pq(start, piece_type, chess.bitboard_to_positions(pawn_mask), stats)[0]
+
+    solve = {'astar': chess.astar_collect, 'heldkarp': chess.held_karp_collect, 'heuristic': chess.heuristic_collect}[solver]
+    return solve(piece_type, square, list( chess.bitboard_squares(pawn_mask) ), stats)[0]
+
+
+# This method compares results with a baseline (both dictionaries of case
+#  name to result) and returns a list of (name, baseline median, median)
+#  for the cases whose median time grew by more than threshold (0.25 = 25%).
+#  When both sides have a 'calibration' time (see calibrate), the baseline
+#  median is first scaled by how much slower or faster the calibration ran,
+#  so results from machines of different speeds can be compared, and the
+#  scaled median is returned.
+#  Cases missing from either side are skipped here; run_suite reports the
+#  ones the baseline has no result for (see find_missing).
+def find_regressions(results, baseline, threshold):
+
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]['median']
+        if 'calibration' in result and 'calibration' in baseline[name]:
+            before *= result['calibration'] / baseline[name]['calibration']
+        if result['median'] > before * (1 + threshold):
+            regressions.append( (name, before, result['median']) )
+
+    return regressions
+
+
+# This method returns the sorted names of the cases in results that have no
+#  result in baseline, so they can't be compared.
+def find_missing(results, baseline):
+    return sorted( name for name in results if name not in baseline )
+
+
+# This method runs the benchmark suite, prints and saves its results, and
+#  compares them with a baseline. It returns 1 if any case regressed or is
+#  missing from the baseline, else 0.
+def run_suite(args):
+
+    chess.load_sliding_tables()
+
+    # each case with a calibration timed right before it
+    def time_suite_case(call, arguments, count):
+        calibration = calibrate()
+        result = time_case(call, arguments, args.repeat, count)
+        result['calibration'] = calibration
+        return result
+
+    results = {}
+    cases = {}
+    print('{:28} {:>7} {:>12} {:>12} {:>14}'.format('case', 'calls', 'median ms', 'p95 ms', 'nodes/s'))
+    for name, call, arguments, count in suite_cases(args.scenarios, args.max_pawns, args.seed):
+        if args.filter and args.filter not in name:
+            continue
+        cases[name] = (call, arguments, count)
+        result = time_suite_case(call, arguments, count)
+        results[name] = result
+        print('{:28} {:>7} {:>12.4f} {:>12.4f} {:>14,.0f}'.format(name, result['calls'], result['median'] * 1000,
+                                                                  result['p95'] * 1000, result['nodes_per_sec']))
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+    # a case can look slower because something else ran at the time, so the
+    #  cases that regressed are timed once more and the faster result is kept
+    for name, before, after in find_regressions(results, baseline, args.threshold):
+        result = time_suite_case(*cases[name])
+        if result['median'] / result['calibration'] < results[name]['median'] / results[name]['calibration']:
+            results[name] = result
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'seed': args.seed, 'scenarios': args.scenarios, 'results': results}, output, indent=1, sort_keys=True)
+
+    if not args.baseline:
+        return 0
+
+    regressions = find_regressions(results, baseline, args.threshold)
+    for name, before, after in regressions:
+        print('REGRESSION {}: median {:.4f} ms -> {:.4f} ms ({:+.0%})'.format(name, before * 1000, after * 1000, after / before - 1))
+    print('{} of {} cases regressed more than {:.0%} against {}'.format(len(regressions), len(results), args.threshold, args.baseline))
+
+    missing = find_missing(results, baseline)
+    for name in missing:
+        print('MISSING {}: no result in the baseline'.format(name))
+    if missing:
+        print('{} of {} cases are missing from {}; save a new baseline with --output'.format(len(missing), len(results), args.baseline))
+
+    return 1 if regressions or missing else 0
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark the chess program.')
+    benchmarks = parser.add_subparsers(dest='benchmark', required=True)
+
+    movegen = benchmarks.add_parser('movegen', help='Move generation throughput')
+    movegen.add_argument('--boards', type=int, default=20000, help='Number of random boards')
+    movegen.add_argument('--seed', type=int, default=1, help='Random seed for the boards')
+    movegen.add_argument('--table-cache', help='File to load/save the sliding tables')
+    movegen.set_defaults(run=run_movegen)
+
+    target = benchmarks.add_parser('target', help='Target mode search throughput')
+    target.add_argument('--boards', type=int, default=5000, help='Number of random boards')
+    target.add_argument('--seed', type=int, default=1, help='Random seed for the boards')
+    target.set_defaults(run=run_target)
+
+    vector = benchmarks.add_parser('vector', help='Vectorized (NumPy) distance maps')
+    vector.add_argument('--boards', type=int, default=20000, help='Number of random boards')
+    vector.add_argument('--seed', type=int, default=1, help='Random seed for the boards')
+    vector.set_defaults(run=run_vector)
+
+    batch = benchmarks.add_parser('batch', help='Batch mode scaling across worker processes')
+    batch.add_argument('--scenarios', type=int, default=4000, help='Number of random scenarios')
+    batch.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Largest number of workers')
+    batch.add_argument('--chunk-size', type=int, default=64, help='Scenarios sent to a worker at a time')
+    batch.add_argument('--seed', type=int, default=1, help='Random seed for the scenarios')
+    batch.set_defaults(run=run_batch_scaling)
+
+    memory = benchmarks.add_parser('memory', help='Peak memory of Knight Collector mode runs')
+    memory.add_argument('--boards', type=int, default=5, help='Number of random boards')
+    memory.add_argument('--pawns', type=int, default=3, help='Number of pawns on each board')
+    memory.add_argument('--solvers', nargs='+', choices=('pq', 'astar', 'heldkarp'), default=['pq', 'astar', 'heldkarp'],
+                        help='Collector solvers to measure')
+    memory.add_argument('--seed', type=int, default=1, help='Random seed for the boards')
+    memory.set_defaults(run=run_memory)
+
+    serve = benchmarks.add_parser('serve', help='Latency of the solver server under load')
+    serve.add_argument('--address', help='Address of a running server (by default one is started for the run)')
+    serve.add_argument('--requests', type=int, default=2000, help='Number of scenarios to send')
+    serve.add_argument('--connections', type=int, default=8, help='Number of connections sending at once')
+    serve.add_argument('--collect-share', type=float, default=0.25, help='Fraction of collect mode scenarios')
+    serve.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes of a started server')
+    serve.add_argument('--seed', type=int, default=1, help='Random seed for the scenarios')
+    serve.set_defaults(run=run_serve)
+
+    perft = benchmarks.add_parser('perft', help='Move sequences per second (perft) with several friendly pieces')
+    perft.add_argument('--depth', type=int, default=3, help='Deepest depth to count')
+    perft.add_argument('--generators', nargs='+', choices=sorted(PERFT_GENERATORS), default=['tables', 'legacy'],
+                       help='Move generators to measure')
+    perft.add_argument('--pieces', help='Count from these pieces instead of the built-in positions (ex: QUEEN:d1,KNIGHT:g1)')
+    perft.add_argument('--pawns', help='Pawn positions for --pieces (ex: d4,e5)')
+    perft.set_defaults(run=run_perft)
+
+    suite = benchmarks.add_parser('suite', help='Every benchmark case, saved to JSON and compared with a baseline')
+    suite.add_argument('--scenarios', type=int, default=20, help='Boards per collector case (more for other cases)')
+    suite.add_argument('--max-pawns', type=int, default=8, help='Most pawns in a collector case')
+    suite.add_argument('--seed', type=int, default=1, help='Random seed for the scenarios')
+    suite.add_argument('--repeat', type=int, default=3, help='Times each call is repeated (the fastest is kept)')
+    suite.add_argument('--filter', help='Only run cases whose name contains this text')
+    suite.add_argument('--output', help='File to write the results to, as JSON')
+    suite.add_argument('--baseline', help='Results file to compare with (ex: bench_baseline.json)')
+    suite.add_argument('--threshold', type=float, default=0.25,
+                       help='Fail when a median time grows by more than this fraction of the baseline')
+    suite.set_defaults(run=run_suite)
+
+    args = parser.parse_args()
+    sys.exit( args.run(args) )
+
+
+if __name__ == '__main__':
+    main()
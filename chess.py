@@ -1,22 +1,38 @@
 import argparse
+import array
+import asyncio
+import concurrent.futures
+import itertools
 import math
+import mmap
+import os
 import random
-from queue import Queue
+import signal
+import stat
+import struct
+from collections import deque
 import heapq
-
-# This program allows the user to specify a chess piece (Queen, Rook, or Knight) and
-#  a position on a standard chess board and will do run one of three modes as chosen
-#  by the user. 
+import json
+import sys
+import threading
+import time
+
+# This program allows the user to specify a chess piece (Queen, Rook, Knight,
+#  Bishop, King, or one of the fairy pieces registered with register_piece)
+#  and a position on a standard chess board, and will run one of three modes
+#  as chosen by the user.
 #  Standard mode returns a list of all the potential board positions the given piece
 #  could advance to, with one move, from the given position, with the assumption
 #  there are no other pieces on the board.
-#  In Target mode, the program randomly places 8 enemy pawns on the board and prints
-#  the minimum set of moves it takes the user's piece to reach the most distant tile
-#  from the starting position, capturing pawns if necessary. This mode implements a
-#  queue-based Breadth-first search.
-#  In Collector mode, the program randomly places 8 enemy pawns on the board and
-#  prints the minimum set of moves it takes the user's peice to caputure all of the
-#  opposing pawns. This mode implements a priority queue-based Breadth-first search.
+#  In Target mode, the program randomly places enemy pawns on the board (8 by default,
+#  or --pawns, up to the number of free squares) and prints the minimum set of moves
+#  it takes the user's piece to reach the most distant tile from the starting
+#  position, capturing pawns if necessary. This mode implements a queue-based
+#  Breadth-first search.
+#  In Collector mode, the program randomly places enemy pawns on the board (as many
+#  as in Target mode) and prints the minimum set of moves it takes the user's peice to
+#  caputure all of the opposing pawns. This mode implements a priority queue-based
+#  Breadth-first search.
 #
 # @author Marco Bohorquez
 
@@ -43,6 +59,36 @@ chess_columns_Na = {1: 'a',
                 }
 
 
+# Squares are numbered from 0 (a1) to 63 (h8) along each row, so
+#  square = (row-1)*8 + (column-1). A set of squares (occupancy, move set)
+#  is a bitboard: a 64-bit integer where bit n is set if square n is in
+#  the set. Algebraic strings like 'e4' are only used for input/output.
+FULL_BOARD = (1 << 64) - 1
+
+# (column, row) steps for the knight's jumps and the eight sliding directions
+#  (N, NE, E, SE, S, SW, W, NW), which index RAY_TABLE below
+QUEEN_DIRECTIONS = ((0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1))
+KNIGHT_JUMPS = ((1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2))
+
+# the rook's and the bishop's sliding directions
+ORTHOGONAL_DIRECTIONS = ((0, 1), (1, 0), (0, -1), (-1, 0))
+DIAGONAL_DIRECTIONS = ((1, 1), (1, -1), (-1, -1), (-1, 1))
+
+# a1, h1, a8 and h8
+CORNER_SQUARES = (0, 7, 56, 63)
+
+# counters kept by the searches in a stats dictionary (see new_stats):
+#  popped         squares (or spaces) taken off the queue and expanded
+#  pushed         squares added to the queue
+#  duplicates     moves to squares that had already been reached
+#  max_frontier   largest queue, heap or search layer
+#  movegen_calls  calls to move generation
+SEARCH_COUNTERS = ('popped', 'pushed', 'duplicates', 'max_frontier', 'movegen_calls')
+
+# the most files or ranks a board can have (see BoardGeometry)
+MAX_BOARD_SIZE = 256
+
+
 
 # The main method validates user input, creates a chess piece,
 #  and will run one of three modes within the program: 
@@ -51,17 +97,127 @@ def main():
 
     # read and parse user input
     parser = argparse.ArgumentParser(description='Process chess input.')
-    parser.add_argument('--piece', required=True, help='Type of chess piece')
-    parser.add_argument('--position', required=True, help='Starting position of chess piece')
+    parser.add_argument('--piece', help='Type of chess piece')
+    parser.add_argument('--position', help='Starting position of chess piece')
+    parser.add_argument('--table-cache', help='File to load/save the sliding move tables')
+    parser.add_argument('--batch', metavar='FILE',
+                        help='Solve the JSONL scenarios in FILE ("-" for stdin) and print one JSON result per line')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Batch and server modes: number of worker processes')
+    parser.add_argument('--chunk-size', type=int, default=64,
+                        help='Batch mode: number of scenarios sent to a worker at a time')
+    parser.add_argument('--unordered', action='store_true',
+                        help='Batch mode: write results as they finish instead of in input order')
+    parser.add_argument('--serve', metavar='ADDRESS',
+                        help='Run a solver server on a Unix socket path, or a TCP port or host:port')
 
     # create mutually exclusive target and collect modes
     modes = parser.add_mutually_exclusive_group()
     modes.add_argument('--target', action='store_true', help='Enable Target mode')
     modes.add_argument('--collect', action='store_true', help='Enable Collect mode')
+    parser.add_argument('--bidirectional', action='store_true',
+                        help='Target mode: search from both the start and the target')
+    parser.add_argument('--solver', choices=('astar', 'heldkarp', 'anytime', 'heuristic', 'pq'),
+                        help='Collect mode solver: astar or heldkarp (both exact), anytime (best found within a budget), '
+                             'heuristic (fast, for many pawns), or pq (original priority queue search)')
+    parser.add_argument('--time-budget', type=float, metavar='SECONDS',
+                        help='Collect mode: stop the anytime solver after SECONDS and print the best solution found')
+    parser.add_argument('--node-budget', type=int, metavar='N',
+                        help='Collect mode: stop the anytime solver after expanding N search states')
+    parser.add_argument('--pawns', type=int, default=8, help='Number of pawns to place (0-63 on the 8x8 board)')
+    parser.add_argument('--seed', type=int, help='Random seed for placing pawns, to repeat a board')
+    parser.add_argument('--generate', type=int, metavar='N',
+                        help='Print N random scenarios as JSON lines for --batch, instead of solving one')
+    parser.add_argument('--stats', action='store_true',
+                        help='Target and Collect modes: print search counters and timings')
+    parser.add_argument('--board', default='8x8', metavar='FILESxRANKS',
+                        help='Board size, for example 12x10 (8x8 by default)')
+    parser.add_argument('--tablebase', action='append', default=[], metavar='FILE',
+                        help='Load an empty-board distance tablebase (can be given once per board size)')
+    parser.add_argument('--precompute', metavar='FILE',
+                        help='Write a distance tablebase for --board (and --piece, or every piece) to FILE')
     args = parser.parse_args()
 
+    try:
+        geometry = parse_board_size(args.board)
+    except ValueError as error:
+        parser.error(str(error))
+    if not 0 <= args.pawns <= geometry.size - 1:
+        parser.error('--pawns must be between 0 and {}'.format(geometry.size - 1))
+    if not geometry.standard and args.solver == 'pq':
+        parser.error('--solver pq only works on the 8x8 board')
+
+    # a budget only makes sense for the anytime solver, which it picks by default
+    budgeted = args.time_budget is not None or args.node_budget is not None
+    if args.solver is None:
+        args.solver = 'anytime' if budgeted else 'astar'
+    elif budgeted and args.solver != 'anytime':
+        parser.error('--time-budget and --node-budget only work with --solver anytime')
+    if args.time_budget is not None and not 0 < args.time_budget < float('inf'):
+        parser.error('--time-budget must be a positive number of seconds')
+    if args.node_budget is not None and args.node_budget < 0:
+        parser.error('--node-budget can not be negative')
+
+    # load the sliding move tables from the cache file if one was given
+    if args.table_cache:
+        load_sliding_tables(args.table_cache)
+
+    # write a tablebase and stop
+    if args.precompute:
+        if args.piece is not None and args.piece.upper() not in PIECE_CLASSES:
+            parser.error('chess piece "{}" not accepted'.format(args.piece))
+        try:
+            write_tablebase(args.precompute, geometry, [args.piece] if args.piece else None)
+        except ValueError as error:
+            parser.error(str(error))
+        print('Wrote {} ({} bytes).'.format(args.precompute, os.path.getsize(args.precompute)))
+        return
+
+    for path in args.tablebase:
+        try:
+            load_tablebase(path)
+        except (OSError, ValueError) as error:
+            parser.error('could not load tablebase {}: {}'.format(path, error))
+
+    # the server reads scenarios from its connections until it is stopped
+    if args.serve:
+        try:
+            parse_address(args.serve)
+        except ValueError as error:
+            parser.error(str(error))
+        serve(args.serve, args.workers, args.table_cache, args.tablebase)
+        return
+
+    # batch mode reads the piece and position of each scenario from its input
+    if args.batch:
+        batch_options = { 'workers': args.workers,
+                          'ordered': not args.unordered,
+                          'chunk_size': max(args.chunk_size, 1),
+                          'table_cache': args.table_cache,
+                          'tablebases': args.tablebase }
+        if args.batch == '-':
+            run_batch(sys.stdin, **batch_options)
+        else:
+            with open(args.batch) as batch_file:
+                run_batch(batch_file, **batch_options)
+        return
+
+    # print random scenarios, with the given piece and position if any
+    if args.generate is not None:
+        if args.piece is not None and args.piece.upper() not in PIECE_CLASSES:
+            parser.error('chess piece "{}" not accepted'.format(args.piece))
+        if args.position is not None and not geometry.is_valid_position(args.position):
+            parser.error('position {} not accepted'.format(args.position))
+        write_scenarios(args.generate, args.pawns, args.seed, args.piece, args.position,
+                        'target' if args.target else 'collect' if args.collect else 'standard',
+                        geometry=geometry)
+        return
+
+    if args.piece is None or args.position is None:
+        parser.error('the following arguments are required: --piece, --position')
+
     # create tuple for validating chess piece
-    pieces_allowed = ('QUEEN', 'ROOK', 'KNIGHT')
+    pieces_allowed = tuple(PIECE_CLASSES)
 
     # validate chess piece
     valid_piece = False
@@ -71,7 +227,7 @@ def main():
         valid_piece = True
 
     # validate position
-    valid_position = is_valid_position( vars(args).get('position') )
+    valid_position = geometry.is_valid_position( vars(args).get('position') )
     if not valid_position:
         print('Position {} not accepted. Please try again.'.format(vars(args).get('position')))
 
@@ -79,228 +235,793 @@ def main():
     if valid_piece and valid_position:
 
         # create the specified chess piece
-        if vars(args).get('piece').upper() == 'QUEEN':
-            my_chess_piece = Queen(vars(args).get('position'))
-        elif vars(args).get('piece').upper() == 'ROOK':
-            my_chess_piece = Rook(vars(args).get('position'))
-        elif vars(args).get('piece').upper() == 'KNIGHT':
-            my_chess_piece = Knight(vars(args).get('position'))
+        solver = Solver(args.piece, geometry)
+        my_chess_piece = solver.piece(args.position)
+
+        # a seed makes the pawn placement repeatable
+        rng = random.Random(args.seed) if args.seed is not None else None
+
+        # search counters and timings are only collected with --stats
+        stats = new_stats() if args.stats else None
 
         # run target or collect mode if specifcied, else run standard mode
         if args.target:
-            target_mode(my_chess_piece)
+            target_mode(my_chess_piece, args.bidirectional, args.pawns, rng, stats)
         elif args.collect:
-            collector_mode(my_chess_piece)
+            collector_mode(my_chess_piece, args.solver, args.pawns, rng, stats, args.time_budget, args.node_budget)
         else:
-            possible_moves = ', '.join(my_chess_piece.calculate_possible_moves())
+            possible_moves = ', '.join( solver.moves(args.position) )
             print(possible_moves)
 
+        if stats is not None and (args.target or args.collect):
+            print_stats(stats)
+
 
 # This method runs Target mode where we place our chess piece,
-#  place 8 pawns randomly on the board, and calculate the minimum
+#  place pawns randomly on the board, and calculate the minimum
 #  set of moves it takes for our piece to get to the farthest
-#  space on the board.
-def target_mode(my_piece):
-    
+#  space on the board. If bidirectional is True, the search runs from
+#  both ends and reports how many spaces each side expanded. pawns
+#  (the number of pawns, 0 up to the number of free squares) and rng
+#  are passed to set_pawns. If stats is a dictionary from
+#  new_stats, the search counters and the time spent on each phase
+#  are added to it. The board is the piece's board (see BoardGeometry).
+#  The search itself is Solver.target; this method places the pawns and
+#  prints the board and the result.
+def target_mode(my_piece, bidirectional=False, pawns=8, rng=None, stats=None):
+
+    started = time.perf_counter()
+    solver = Solver(my_piece.piece_type, my_piece.geometry)
+
     # create a new chessboard
-    chessboard = new_board()
+    chessboard = new_board(solver.geometry)
     
     # place 'Q','R', or 'K' on the board
     chessboard[my_piece.column-1][my_piece.row-1] = my_piece.icon
     
-    # randomly generate 8 pawns and place them on the board
-    opp_pieces = set_pawns(chessboard)
-    
+    # randomly generate the pawns and place them on the board
+    opp_pieces = set_pawns(chessboard, pawns, rng)
+
+    # build the move tables now, so they are timed as setup
+    solver.prepare()
+    searching = time.perf_counter()
+
+    # calculate the minimum number of moves to the farthest space
+    result = solver.target(my_piece.position, opp_pieces, bidirectional=bidirectional, stats=stats)
+    printing = time.perf_counter()
+
     print('')
     print_board(chessboard)
-    
-    # calculate farthest space from current position
-    farthest = get_farthest(my_piece)
-    print('\nFarthest space from current position: {}\tDistance: {:.2f}'.format(farthest[0], farthest[1]))
-    
-    # create the start and target spaces for BFS
-    start = Space( my_piece.column, my_piece.row, 0)
-    target = Space( chess_columns_aN.get(farthest[0][0]), int(farthest[0][1]), -1 )
-    
-    # calculate and print minimum number of moves from start to target
-    number_of_moves = BFS(start, target, my_piece.piece_type, opp_pieces)
-    print('Minimum # of {} moves from {} to {}: {}'.format(my_piece.piece_type, my_piece.position, farthest[0], number_of_moves))
+    print('\nFarthest space from current position: {}\tDistance: {:.2f}'.format(result['target'], result['distance']))
+
+    # print minimum number of moves from start to target
+    print('Minimum # of {} moves from {} to {}: {}'.format(my_piece.piece_type, my_piece.position, result['target'], result['min_moves']))
+
+    if bidirectional:
+        print('Spaces expanded forward: {}\tbackward: {}'.format(result['expanded_forward'], result['expanded_backward']))
+    else:
+        # print the space that takes the most moves to reach
+        print('Farthest space by # of {} moves: {}\tMoves: {}'.format(my_piece.piece_type, result['farthest_by_moves'], result['farthest_moves']))
+
+    if stats is not None:
+        add_timings(stats, setup=searching - started, search=printing - searching, output=time.perf_counter() - printing)
 
     # return 1 after successful run (for testing)
     return 1
 
 
 # This method runs Collector mode where we place our chess piece,
-#  place 8 pawns randomly on the board, and calculate the minimum
+#  place pawns randomly on the board, and calculate the minimum
 #  set of moves it takes for our piece to capture all the opposing
-#  pieces.
-def collector_mode(my_piece):
-    
+#  pieces. The solver is 'astar' (A* search over captures), 'heldkarp'
+#  (dynamic program over capture orders), 'anytime' (the best solution found
+#  within time_budget seconds or node_budget search states, see
+#  anytime_collect), 'heuristic' (a short capture order for many pawns, see
+#  heuristic_collect) or 'pq' (the original priority queue search, BFS_pq).
+#  Both 'astar' and 'heldkarp' are exact.
+#  pawns (the number of pawns, 0 up to the number of free squares) and
+#  rng are passed to set_pawns, and stats works as in target_mode.
+#  The 'pq' solver only works on the 8x8 board.
+#  The search itself is Solver.collect. While the anytime solver runs, Ctrl-C
+#  (SIGINT) or SIGTERM stops it and the best solution so far is printed.
+def collector_mode(my_piece, solver='astar', pawns=8, rng=None, stats=None, time_budget=None, node_budget=None):
+
+    started = time.perf_counter()
+    piece_solver = Solver(my_piece.piece_type, my_piece.geometry)
+    if solver == 'pq' and not piece_solver.geometry.standard:
+        raise ValueError('The pq solver only works on the 8x8 board.')
+
     # create a new chessboard
-    chessboard = new_board()
+    chessboard = new_board(piece_solver.geometry)
     
     # place 'Q','R', or 'K' on the board
     chessboard[my_piece.column-1][my_piece.row-1] = my_piece.icon
     
-    # randomly generate 8 pawns and place them on the board
-    opp_pieces = set_pawns(chessboard)
-    
+    # randomly generate the pawns and place them on the board
+    opp_pieces = set_pawns(chessboard, pawns, rng)
+
+    # build the move tables now, so they are timed as setup
+    piece_solver.prepare()
+    searching = time.perf_counter()
+
+    # Ctrl-C (or SIGTERM, from a scheduler or timeout) stops the anytime
+    #  solver instead of the program (signal handlers can only be set from
+    #  the main thread)
+    stop = None
+    if solver == 'anytime' and threading.current_thread() is threading.main_thread():
+        stop = threading.Event()
+        previous_handlers = { signal_number: signal.signal(signal_number, lambda signal_number, frame: stop.set())
+                              for signal_number in (signal.SIGINT, signal.SIGTERM) }
+
+    # calculate minimum moves to capture all opp pieces (pieces that keep to
+    #  one colour, like the bishop, may not reach every pawn)
+    try:
+        result = piece_solver.collect(my_piece.position, opp_pieces, solver, stats,
+                                      time_budget=time_budget, node_budget=node_budget, stop=stop)
+    except ValueError:
+        result = None
+    finally:
+        if stop is not None:
+            for signal_number, handler in previous_handlers.items():
+                signal.signal(signal_number, handler)
+    printing = time.perf_counter()
+
     print('')
     print_board(chessboard)
-    
-    # create the start space for BFS_pq
-    start = Space( my_piece.column, my_piece.row, 0, [], opp_pieces )
-    
-    # calculate and print minimum moves to capture all opp pieces
-    min_moves = BFS_pq(start, my_piece.piece_type, opp_pieces)
-    print('Minimum # of {} moves: {}'.format(my_piece.piece_type, min_moves[0]))
-    print('Moves: ' + str(min_moves[1]))
+
+    # print minimum moves to capture all opp pieces
+    if result is None:
+        print('The {} can not capture every pawn.'.format(my_piece.piece_type))
+    elif result.get('optimal', True):
+        print('Minimum # of {} moves: {}'.format(my_piece.piece_type, result['min_moves']))
+        print('Moves: ' + str(result['path']))
+    else:
+        print('Fewest # of {} moves found: {}\tLower bound: {}'.format(my_piece.piece_type, result['min_moves'], result['lower_bound']))
+        print('Moves: ' + str(result['path']))
+
+    if stats is not None:
+        add_timings(stats, setup=searching - started, search=printing - searching, output=time.perf_counter() - printing)
 
     # return 1 after successful run (for testing)
     return 1
 
 
+# This class solves problems for one piece type on one board size, without
+#  printing anything: it is the library version of the program's modes, and
+#  the modes, batch mode and the server are built on it. Positions and pawns
+#  are given as strings (ex: 'e4') and every result is a dictionary or list
+#  of them. Invalid piece types, positions and pawns raise ValueError.
+#  board is a BoardGeometry or a size such as '12x10' (8x8 by default).
+#  A Solver keeps no state between calls, and the move tables it shares
+#  with every other Solver are built under a lock (see TABLES_LOCK), so one
+#  Solver can be used from many threads at once.
+#
+# Example:
+#  solver = Solver('ROOK')
+#  solver.collect('a1', ['a8', 'h8'])  ->  {'min_moves': 2, 'path': ['a1', 'a8', 'h8']}
+class Solver:
+
+    def __init__(self, piece_type, board=None):
+
+        self.piece_type = str(piece_type).upper()
+        if self.piece_type not in PIECE_CLASSES:
+            raise ValueError('Chess piece "{}" not accepted.'.format(piece_type))
+
+        if board is None:
+            self.geometry = DEFAULT_GEOMETRY
+        elif isinstance(board, BoardGeometry):
+            self.geometry = board
+        else:
+            self.geometry = parse_board_size(board)
+
+    # This method builds the move tables this solver's searches use, so that
+    #  the first search doesn't pay for them. Calling it is optional.
+    def prepare(self):
+        if self.geometry.standard:
+            if PIECE_SPECS[self.piece_type].slides:
+                ensure_sliding_tables()
+            empty_board_distances(self.piece_type)
+
+    # This method returns the chess piece at position.
+    def piece(self, position):
+
+        if not self.geometry.is_valid_position(position):
+            raise ValueError('Position {} not accepted.'.format(position))
+        return PIECE_CLASSES[self.piece_type](position.lower(), self.geometry)
+
+    # This method returns the bitboard of a list of pawn positions, which must
+    #  be on the board, not repeated, and not on position.
+    def occupancy(self, pawns, position=None):
+        return self.geometry.positions_to_bitboard( self.pawn_positions(pawns, position) )
+
+    # This method returns a list of pawn positions in lower case, checked as
+    #  in occupancy. pawns must be a list (or other iterable) of positions,
+    #  not a single string.
+    def pawn_positions(self, pawns, position=None):
+
+        if isinstance(pawns, (str, bytes)) or not hasattr(pawns, '__iter__'):
+            raise ValueError('Pawns must be a list of positions, not {}.'.format(json.dumps(pawns, default=repr)))
+        pawns = [ str(pos).lower() for pos in pawns ]
+        for pos in pawns:
+            if not self.geometry.is_valid_position(pos) or pos == position or pawns.count(pos) > 1:
+                raise ValueError('Pawn position {} not accepted.'.format(pos))
+        return pawns
+
+    # This method returns the list of positions the piece can move to from
+    #  position in one move, past the given pawns (none by default).
+    def moves(self, position, pawns=()):
+        piece = self.piece(position)
+        return piece.calculate_possible_moves( self.pawn_positions(pawns, piece.position) )
+
+    # This method returns a dictionary with the minimum number of moves from
+    #  position to every position on the board (-1 for positions that can't
+    #  be reached), with the given pawns in the way. stats works as in
+    #  distance_map.
+    def distance_map(self, position, pawns=(), stats=None):
+
+        piece = self.piece(position)
+        distances = self.geometry.distance_map( self.piece_type, piece.square,
+                                                self.occupancy(pawns, piece.position), stats )
+        return { self.geometry.square_name(square): moves for square, moves in enumerate(distances) }
+
+    # This method finds the minimum number of moves from position to target
+    #  (by default the farthest space from position, see get_farthest), with
+    #  the given pawns in the way. It returns a dictionary with the 'target',
+    #  its straight-line 'distance' from position, and 'min_moves' (-1 if it
+    #  can't be reached), plus either the space that takes the most moves to
+    #  reach ('farthest_by_moves') and that number ('farthest_moves'), or,
+    #  with bidirectional, the number of spaces each side of the
+    #  search expanded ('expanded_forward' and 'expanded_backward').
+    def target(self, position, pawns=(), target=None, bidirectional=False, stats=None):
+
+        piece = self.piece(position)
+        occupancy = self.occupancy(pawns, piece.position)
+        geometry = self.geometry
+
+        if target is None:
+            target = get_farthest(piece)[0]
+        elif not geometry.is_valid_position(target):
+            raise ValueError('Target position {} not accepted.'.format(target))
+        target = target.lower()
+        target_square = geometry.square_index(target)
+
+        distance = math.dist( [target_square % geometry.files, target_square // geometry.files],
+                              [piece.column - 1, piece.row - 1] )
+        result = {'target': target, 'distance': distance}
+
+        if bidirectional:
+            moves, forward, backward = geometry.bidirectional_search(self.piece_type, piece.square, target_square, occupancy, stats)
+            result.update( {'min_moves': moves, 'expanded_forward': forward, 'expanded_backward': backward} )
+
+        else:
+            # calculate the minimum number of moves to every space in a single search
+            distances = geometry.distance_map(self.piece_type, piece.square, occupancy, stats)
+            farthest, farthest_moves = geometry.farthest_in_map(distances, piece.square)
+            result.update( {'min_moves': distances[target_square],
+                            'farthest_by_moves': geometry.square_name(farthest),
+                            'farthest_moves': farthest_moves} )
+
+        return result
+
+    # This method finds the minimum number of moves it takes to capture all
+    #  the pawns from position, with the given solver (as in collector_mode).
+    #  It returns a dictionary with 'min_moves' and the 'path' of positions
+    #  visited, starting with position. Pawns that can't all be captured
+    #  raise ValueError. stats works as in the collectors.
+    #  time_budget, node_budget and stop are passed to anytime_collect, and
+    #  only work with the 'anytime' solver. For it and the 'heuristic' solver,
+    #  'min_moves' is the fewest found, and the result also has a proven
+    #  'lower_bound' and whether the moves are 'optimal' (equal to it).
+    def collect(self, position, pawns, solver='astar', stats=None, time_budget=None, node_budget=None, stop=None):
+
+        piece = self.piece(position)
+        pawns = self.pawn_positions(pawns, piece.position)
+        geometry = self.geometry
+
+        if solver != 'anytime' and (time_budget is not None or node_budget is not None):
+            raise ValueError('Budgets only work with the anytime solver.')
+
+        if solver == 'pq':
+            if not geometry.standard:
+                raise ValueError('The pq solver only works on the 8x8 board.')
+            solution = BFS_pq(Space(piece.column, piece.row, 0, [], pawns), self.piece_type, pawns, stats)
+            if not solution:
+                raise ValueError('Pawns can not all be captured.')
+            return {'min_moves': solution[0], 'path': solution[1]}
+
+        if solver not in ('astar', 'heldkarp', 'anytime', 'heuristic'):
+            raise ValueError('Solver {} not accepted.'.format(solver))
+
+        pawn_squares = [ geometry.square_index(pos) for pos in pawns ]
+        if solver in ('anytime', 'heuristic'):
+            if solver == 'heuristic':
+                solution = heuristic_collect(self.piece_type, piece.square, pawn_squares, stats, geometry)
+            else:
+                # a time budget must be a positive number of seconds (NaN
+                #  would never run out), a node budget a whole number
+                if time_budget is not None and ( isinstance(time_budget, bool) or not isinstance(time_budget, (int, float))
+                                                 or not 0 < time_budget < float('inf') ):
+                    raise ValueError('Time budget {} not accepted.'.format(time_budget))
+                if node_budget is not None and (isinstance(node_budget, bool) or not isinstance(node_budget, int) or node_budget < 0):
+                    raise ValueError('Node budget {} not accepted.'.format(node_budget))
+                solution = anytime_collect(self.piece_type, piece.square, pawn_squares, time_budget, node_budget, stop, stats, geometry)
+            if solution is None:
+                raise ValueError('Pawns can not all be captured.')
+            return {'min_moves': solution[0], 'path': [geometry.square_name(square) for square in solution[1]],
+                    'lower_bound': solution[2], 'optimal': solution[0] == solution[2]}
+        if solver == 'heldkarp':
+            solution = held_karp_collect(self.piece_type, piece.square, pawn_squares, stats, geometry)
+        else:
+            solution = astar_collect(self.piece_type, piece.square, pawn_squares, stats, geometry)
+
+        if solution is None:
+            raise ValueError('Pawns can not all be captured.')
+
+        return {'min_moves': solution[0], 'path': [geometry.square_name(square) for square in solution[1]]}
+
+
+
+# This method solves one scenario, given as a dictionary with these keys:
+#   piece     a piece type in PIECE_CLASSES (ex: QUEEN, KNIGHT, AMAZON)
+#   position  starting position of the piece (ex: 'e4')
+#   mode      'standard' (default), 'target' or 'collect'
+#   pawns     list of pawn positions (target and collect modes)
+#   pawn_mask bitboard of pawn squares, instead of pawns
+#   seed      if neither pawns nor pawn_mask is given, pawns are placed
+#             randomly with set_pawns, using this seed if it is given
+#   pawn_count  number of random pawns to place (default 8)
+#   target    target position (target mode, defaults to the farthest space)
+#   solver    collect mode solver, as in collector_mode (default 'astar',
+#             or 'anytime' if a budget is given)
+#   time_budget, node_budget  budgets for the anytime solver (see
+#             anytime_collect); its results, and the heuristic solver's,
+#             also get 'lower_bound' and 'optimal'
+#   stats     if true, the result gets a 'stats' dictionary of search
+#             counters and setup/search timings (see new_stats)
+#   board     board size, files x ranks (default '8x8')
+#   id        copied to the result, to match results with scenarios
+#  A dictionary of results is returned. Invalid scenarios raise ValueError.
+def solve_scenario(scenario):
+
+    piece_type = str( scenario.get('piece', '') ).upper()
+    position = str( scenario.get('position', '') ).lower()
+    mode = scenario.get('mode', 'standard')
+
+    if piece_type not in PIECE_CLASSES:
+        raise ValueError('Chess piece "{}" not accepted.'.format(scenario.get('piece')))
+    solver = Solver( piece_type, scenario.get('board', '8x8') )
+    geometry = solver.geometry
+    my_piece = solver.piece(position)
+
+    result = {'piece': piece_type, 'position': position, 'mode': mode}
+    if 'board' in scenario:
+        result['board'] = '{}x{}'.format(geometry.files, geometry.ranks)
+    if 'id' in scenario:
+        result['id'] = scenario['id']
+
+    if mode == 'standard':
+        result['moves'] = solver.moves(position)
+        return result
+
+    if mode not in ('target', 'collect'):
+        raise ValueError('Mode {} not accepted.'.format(mode))
+
+    # fields of the wrong type (ex: "pawns": 5) are errors in the scenario
+    for key, types in ( ('pawns', list), ('seed', int), ('pawn_count', int), ('target', str) ):
+        if scenario.get(key) is not None and (not isinstance(scenario[key], types) or isinstance(scenario[key], bool)):
+            raise ValueError('{} {} not accepted.'.format(key.capitalize().replace('_', ' '), json.dumps(scenario[key])))
+
+    stats = new_stats() if scenario.get('stats') else None
+    started = time.perf_counter()
+
+    # use the given pawns, or place them randomly around the piece
+    pawns = scenario.get('pawns')
+    if pawns is None and 'pawn_mask' in scenario:
+        pawn_mask = scenario['pawn_mask']
+        if not isinstance(pawn_mask, int) or isinstance(pawn_mask, bool) or not 0 <= pawn_mask <= geometry.full:
+            raise ValueError('Pawn mask {} not accepted.'.format(pawn_mask))
+        pawns = geometry.bitboard_to_positions(pawn_mask)
+
+    if pawns is None:
+        chessboard = new_board(geometry)
+        chessboard[my_piece.column-1][my_piece.row-1] = my_piece.icon
+        rng = random.Random(scenario['seed']) if 'seed' in scenario else None
+        pawns = set_pawns(chessboard, scenario.get('pawn_count', 8), rng)
+    else:
+        pawns = [ str(pos).lower() for pos in pawns ]
+        solver.occupancy(pawns, position)
+
+    result['pawns'] = pawns
+    searching = time.perf_counter()
+
+    if mode == 'target':
+        solution = solver.target(position, pawns, scenario.get('target') or None, stats=stats)
+        for key in ('target', 'min_moves', 'farthest_by_moves', 'farthest_moves'):
+            result[key] = solution[key]
+    else:
+        time_budget = scenario.get('time_budget')
+        node_budget = scenario.get('node_budget')
+        default_solver = 'astar' if time_budget is None and node_budget is None else 'anytime'
+        result.update( solver.collect(position, pawns, scenario.get('solver', default_solver), stats,
+                                      time_budget=time_budget, node_budget=node_budget) )
+
+    if stats is not None:
+        add_timings(stats, setup=searching - started, search=time.perf_counter() - searching)
+        result['stats'] = stats
+
+    return result
+
+
+# This method reads a scenario dictionary from one JSON line. Lines that
+#  aren't JSON objects raise ValueError.
+def read_scenario(line):
+
+    scenario = json.loads(line)
+    if not isinstance(scenario, dict):
+        raise ValueError('Scenario must be a JSON object.')
+    return scenario
+
+
+# This method solves a scenario and returns its JSON result line, with the
+#  given line number. Scenarios that can't be solved get an 'error' result,
+#  so one bad line never stops a batch (TypeError is caught too, for field
+#  types solve_scenario doesn't check).
+def solve_scenario_line(line_number, scenario):
+
+    try:
+        result = solve_scenario(scenario)
+    except (TypeError, ValueError) as error:
+        result = {'error': str(error)}
+
+    result['line'] = line_number
+    return json.dumps(result)
+
+
+# This method solves one line of a batch (see run_batch) and returns its JSON
+#  result line, or None if the line is blank.
+def solve_batch_line(line_number, line):
+
+    line = line.strip()
+    if not line:
+        return None
+
+    try:
+        scenario = read_scenario(line)
+    except ValueError as error:
+        return json.dumps({'error': str(error), 'line': line_number})
+
+    return solve_scenario_line(line_number, scenario)
+
+
+# This method solves a chunk of (line number, line) pairs in a worker process
+#  and returns the list of JSON result lines.
+def solve_batch_chunk(chunk):
+    results = [ solve_batch_line(line_number, line) for line_number, line in chunk ]
+    return [ result for result in results if result is not None ]
+
+
+# This method sets up a batch worker process. The move tables are built once
+#  per worker here, rather than for each scenario. The tablebase files are
+#  mapped by every worker, which all share one copy of them in memory.
+def init_batch_worker(table_cache=None, tablebases=()):
+
+    load_sliding_tables(table_cache)
+    for path in tablebases:
+        load_tablebase(path)
+    for piece_type in PIECE_CLASSES:
+        empty_board_distances(piece_type)
+
+
+# This method writes count random scenarios (see generate_scenarios) to output
+#  as JSON lines that run_batch can read. The piece type is picked at random
+#  for each scenario unless piece_type is given, and every scenario starts
+#  from position if it is given.
+def write_scenarios(count, pawns=8, seed=None, piece_type=None, position=None, mode='standard', output=sys.stdout,
+                    geometry=None):
+
+    # piece types are drawn from their own generator so that the squares
+    #  are the same with and without a fixed piece type
+    piece_rng = random.Random(seed)
+    piece_types = sorted(PIECE_CLASSES)
+    geometry = geometry or DEFAULT_GEOMETRY
+    start = geometry.square_index(position.lower()) if position else None
+
+    for square, pawn_mask in generate_scenarios(count, pawns, seed, start, geometry.size):
+        scenario = {'piece': piece_type.upper() if piece_type else piece_rng.choice(piece_types),
+                    'position': geometry.square_name(square),
+                    'mode': mode,
+                    'pawn_mask': pawn_mask}
+        if not geometry.standard:
+            scenario['board'] = '{}x{}'.format(geometry.files, geometry.ranks)
+        output.write(json.dumps(scenario) + '\n')
+
+
+# This method reads scenarios from a stream of JSON lines (one dictionary per
+#  line, see solve_scenario) and writes one JSON result line to output as each
+#  scenario is solved. Every result has the 'line' number of its scenario.
+#  Scenarios that can't be read or solved produce a result with an 'error'
+#  key, and the batch carries on. Returns the number of scenarios.
+#
+#  With more than one worker, chunks of chunk_size lines are solved in a pool
+#  of worker processes. At most two chunks per worker are read ahead, so
+#  memory stays bounded for any size of input. Results are written in input
+#  order unless ordered is False, in which case each chunk is written as
+#  soon as it is done. Workers load table_cache and the tablebases (a list
+#  of tablebase files) as they start.
+def run_batch(stream, output=sys.stdout, workers=1, ordered=True, chunk_size=64, table_cache=None, tablebases=()):
+
+    count = 0
+    numbered = enumerate(stream, 1)
+
+    # solve one line at a time in this process
+    if workers <= 1:
+        for line_number, line in numbered:
+            result = solve_batch_line(line_number, line)
+            if result is not None:
+                output.write(result + '\n')
+                output.flush()
+                count += 1
+        return count
+
+    def write_results(results):
+        for result in results:
+            output.write(result + '\n')
+        output.flush()
+        return len(results)
+
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=init_batch_worker,
+                                                initargs=(table_cache, tuple(tablebases))) as pool:
+
+        # chunks in flight, oldest first
+        pending = deque()
+
+        while True:
+            chunk = list( itertools.islice(numbered, chunk_size) )
+            if chunk:
+                pending.append( pool.submit(solve_batch_chunk, chunk) )
+
+            # once enough chunks are in flight (or the input has run out),
+            #  write out results before reading more
+            while pending and (len(pending) >= 2 * workers or not chunk):
+                if ordered:
+                    count += write_results( pending.popleft().result() )
+                else:
+                    done, not_done = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        count += write_results( future.result() )
+                    pending = deque(future for future in pending if future in not_done)
+
+            if not chunk:
+                break
+
+    return count
+
+
+# This method reads a server address: a port number or host:port for a TCP
+#  socket, or anything else (a file path) for a Unix socket. It returns
+#  ('tcp', host, port) or ('unix', path). TCP servers listen on localhost
+#  unless a host is given.
+def parse_address(text):
+
+    host, separator, port = text.rpartition(':')
+    if port.isdigit() and ('/' not in text):
+        if not 0 < int(port) < 65536:
+            raise ValueError('Port {} not accepted.'.format(port))
+        return ('tcp', host or '127.0.0.1', int(port))
+
+    if not text:
+        raise ValueError('Address not accepted.')
+    return ('unix', text)
+
+
+# This method removes the Unix socket at path, left by an earlier server.
+#  Anything else at path is left alone.
+def remove_socket(path):
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        os.remove(path)
+
+
+# This class is the solver server started by --serve. Each connection sends
+#  scenarios as JSON lines, in the batch format (see solve_scenario), and
+#  gets one JSON result line back per scenario, in the order they were sent,
+#  numbered by 'line' within the connection. A connection can send more
+#  scenarios without waiting for results.
+#  The move tables are built once, when the server starts, and stay loaded.
+#  Standard and Target mode scenarios on the 8x8 board are solved right
+#  away in the server's event loop, while Collector mode scenarios and
+#  scenarios on other boards (which can take much longer) are sent to a pool
+#  of worker processes, so cheap queries are not held up behind them.
+class SolverServer:
+
+    def __init__(self, workers=1, table_cache=None, tablebases=()):
+
+        init_batch_worker(table_cache, tablebases)
+        self.pool = concurrent.futures.ProcessPoolExecutor( max(workers, 1), initializer=init_batch_worker,
+                                                            initargs=(table_cache, tuple(tablebases)) )
+        self.server = None
+
+        # the worker processes are started on the first job, so start them
+        #  now: a worker started later would hold a copy of every open
+        #  connection, and closing a connection would not end it
+        self.pool.submit(int).result()
+
+    # This method starts listening on address (see parse_address).
+    async def start(self, address):
+
+        address = parse_address(address)
+        if address[0] == 'tcp':
+            self.server = await asyncio.start_server(self.handle_connection, address[1], address[2], limit=2 ** 24)
+        else:
+            remove_socket(address[1])
+            self.server = await asyncio.start_unix_server(self.handle_connection, address[1], limit=2 ** 24)
+        return self.server
+
+    # This method stops listening and shuts down the worker processes, once
+    #  the scenarios they are working on are done.
+    async def close(self):
+
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.pool.shutdown(cancel_futures=True)
+
+    # This method returns the JSON result line of one scenario line. Any
+    #  error while solving it becomes an error result, so the client always
+    #  gets one line back per scenario.
+    async def solve(self, line_number, line):
+
+        try:
+            scenario = read_scenario(line)
+            if scenario.get('mode') != 'collect' and scenario.get('board', '8x8') == '8x8':
+                return solve_scenario_line(line_number, scenario)
+            return await asyncio.get_running_loop().run_in_executor(self.pool, solve_scenario_line,
+                                                                    line_number, scenario)
+        except concurrent.futures.process.BrokenProcessPool:
+            return json.dumps({'error': 'Worker process failed.', 'line': line_number})
+        except Exception as error:
+            return json.dumps({'error': str(error) or type(error).__name__, 'line': line_number})
+
+    # This method serves one connection. Scenarios are started as they are
+    #  read, and a second task writes their results in order. If a result
+    #  can't be written, the connection is closed, which also ends the
+    #  reading.
+    async def handle_connection(self, reader, writer):
+
+        pending = asyncio.Queue()
+
+        async def write_results():
+            while True:
+                result = await pending.get()
+                if result is None:
+                    break
+                try:
+                    writer.write( (await result).encode() + b'\n' )
+                    await writer.drain()
+                except (ConnectionError, OSError):
+                    writer.close()
+                    break
+
+        writing = asyncio.ensure_future( write_results() )
+        line_number = 0
+
+        try:
+            while not writing.done():
+                line = await reader.readline()
+                if not line:
+                    break
+                line_number += 1
+                line = line.decode('utf-8', 'replace').strip()
+                if line:
+                    await pending.put( asyncio.ensure_future(self.solve(line_number, line)) )
+
+            await pending.put(None)
+            await writing
+
+        except (ConnectionError, ValueError):
+            # the client went away, or sent a line longer than the limit
+            writing.cancel()
+
+        finally:
+            # scenarios whose results will never be written
+            while not pending.empty():
+                result = pending.get_nowait()
+                if result is not None:
+                    result.cancel()
+            writer.close()
+
+
+# This method runs a SolverServer on address until it gets SIGINT or SIGTERM.
+def serve(address, workers=1, table_cache=None, tablebases=()):
+
+    async def run():
+        solver_server = SolverServer(workers, table_cache, tablebases)
+        await solver_server.start(address)
+
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, stopping.set)
+
+        print('Serving on {}'.format(address), file=sys.stderr, flush=True)
+        try:
+            await stopping.wait()
+        finally:
+            await solver_server.close()
+
+    try:
+        asyncio.run( run() )
+    finally:
+        address = parse_address(address)
+        if address[0] == 'unix':
+            remove_socket(address[1])
+
+
 
 # This is a base class for the chess pieces in this program.
-# Its attributes are position, column, and row. It has two
+# Its attributes are position, column, row, and square. It has two
 # class variables, piece type and icon.
 class ChessPiece:
 
     piece_type = ''
     icon = ''
     
-    def __init__(self, position):
+    def __init__(self, position, geometry=None):
         
         # position is a string (ex:'e4')
         self.position = position
+
+        # geometry is the BoardGeometry of the board the piece is on
+        #  (the standard 8x8 board by default)
+        self.geometry = geometry if geometry is not None else DEFAULT_GEOMETRY
         
-        # column/row are integers from 1-8
-        self.column = chess_columns_aN.get(position[0])
-        self.row = int(position[1])
+        # column/row are integers from 1-8 (up to the board's files/ranks)
+        if self.geometry.standard:
+            self.column = chess_columns_aN.get(position[0])
+            self.row = int(position[1])
+        else:
+            file, rank = self.geometry.parse_position(position)
+            self.column = file + 1
+            self.row = rank + 1
+
+        # square is the bitboard index of the position (0-63 on the 8x8 board)
+        self.square = (self.row - 1) * self.geometry.files + self.column - 1
+
+    # This method returns the bitboard of moves that can be targeted by this
+    #  piece, given a bitboard of occupied (opposing piece) squares.
+    def calculate_moves(self, occupancy=0):
+        if self.geometry.standard:
+            return generate_moves(self.piece_type, self.square, occupancy)
+        return self.geometry.moves(self.piece_type, self.square, occupancy)
+
+    # This method returns a list of moves that can be targeted by this
+    #  piece. It is a thin wrapper around calculate_moves for callers that
+    #  work with lists of positions such as 'e4'.
+    def calculate_possible_moves(self, opp_pieces=[]):
+        if self.geometry.standard:
+            return bitboard_to_positions( self.calculate_moves( positions_to_bitboard(opp_pieces) ) )
+        return self.geometry.bitboard_to_positions( self.calculate_moves( self.geometry.positions_to_bitboard(opp_pieces) ) )
 
 
 # The Queen can target spaces in its file(column), row, or diagonals.
+#  Its 'line of sight' ends if there is an opposing piece in the way.
 class Queen(ChessPiece):
 
     piece_type = 'QUEEN' 
     icon = 'Q'
     
-    def __init__(self, position):
-        super().__init__(position)
-    
-    # This method returns a list of moves that can be targeted by this
-    #  Queen. Based on the provided list of opposing pieces, this Queen's
-    #  'line of sight' ends if there is an opposing piece in the way.
-    def calculate_possible_moves(self, opp_pieces=[]):
-
-        # the list of possible moves to be returned
-        moves = []
-        
-        # add spaces North of Queen until end of board or pawn is reached
-        for x in range (self.row+1, 9):
-            space = '{}{}'.format( chess_columns_Na.get(self.column), x)
-            moves.append(space)
-            if space in opp_pieces:
-                break
-            
-        # add spaces NE of Queen until end of board or pawn is reached
-        for x in range( 1, 9 - max(self.column, self.row) ) :
-            space = '{}{}'.format( chess_columns_Na.get(self.column+x), self.row+x )
-            moves.append(space)
-            if space in opp_pieces:
-                break
-            
-        # add spaces East of Queen until end of board or pawn is reached
-        for x in range (self.column+1, 9):
-            space = '{}{}'.format( chess_columns_Na.get(x), self.row )
-            moves.append(space)
-            if space in opp_pieces:
-                break
-            
-        # add spaces SE of Queen until end of board or pawn is reached
-        for x in range( 1, min(8-self.column+1, self.row) ):
-            space = '{}{}'.format(chess_columns_Na.get(self.column+x), self.row-x)
-            moves.append(space)
-            if space in opp_pieces:
-                break
-            
-        # add spaces South of Queen until end of board or pawn is reached
-        for x in range (self.row-1, 0, -1):
-            space = '{}{}'.format( chess_columns_Na.get(self.column), x)
-            moves.append(space)
-            if space in opp_pieces:
-                break
-            
-        # add spaces SW of Queen until end of board or pawn is reached
-        for x in range( 1, min(self.column, self.row) ):
-            space = '{}{}'.format( chess_columns_Na.get(self.column-x), self.row-x)
-            moves.append(space)
-            if space in opp_pieces:
-                break
-        
-        # add spaces West of Queen until end of board or pawn is reached
-        for x in range (self.column-1, 0, -1):
-            space = '{}{}'.format( chess_columns_Na.get(x), self.row )
-            moves.append(space)
-            if space in opp_pieces:
-                break
-        
-        # add spaces NW of Queen until end of board or pawn is reached
-        for x in range(1, min(self.column, 9-self.row)):
-            space = '{}{}'.format( chess_columns_Na.get(self.column-x), self.row+x)
-            moves.append(space)
-            if space in opp_pieces:
-                break
-            
-        return moves
+    def __init__(self, position, geometry=None):
+        super().__init__(position, geometry)
 
 
 # The Rook can target spaces in its file(column) or row.
+#  Its 'line of sight' ends if there is an opposing piece in the way.
 class Rook(ChessPiece):
 
     piece_type = 'ROOK'
     icon = 'R'
     
-    def __init__(self, position):
-        super().__init__(position)
-    
-    # This method returns a list of moves that can be targeted by this
-    #  Rook. Based on the provided list of opposing pieces, this Rook's
-    #  'line of sight' ends if there is an opposing piece in the way.
-    def calculate_possible_moves(self, opp_pieces=[]):
-
-        # the list of possible moves to be returned
-        moves = []
-        
-        # add spaces North of Rook until end of board or pawn is reached
-        for x in range (self.row+1,9):
-            space = '{}{}'.format( chess_columns_Na.get(self.column), x)
-            moves.append(space)
-            if space in opp_pieces:
-                break
-            
-        # add spaces East of Rook until end of board or pawn is reached
-        for x in range (self.column+1,9):
-            space = '{}{}'.format( chess_columns_Na.get(x), self.row )
-            moves.append(space)
-            if space in opp_pieces:
-                break
-            
-        # add spaces South of Rook until end of board or pawn is reached
-        for x in range (self.row-1, 0, -1):
-            space = '{}{}'.format( chess_columns_Na.get(self.column), x)
-            moves.append(space)
-            if space in opp_pieces:
-                break
-        
-        # add spaces West of Rook until end of board or pawn is reached
-        for x in range (self.column-1, 0, -1):
-            space = '{}{}'.format( chess_columns_Na.get(x), self.row )
-            moves.append(space)
-            if space in opp_pieces:
-                break
-            
-        return moves
+    def __init__(self, position, geometry=None):
+        super().__init__(position, geometry)
 
 
 # The Knight can move two squares vertically and one square horizontally
@@ -311,31 +1032,1059 @@ class Knight(ChessPiece):
     piece_type = 'KNIGHT'
     icon = 'K'
     
-    def __init__(self, position):
-        super().__init__(position)
-        
-    # This method returns a list of moves that can be targeted by this
-    #  Knight. The knight can jump over other pieces so its movement is
-    #  not 'blocked' by other pieces.
-    def calculate_possible_moves(self, opp_pieces=[]):
+    def __init__(self, position, geometry=None):
+        super().__init__(position, geometry)
+
+
+# The Bishop can target spaces in its diagonals.
+#  Its 'line of sight' ends if there is an opposing piece in the way.
+class Bishop(ChessPiece):
+
+    piece_type = 'BISHOP'
+    icon = 'B'
+
+    def __init__(self, position, geometry=None):
+        super().__init__(position, geometry)
+
+
+# The King can move one square in any direction.
+#  (It is shown as 'G' on the board, since 'K' is the Knight.)
+class King(ChessPiece):
+
+    piece_type = 'KING'
+    icon = 'G'
+
+    def __init__(self, position, geometry=None):
+        super().__init__(position, geometry)
+
+
+# chess piece classes by piece type (see also register_piece, which adds a
+#  class for every other piece type it registers)
+PIECE_CLASSES = {'QUEEN': Queen, 'ROOK': Rook, 'KNIGHT': Knight, 'BISHOP': Bishop, 'KING': King}
+
+
+# This method returns the bitboard of every square from square to the edge
+#  of the board in the given (column, row) direction, not including square.
+def build_ray(square, direction):
+
+    ray = 0
+    dc, dr = direction
+    c = square % 8 + dc
+    r = square // 8 + dr
+
+    while 0 <= c < 8 and 0 <= r < 8:
+        ray |= 1 << (r * 8 + c)
+        c += dc
+        r += dr
+
+    return ray
+
+
+# This method returns the bitboard of squares a knight can target from square.
+def build_knight_moves(square):
+
+    moves = 0
+    column = square % 8
+    row = square // 8
+
+    for dc, dr in KNIGHT_JUMPS:
+        c = column + dc
+        r = row + dr
+        if 0 <= c < 8 and 0 <= r < 8:
+            moves |= 1 << (r * 8 + c)
+
+    return moves
+
+
+# Move tables, built once when the module is loaded.
+#  KNIGHT_TABLE[square] is the bitboard of the knight's targets from square.
+#  RAY_TABLE[d][square] is the ray from square in direction QUEEN_DIRECTIONS[d].
+KNIGHT_TABLE = [build_knight_moves(square) for square in range(64)]
+RAY_TABLE = [[build_ray(square, direction) for square in range(64)] for direction in QUEEN_DIRECTIONS]
+
+# Rays that run toward higher squares (N, NE, E, NW) meet their first blocker
+#  at the lowest set bit; rays that run toward lower squares (SE, S, SW, W)
+#  meet it at the highest set bit.
+ROOK_RAYS = ( (RAY_TABLE[0], RAY_TABLE[2]), (RAY_TABLE[4], RAY_TABLE[6]) )
+BISHOP_RAYS = ( (RAY_TABLE[1], RAY_TABLE[7]), (RAY_TABLE[3], RAY_TABLE[5]) )
+QUEEN_RAYS = ( ROOK_RAYS[0] + BISHOP_RAYS[0], ROOK_RAYS[1] + BISHOP_RAYS[1] )
+
+
+# This method returns the bitboard of squares a piece sliding along the given
+#  rays can target from square. Each ray is cut just past its first occupied
+#  square, so the blocking piece can be captured but not jumped.
+def sliding_moves(square, occupancy, rays):
+
+    moves = 0
+    positive_rays, negative_rays = rays
+
+    for table in positive_rays:
+        ray = table[square]
+        blockers = ray & occupancy
+        if blockers:
+            ray ^= table[ (blockers & -blockers).bit_length() - 1 ]
+        moves |= ray
+
+    for table in negative_rays:
+        ray = table[square]
+        blockers = ray & occupancy
+        if blockers:
+            ray ^= table[ blockers.bit_length() - 1 ]
+        moves |= ray
+
+    return moves
+
+
+# This method returns the bitboard of squares a knight can target from square.
+#  Knights jump, so the occupancy is ignored.
+def knight_moves(square, occupancy=0):
+    return KNIGHT_TABLE[square]
+
+
+# This method returns the bitboard of squares whose occupancy can change a
+#  slider's moves from square: every square on its rays except the last one,
+#  since a piece on the edge of the board never hides anything behind it.
+def build_relevant_mask(square, rays):
+
+    mask = 0
+    positive_rays, negative_rays = rays
+
+    # drop the last (highest) square of rays running toward higher squares
+    for table in positive_rays:
+        ray = table[square]
+        if ray:
+            ray ^= 1 << (ray.bit_length() - 1)
+        mask |= ray
+
+    # drop the last (lowest) square of rays running toward lower squares
+    for table in negative_rays:
+        ray = table[square]
+        mask |= ray ^ (ray & -ray)
+
+    return mask
+
+
+# Relevant occupancy masks for the rook and bishop, per square.
+ROOK_MASKS = [build_relevant_mask(square, ROOK_RAYS) for square in range(64)]
+BISHOP_MASKS = [build_relevant_mask(square, BISHOP_RAYS) for square in range(64)]
+
+# Occupancy-indexed attack tables: ROOK_ATTACKS[square] maps every subset of
+#  ROOK_MASKS[square] to the rook's moves with that occupancy (same for the
+#  bishop). These are built on first use by load_sliding_tables().
+ROOK_ATTACKS = None
+BISHOP_ATTACKS = None
+
+# empty-board distance tables by piece type, see empty_board_distances()
+EMPTY_BOARD_DISTANCES = {}
+
+# header of a sliding table cache file: a magic string and a version, bump
+#  the version when the table layout changes
+SLIDING_TABLES_MAGIC = b'CHESSSLT'
+SLIDING_TABLES_VERSION = 2
+SLIDING_TABLES_HEADER = struct.Struct('<8sI')
+
+# loaded distance tablebases by (files, ranks), see load_tablebase()
+TABLEBASES = {}
+
+# held while the tables above (and board geometries) are built or loaded,
+#  so threads that need a table at the same time build it only once
+TABLES_LOCK = threading.RLock()
+
+
+# This method returns a list with one dictionary per square, mapping each
+#  subset of the square's relevant mask to the slider's moves.
+def build_attack_table(masks, rays):
+
+    attacks = []
+
+    for square in range(64):
+        table = {}
+        for subset in mask_subsets(masks[square]):
+            table[subset] = sliding_moves(square, subset, rays)
+        attacks.append(table)
+
+    return attacks
+
+
+# This method yields every subset of the bitboard mask, starting with 0 (the
+#  "carry-rippler" trick). The order is always the same for the same mask.
+def mask_subsets(mask):
+
+    subset = 0
+    while True:
+        yield subset
+        subset = (subset - mask) & mask
+        if subset == 0:
+            break
+
+
+# This method builds the rook and bishop attack tables. If a cache_path is
+#  given, the tables are loaded from that file when it holds a valid copy,
+#  and written to it otherwise, so later runs skip the build. The file holds
+#  a header (SLIDING_TABLES_HEADER) and then the moves of every table entry
+#  as little-endian 64-bit numbers, in the order of mask_subsets, so
+#  loading it only reads numbers.
+def load_sliding_tables(cache_path=None):
+    with TABLES_LOCK:
+        build_sliding_tables(cache_path)
+
+
+# This method returns once the rook and bishop attack tables are built,
+#  building them if no thread has yet.
+def ensure_sliding_tables():
+    if ROOK_ATTACKS is None:
+        with TABLES_LOCK:
+            if ROOK_ATTACKS is None:
+                build_sliding_tables()
+
+
+# This method does the work of load_sliding_tables, with TABLES_LOCK held.
+def build_sliding_tables(cache_path=None):
+
+    global ROOK_ATTACKS, BISHOP_ATTACKS
+
+    masks = [ROOK_MASKS, BISHOP_MASKS]
+    tables = None
+
+    # try the cache first
+    if cache_path is not None and os.path.exists(cache_path):
+        try:
+            tables = read_sliding_tables(cache_path, masks)
+        except (OSError, ValueError):
+            tables = None
+
+    # otherwise build the tables and save them if asked to
+    if tables is None:
+        tables = [ build_attack_table(ROOK_MASKS, ROOK_RAYS),
+                   build_attack_table(BISHOP_MASKS, BISHOP_RAYS) ]
+        if cache_path is not None:
+            try:
+                write_sliding_tables(cache_path, tables, masks)
+            except OSError:
+                print('Could not write table cache {}.'.format(cache_path), file=sys.stderr)
+
+    ROOK_ATTACKS, BISHOP_ATTACKS = tables
+
+
+# This method writes attack tables (lists of one dictionary per square, see
+#  build_attack_table) built from the given lists of masks to a cache file.
+def write_sliding_tables(path, tables, masks):
+
+    moves = array.array('Q')
+    for table, table_masks in zip(tables, masks):
+        for square in range(64):
+            moves.extend( table[square][subset] for subset in mask_subsets(table_masks[square]) )
+    if sys.byteorder == 'big':
+        moves.byteswap()
+
+    with open(path, 'wb') as cache_file:
+        cache_file.write( SLIDING_TABLES_HEADER.pack(SLIDING_TABLES_MAGIC, SLIDING_TABLES_VERSION) )
+        moves.tofile(cache_file)
+
+
+# This method reads the attack tables written by write_sliding_tables.
+#  Files with the wrong header or size raise ValueError.
+def read_sliding_tables(path, masks):
+
+    with open(path, 'rb') as cache_file:
+        header = cache_file.read(SLIDING_TABLES_HEADER.size)
+        data = cache_file.read()
+
+    if len(header) != SLIDING_TABLES_HEADER.size or \
+       SLIDING_TABLES_HEADER.unpack(header) != (SLIDING_TABLES_MAGIC, SLIDING_TABLES_VERSION):
+        raise ValueError('{} is not a sliding table cache.'.format(path))
+
+    sizes = [ 1 << bin(mask).count('1') for table_masks in masks for mask in table_masks ]
+    if len(data) != 8 * sum(sizes):
+        raise ValueError('{} has the wrong size.'.format(path))
+
+    moves = array.array('Q')
+    moves.frombytes(data)
+    if sys.byteorder == 'big':
+        moves.byteswap()
+
+    tables = []
+    position = 0
+    for table_masks in masks:
+        table = []
+        for mask in table_masks:
+            entries = dict( zip(mask_subsets(mask), moves[position:position + (1 << bin(mask).count('1'))]) )
+            position += len(entries)
+            table.append(entries)
+        tables.append(table)
+
+    return tables
+
+
+# This method returns the bitboard of squares a rook can target from square.
+def rook_moves(square, occupancy=0):
+    if ROOK_ATTACKS is None:
+        ensure_sliding_tables()
+    return ROOK_ATTACKS[square][occupancy & ROOK_MASKS[square]]
+
+
+# This method returns the bitboard of squares a queen can target from square.
+def queen_moves(square, occupancy=0):
+    if ROOK_ATTACKS is None:
+        ensure_sliding_tables()
+    return ( ROOK_ATTACKS[square][occupancy & ROOK_MASKS[square]]
+             | BISHOP_ATTACKS[square][occupancy & BISHOP_MASKS[square]] )
+
+
+# This method returns the bitboard of squares a bishop can target from square.
+def bishop_moves(square, occupancy=0):
+    if ROOK_ATTACKS is None:
+        ensure_sliding_tables()
+    return BISHOP_ATTACKS[square][occupancy & BISHOP_MASKS[square]]
+
+
+# This class is the description of a piece type that the program's move
+#  generation and searches are built from:
+#   name    the piece type, ex: 'QUEEN'
+#   icon    the letter print_board shows for it
+#   leaps   (column, row) offsets it can jump to, over any pawns
+#   slides  (column, row) directions, from QUEEN_DIRECTIONS, it can slide
+#           in until it reaches the edge of the board or a pawn
+#   reach   the longest column or row offset of its leaps
+#  A compound piece has both leaps and slides. Every offset and direction
+#  must come with its opposite, since the searches rely on a move from a to
+#  b meaning there is a move from b to a; specs that break this raise
+#  ValueError.
+class PieceSpec:
+
+    __slots__ = ('name', 'icon', 'leaps', 'slides', 'reach')
+
+    def __init__(self, name, icon, leaps=(), slides=()):
+
+        self.name = name
+        self.icon = icon
+        self.leaps = tuple(leaps)
+        self.slides = tuple(slides)
+        self.reach = max( [max(abs(dc), abs(dr)) for dc, dr in self.leaps], default=0 )
+
+        for dc, dr in self.leaps + self.slides:
+            if (dc, dr) == (0, 0):
+                raise ValueError('Piece {} can not have a move of (0, 0), which stays on the same square.'.format(name))
+            if (-dc, -dr) not in self.leaps + self.slides:
+                raise ValueError('Piece {} needs the move opposite to ({}, {}).'.format(name, dc, dr))
+        for direction in self.slides:
+            if direction not in QUEEN_DIRECTIONS:
+                raise ValueError('Piece {} can not slide in direction {}.'.format(name, direction))
+
+    # This method checks if the piece can get from one square to another
+    #  dc columns and dr rows away in one move, on an empty board without
+    #  edges.
+    def reaches(self, dc, dr):
+        if (dc, dr) in self.leaps:
+            return True
+        if dc != 0 and dr != 0 and abs(dc) != abs(dr):
+            return False
+        return ( (dc > 0) - (dc < 0), (dr > 0) - (dr < 0) ) in self.slides
+
+
+# This method returns every (column, row) offset a leaper with the given
+#  jump can move by: (1, 2) gives the knight's eight jumps.
+def leaper(columns, rows):
+    offsets = set()
+    for dc, dr in ( (columns, rows), (rows, columns) ):
+        for sc in (1, -1):
+            for sr in (1, -1):
+                offsets.add( (dc * sc, dr * sr) )
+    return tuple( sorted(offsets) )
+
+
+# This method compiles a piece spec for the 8x8 board. It returns a tuple of
+#  the table of its leaps (entry [square] is the bitboard of squares it can
+#  leap to, None if it has no leaps) and its move function, called as
+#  function(square, occupancy): leaps come from that table, and slides from
+#  the occupancy-indexed rook and bishop tables (or, for other sets of
+#  directions, from the rays in RAY_TABLE).
+def compile_moves(spec):
+
+    leaps = None
+    if spec.leaps:
+        leaps = [0] * 64
+        for square in range(64):
+            for dc, dr in spec.leaps:
+                c = square % 8 + dc
+                r = square // 8 + dr
+                if 0 <= c < 8 and 0 <= r < 8:
+                    leaps[square] |= 1 << (r * 8 + c)
+
+    slides = set(spec.slides)
+    if not slides:
+        slide = None
+    elif slides == set(QUEEN_DIRECTIONS):
+        slide = queen_moves
+    elif slides == set(ORTHOGONAL_DIRECTIONS):
+        slide = rook_moves
+    elif slides == set(DIAGONAL_DIRECTIONS):
+        slide = bishop_moves
+    else:
+        # rays toward higher squares are cut at their lowest blocker, and
+        #  the others at their highest (see sliding_moves)
+        positive = tuple( RAY_TABLE[QUEEN_DIRECTIONS.index(d)] for d in spec.slides if d[1] > 0 or d == (1, 0) )
+        negative = tuple( RAY_TABLE[QUEEN_DIRECTIONS.index(d)] for d in spec.slides if d[1] < 0 or d == (-1, 0) )
+        slide = lambda square, occupancy=0, rays=(positive, negative): sliding_moves(square, occupancy, rays)
+
+    if leaps and slide:
+        return (leaps, lambda square, occupancy=0: leaps[square] | slide(square, occupancy))
+    if leaps:
+        return (leaps, lambda square, occupancy=0: leaps[square])
+    return (None, slide)
+
+
+# piece specs and their compiled move functions by piece type, and the leap
+#  tables of the pieces that only leap, which generate_moves reads directly
+PIECE_SPECS = {}
+MOVE_FUNCTIONS = {}
+LEAP_TABLES = {}
+
+
+# This method adds a piece type to the program. Its spec (see PieceSpec) is
+#  compiled into move tables now, and it gets a ChessPiece class unless it
+#  already has one in PIECE_CLASSES. From then on it works everywhere a
+#  piece type is accepted: move generation, the searches, the modes, batch
+#  mode and the Solver.
+def register_piece(name, icon, leaps=(), slides=()):
+
+    spec = PieceSpec(name, icon, leaps, slides)
+
+    with TABLES_LOCK:
+        leaps, MOVE_FUNCTIONS[name] = compile_moves(spec)
+        PIECE_SPECS[name] = spec
+        if spec.slides:
+            LEAP_TABLES.pop(name, None)
+        else:
+            LEAP_TABLES[name] = leaps
+        if name not in PIECE_CLASSES:
+            PIECE_CLASSES[name] = type( name.title(), (ChessPiece,), {'piece_type': name, 'icon': icon} )
+
+    return spec
+
+
+# the standard pieces, and some fairy chess pieces: the Amazon (queen and
+#  knight), Archbishop (bishop and knight), Chancellor (rook and knight)
+#  and Camel (a long knight that jumps 1 and 3 squares)
+register_piece('QUEEN', 'Q', slides=QUEEN_DIRECTIONS)
+register_piece('ROOK', 'R', slides=ORTHOGONAL_DIRECTIONS)
+register_piece('BISHOP', 'B', slides=DIAGONAL_DIRECTIONS)
+register_piece('KNIGHT', 'K', leaps=KNIGHT_JUMPS)
+register_piece('KING', 'G', leaps=leaper(0, 1) + leaper(1, 1))
+register_piece('AMAZON', 'Z', leaps=KNIGHT_JUMPS, slides=QUEEN_DIRECTIONS)
+register_piece('ARCHBISHOP', 'A', leaps=KNIGHT_JUMPS, slides=DIAGONAL_DIRECTIONS)
+register_piece('CHANCELLOR', 'C', leaps=KNIGHT_JUMPS, slides=ORTHOGONAL_DIRECTIONS)
+register_piece('CAMEL', 'L', leaps=leaper(1, 3))
+
+
+# This method returns the bitboard of squares the given piece type can
+#  target from square, given a bitboard of occupied squares.
+def generate_moves(piece_type, square, occupancy=0):
+    if piece_type in LEAP_TABLES:
+        return LEAP_TABLES[piece_type][square]
+    if piece_type in MOVE_FUNCTIONS:
+        return MOVE_FUNCTIONS[piece_type](square, occupancy)
+    return 0
+
+
+# This method returns the move function, called as function(square, occupancy),
+#  for the given piece type. Searches look it up once instead of dispatching
+#  on the piece type for every square they expand.
+def move_function(piece_type):
+    return MOVE_FUNCTIONS[piece_type]
+
+
+# This method returns the bitboard of squares the given piece type can
+#  target from square through the list API: a ChessPiece is made at the
+#  square's position and asked for calculate_possible_moves past the
+#  positions of the occupied squares. It gives the same moves as
+#  generate_moves, and is there so perft can measure the list API.
+def legacy_moves(piece_type, square, occupancy=0):
+    piece = PIECE_CLASSES[piece_type]( square_name(square) )
+    return positions_to_bitboard( piece.calculate_possible_moves( bitboard_to_positions(occupancy) ) )
+
+
+# This method counts the sequences of depth moves (perft, as in chess engine
+#  testing) that a side made of the friendly pieces can play on the 8x8
+#  board. pieces is a list of (piece type, square) tuples and pawns is a
+#  bitboard of opposing pawns, which never move. A move takes one friendly
+#  piece to a square it can target that no friendly piece is on; friendly
+#  pieces and pawns both block sliding pieces, and a pawn that is moved onto
+#  is captured and taken off the board.
+#  generator is the move generator being measured, called as
+#  generator(piece_type, square, occupancy) and returning a bitboard, like
+#  generate_moves (the default) or legacy_moves. The moves of the last ply
+#  are counted without being made.
+def perft(pieces, pawns=0, depth=1, generator=generate_moves):
+
+    piece_types = [piece_type for piece_type, square in pieces]
+    squares = [square for piece_type, square in pieces]
+    if len(set(squares)) != len(squares) or any(pawns >> square & 1 for square in squares):
+        raise ValueError('Pieces and pawns must all be on different squares.')
+
+    def count(depth, pawns):
+
+        friendly = 0
+        for square in squares:
+            friendly |= 1 << square
+        occupancy = friendly | pawns
+
+        nodes = 0
+        for i in range(len(squares)):
+            square = squares[i]
+            moves = generator(piece_types[i], square, occupancy) & ~friendly
+            if depth == 1:
+                nodes += bin(moves).count('1')
+                continue
+
+            # make each move, count the sequences after it, and take it back
+            for target in bitboard_squares(moves):
+                squares[i] = target
+                nodes += count(depth - 1, pawns & ~(1 << target))
+            squares[i] = square
+
+        return nodes
+
+    return count(depth, pawns) if depth > 0 else 1
+
+
+# This method returns the minimum number of moves it takes a knight to get
+#  from square a to square b, from the closed-form knight distance formula.
+#  Knights jump over pawns and may land on them, so this is the answer with
+#  any pawns on the board too.
+#  With dx >= dy the distances away from the edges of the board are:
+#   (1, 0) takes 3 moves and (2, 2) takes 4, and otherwise, with
+#   delta = dx - dy, it is delta - 2*floor((delta - dy) / 3) when dy > delta
+#   and delta - 2*floor((delta - dy) / 4) when it isn't.
+#  The only other exception on an 8x8 board is a corner and the square
+#  diagonally next to it, which take 4 moves instead of 2 because both
+#  two-move routes leave the board.
+def knight_distance(a, b):
+
+    dx = abs(a % 8 - b % 8)
+    dy = abs(a // 8 - b // 8)
+
+    if dx == 1 and dy == 1 and (a in CORNER_SQUARES or b in CORNER_SQUARES):
+        return 4
+
+    return knight_steps(dx, dy)
+
+
+# This method returns the minimum number of moves it takes a knight to move
+#  dx files and dy ranks on a board without edges (the formula used by
+#  knight_distance).
+def knight_steps(dx, dy):
+
+    if dx < dy:
+        dx, dy = dy, dx
+
+    if dx == 1 and dy == 0:
+        return 3
+    if dx == 2 and dy == 2:
+        return 4
+
+    delta = dx - dy
+    if dy > delta:
+        return delta - 2 * ((delta - dy) // 3)
+    return delta - 2 * ((delta - dy) // 4)
+
+
+# distance formulas, called as formula(a, b), for the piece types that have
+#  one, and the same formulas on a board without edges, called as
+#  formula(dx, dy)
+DISTANCE_FORMULAS = {'KNIGHT': knight_distance}
+ENDLESS_DISTANCES = {'KNIGHT': knight_steps}
+
+
+# This method returns the minimum number of moves it takes the given piece
+#  type to get from square source to square target with the pawns in
+#  occupancy in the way, without a search, or None if that takes a search.
+#  Piece types in DISTANCE_FORMULAS (the knight, see knight_distance)
+#  always have an answer. Every other piece takes 1 move if target is one
+#  of the moves from source, and otherwise 2 if some square can be reached
+#  from both (moves are symmetric, so target can be reached from that
+#  square). Pawns can only make a path longer, so these answers are exact;
+#  when neither holds (a pawn is in the way of every short path, or the
+#  piece needs a third move) None is returned.
+def closed_form_distance(piece_type, source, target, occupancy=0):
+
+    if source == target:
+        return 0
+    if piece_type in DISTANCE_FORMULAS:
+        return DISTANCE_FORMULAS[piece_type](source, target)
+
+    moves_from = move_function(piece_type)
+    reached = moves_from(source, occupancy)
+    if reached >> target & 1:
+        return 1
+    if reached & moves_from(target, occupancy):
+        return 2
+
+    return None
+
+
+# This class describes a board of any size: files (columns) by ranks (rows).
+#  Squares are numbered along each rank as on the standard board, so
+#  square = rank * files + file (counting from 0), and sets of squares are
+#  bitboards with one bit per square (Python integers of any length).
+#  Files are named a to z, then aa, ab, ... like spreadsheet columns, and
+#  ranks are numbered from 1, so 'e4', 'z26' and 'aa150' are positions.
+#
+#  The 8x8 board uses the program's precomputed move tables. On other
+#  boards, moves are made for a whole set of squares at once by shifting
+#  its bitboard (with a mask so no move wraps around the edge of the
+#  board), and sliding moves grow through the empty squares in steps of 1,
+#  2, 4, ... squares (an occluded fill, as in chess_numpy). A Breadth-first
+#  search then takes a few big integer operations per layer of squares, so
+#  boards up to MAX_BOARD_SIZE files and ranks (256x256) don't need
+#  per-square lists or strings.
+#  Use get_geometry to get the (shared) geometry for a board size.
+class BoardGeometry:
+
+    def __init__(self, files=8, ranks=8):
+
+        if not 1 <= files <= MAX_BOARD_SIZE or not 1 <= ranks <= MAX_BOARD_SIZE:
+            raise ValueError( 'Board size {}x{} not accepted (1 to {} files and ranks).'.format(files, ranks,
+                                                                                             MAX_BOARD_SIZE) )
+
+        self.files = files
+        self.ranks = ranks
+        self.size = files * ranks
+        self.full = (1 << self.size) - 1
+        self.standard = files == 8 and ranks == 8
+        self.first_file = self.full // ((1 << files) - 1)
+
+        # (leap shifts, slide shifts) by piece spec, see piece_shifts
+        self.shifts = {}
+
+        # doubling steps of the occluded fill: 1, 2, 4, ... up to the longest
+        #  line on the board
+        self.fill_steps = max(files, ranks).bit_length()
+
+    # This method returns a (shift, mask) pair for a move of dc files and dr
+    #  ranks: a positive shift moves toward higher squares, and the mask
+    #  removes the squares a move from the other side of the board wrapped
+    #  onto (the first dc files when dc > 0, the last -dc when it is < 0).
+    def shift(self, dc, dr):
+
+        mask = self.full
+        if dc > 0:
+            mask &= ~( self.first_file * ((1 << min(dc, self.files)) - 1) )
+        elif dc < 0:
+            mask &= ~( self.first_file * ((1 << min(-dc, self.files)) - 1) << max(self.files + dc, 0) )
+
+        return (dr * self.files + dc, mask)
+
+    # This method returns a tuple of the (shift, mask) pairs of the given
+    #  piece type's leaps and of its slides (see shift), made from its
+    #  PieceSpec the first time they are needed.
+    def piece_shifts(self, piece_type):
+
+        spec = PIECE_SPECS[piece_type]
+        shifts = self.shifts.get(spec)
+        if shifts is None:
+            shifts = ( tuple(self.shift(dc, dr) for dc, dr in spec.leaps),
+                       tuple(self.shift(dc, dr) for dc, dr in spec.slides) )
+            self.shifts[spec] = shifts
+        return shifts
+
+    # This method returns the name of a file (0 is 'a', 26 is 'aa').
+    def file_name(self, file):
+        name = ''
+        file += 1
+        while file:
+            file, letter = divmod(file - 1, 26)
+            name = chr(ord('a') + letter) + name
+        return name
+
+    # This method returns the position (ex: 'e4') of a square.
+    def square_name(self, square):
+        return self.file_name(square % self.files) + str(square // self.files + 1)
+
+    # This method returns a tuple of the file and rank (counting from 0) of a
+    #  position such as 'e4' or 'aa150', or None if it isn't on this board.
+    def parse_position(self, position):
+
+        if not isinstance(position, str):
+            return None
+
+        letters = len(position) - len(position.lstrip('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+        digits = position[letters:]
+        if letters == 0 or not digits.isdigit() or not digits.isascii() or digits[0] == '0':
+            return None
+
+        file = 0
+        for letter in position[:letters].lower():
+            file = file * 26 + ord(letter) - ord('a') + 1
+        file -= 1
+        rank = int(digits) - 1
+
+        if file >= self.files or rank >= self.ranks:
+            return None
+        return (file, rank)
+
+    # This method checks if a given position is a real position on this board.
+    def is_valid_position(self, position):
+        return self.parse_position(position) is not None
+
+    # This method returns the square of a position such as 'e4'.
+    def square_index(self, position):
+        file, rank = self.parse_position(position)
+        return rank * self.files + file
+
+    # This method converts a list of positions into a bitboard.
+    def positions_to_bitboard(self, positions):
+        bitboard = 0
+        for position in positions:
+            bitboard |= 1 << self.square_index(position)
+        return bitboard
+
+    # This method returns a list of the squares set in a bitboard, lowest
+    #  square first. Bits are found in the bitboard's binary string, which
+    #  takes one pass over a large bitboard instead of one per square.
+    def squares(self, bitboard):
+        if self.standard:
+            return list( bitboard_squares(bitboard) )
+
+        bits = bin(bitboard)[:1:-1]
+        squares = []
+        square = bits.find('1')
+        while square >= 0:
+            squares.append(square)
+            square = bits.find('1', square + 1)
+        return squares
+
+    # This method converts a bitboard into a list of positions.
+    def bitboard_to_positions(self, bitboard):
+        return [self.square_name(square) for square in self.squares(bitboard)]
+
+    # This method returns the bitboard of the squares that any of the pieces
+    #  (a bitboard) of the given piece type can move to, with the pawns in
+    #  occupancy blocking sliding pieces.
+    def fill_moves(self, piece_type, pieces, occupancy=0):
+
+        moves = 0
+        leaps, slides = self.piece_shifts(piece_type)
+
+        for shift, mask in leaps:
+            moves |= (pieces << shift if shift > 0 else pieces >> -shift) & mask
+
+        empty = self.full & ~occupancy
+        for shift, mask in slides:
+            moves |= self.slide(pieces, empty, shift, mask)
 
-        # the list of possible moves to be returned
-        moves = []
-        
-        for r in [-2,2]:
-            for c in [-1,+1]:
-                space = '{}{}'.format( chess_columns_Na.get(self.column + c), self.row + r )
-                if is_valid_position(space):
-                    moves.append(space)
-
-        for r in [-1,1]:
-            for c in [-2,2]:
-                space = '{}{}'.format( chess_columns_Na.get(self.column + c), self.row + r )
-                if is_valid_position(space):
-                    moves.append(space)
-                    
         return moves
 
+    # This method returns the squares any of the pieces (a bitboard) can slide
+    #  to in the direction of one (shift, mask) pair from piece_shifts,
+    #  stopping at (and including) the first square that isn't in empty.
+    def slide(self, pieces, empty, shift, mask):
+
+        # grow the pieces through the empty squares, doubling the step each
+        #  time, then move one more square onto the blockers
+        flood = pieces
+        through = empty & mask
+        step = shift
+        for i in range(self.fill_steps):
+            if step > 0:
+                flood |= through & (flood << step)
+                through &= through << step
+            else:
+                flood |= through & (flood >> -step)
+                through &= through >> -step
+            step *= 2
+
+        return (flood << shift if shift > 0 else flood >> -shift) & mask
+
+    # This method returns the bitboard of squares a piece of the given type
+    #  can move to from square.
+    def moves(self, piece_type, square, occupancy=0):
+        if self.standard:
+            return generate_moves(piece_type, square, occupancy)
+        return self.fill_moves(piece_type, 1 << square, occupancy)
+
+    # This method returns the bitboards of the squares first reached after 0,
+    #  1, 2, ... moves by a Breadth-first search from square, stopping after
+    #  the layer that reaches the last of the squares in the bitboard targets
+    #  (if any are given). Moves are symmetric (see bidirectional_search), so
+    #  a square in one layer can be reached from a square of the layer
+    #  before it that it can move to.
+    def layers(self, piece_type, square, occupancy=0, targets=0, stats=None):
+
+        layers = [1 << square]
+        visited = 1 << square
+        popped = pushed = duplicates = 0
+
+        while layers[-1] and (not targets or visited & targets != targets):
+            all_squares = self.fill_moves(piece_type, layers[-1], occupancy)
+            reached = all_squares & ~visited
+            visited |= reached
+            layers.append(reached)
+            if stats is not None:
+                popped += bin(layers[-2]).count('1')
+                pushed += bin(reached).count('1')
+                duplicates += bin(all_squares & ~reached).count('1')
+
+        # the frontier is a whole layer, and there is one move generation
+        #  (fill) per layer
+        if stats is not None:
+            frontier = max(bin(layer).count('1') for layer in layers)
+            count_search(stats, popped, pushed, duplicates, frontier, len(layers) - 1)
+
+        # drop the empty layer the search ended on
+        if not layers[-1]:
+            layers.pop()
+        return layers
+
+    # This method returns a list with the minimum number of moves it takes the
+    #  given piece type to get from square to every square (-1 if a square
+    #  can't be reached), as distance_map does on the standard board.
+    #  Maps of pieces that only leap (and maps of an empty board) are read
+    #  from a loaded tablebase if there is one for this board.
+    def distance_map(self, piece_type, square, occupancy=0, stats=None):
+
+        if self.standard:
+            return distance_map(piece_type, square, occupancy, stats=stats)
+
+        # leapers jump over pawns, so a loaded tablebase has their distances
+        tablebase = TABLEBASES.get( (self.files, self.ranks) )
+        if ( tablebase is not None and piece_type in tablebase.offsets
+             and (not PIECE_SPECS[piece_type].slides or not occupancy) ):
+            distances = list( tablebase.rows(piece_type)[square] )
+            if UNREACHABLE in distances:
+                distances = [-1 if moves == UNREACHABLE else moves for moves in distances]
+            return distances
+
+        distances = [-1] * self.size
+        for moves, layer in enumerate( self.layers(piece_type, square, occupancy, stats=stats) ):
+            for reached in self.squares(layer):
+                distances[reached] = moves
+
+        return distances
+
+    # This method returns the minimum number of moves it takes the given piece
+    #  type to get from source to target (-1 if it can't be reached).
+    def distance(self, piece_type, source, target, occupancy=0, stats=None):
+        layers = self.layers(piece_type, source, occupancy, 1 << target, stats)
+        return len(layers) - 1 if layers[-1] >> target & 1 else -1
+
+    # This method runs bidirectional_search on this board, with the same
+    #  arguments and result. Off the standard board, each side grows a whole
+    #  layer at once with fill_moves, which also serves the backward side
+    #  since moves are symmetric, and the squares expanded are counted per
+    #  layer.
+    def bidirectional_search(self, piece_type, start, target, occupancy=0, stats=None):
+
+        if self.standard:
+            return bidirectional_search(piece_type, start, target, occupancy, stats)
+
+        if start == target:
+            return (0, 0, 0)
+
+        # per side: the layers reached so far (one bitboard per number of
+        #  moves), visited bitboard, and number of squares expanded
+        layers = ( [1 << start], [1 << target] )
+        visited = [1 << start, 1 << target]
+        expanded = [0, 0]
+        result = -1
+
+        # search counters, only kept when stats are wanted
+        pushed = duplicates = max_frontier = fills = 0
+
+        while layers[0][-1] and layers[1][-1]:
+
+            # grow the side with the smaller frontier
+            sizes = [bin(side_layers[-1]).count('1') for side_layers in layers]
+            side = 0 if sizes[0] <= sizes[1] else 1
+            other = 1 - side
+
+            all_squares = self.fill_moves(piece_type, layers[side][-1], occupancy)
+            reached = all_squares & ~visited[side]
+            visited[side] |= reached
+            layers[side].append(reached)
+            expanded[side] += sizes[side]
+
+            if stats is not None:
+                pushed += bin(reached).count('1')
+                duplicates += bin(all_squares & ~reached).count('1')
+                max_frontier = max(max_frontier, sizes[side], bin(reached).count('1'))
+                fills += 1
+
+            # the earliest layer of the other side that the new layer meets
+            #  gives the shortest path through it
+            meet = reached & visited[other]
+            if meet:
+                depth = next(moves for moves, layer in enumerate(layers[other]) if layer & meet)
+                result = len(layers[side]) - 1 + depth
+                break
+
+        if stats is not None:
+            count_search(stats, expanded[0] + expanded[1], pushed, duplicates, max_frontier, fills)
+
+        # result stays -1 if one side ran out of squares, so target can't be reached
+        return (result, expanded[0], expanded[1])
+
+    # This method returns the minimum number of moves it takes the given piece
+    #  type to get from square to each square in the list targets, indexed
+    #  by square (-1 for squares that can't be reached). The search stops as
+    #  soon as every target has been reached, and on large boards only the
+    #  targets are kept (in a dictionary) instead of a whole distance map.
+    def target_distances(self, piece_type, square, targets, occupancy=0, stats=None):
+
+        if self.standard:
+            return distance_map(piece_type, square, occupancy, stats=stats)
+
+        target_mask = 0
+        for target in targets:
+            target_mask |= 1 << target
+
+        distances = dict.fromkeys(targets, -1)
+        for moves, layer in enumerate( self.layers(piece_type, square, occupancy, target_mask, stats) ):
+            if layer & target_mask:
+                for target in targets:
+                    if layer >> target & 1:
+                        distances[target] = moves
+
+        return distances
+
+    # This method returns the list of squares on a shortest path for the given
+    #  piece type from source to target, not including source (None if target
+    #  can't be reached), as shortest_path does on the standard board.
+    def shortest_path(self, piece_type, source, target, occupancy=0, stats=None):
+
+        if self.standard:
+            return shortest_path(piece_type, source, target, occupancy, stats)
+
+        layers = self.layers(piece_type, source, occupancy, 1 << target, stats)
+        if not layers[-1] >> target & 1:
+            return None
+        if source == target:
+            return []
+
+        # walk back through the layers to the source
+        path = [target]
+        for layer in reversed(layers[1:-1]):
+            before = self.fill_moves(piece_type, 1 << path[-1], occupancy) & layer
+            path.append( (before & -before).bit_length() - 1 )
+        path.reverse()
+
+        return path
+
+    # This method returns the fewest moves the given piece type could need to
+    #  get from square a to square b on an endless empty board: 1 if it has
+    #  a move there, and otherwise 2, or for a piece that only leaps, the
+    #  number of its longest leaps it takes to cover the distance (piece
+    #  types in ENDLESS_DISTANCES have an exact formula). Pawns and the edges
+    #  of the board can only make paths longer, so this is a lower bound on
+    #  the real number of moves (and it is a distance itself, so it keeps the
+    #  triangle inequality). With a tablebase loaded for this board (see
+    #  load_tablebase), the exact empty-board distance is used instead.
+    def lower_bound(self, piece_type, a, b):
+
+        tablebase = TABLEBASES.get( (self.files, self.ranks) )
+        if tablebase is not None and piece_type in tablebase.offsets:
+            return tablebase.distance(piece_type, a, b)
+
+        dc = b % self.files - a % self.files
+        dr = b // self.files - a // self.files
+
+        if dc == 0 and dr == 0:
+            return 0
+        if piece_type in ENDLESS_DISTANCES:
+            return ENDLESS_DISTANCES[piece_type](abs(dc), abs(dr))
+
+        spec = PIECE_SPECS[piece_type]
+        if spec.reaches(dc, dr):
+            return 1
+        if spec.slides:
+            return 2
+        return max( 2, -(-max(abs(dc), abs(dr)) // spec.reach) )
+
+    # This method returns a tuple of the square that takes the most moves to
+    #  reach in a list of distances from distance_map, and that number of
+    #  moves, as farthest_in_map does on the standard board.
+    def farthest_in_map(self, distances, square):
+
+        if self.standard:
+            return farthest_in_map(distances, square)
+
+        column = square % self.files
+        row = square // self.files
+        farthest = max( range(self.size),
+                        key=lambda s: (distances[s], (s % self.files - column) ** 2 + (s // self.files - row) ** 2) )
+
+        return (farthest, distances[farthest])
+
+    # This method generates a board (a list of columns) where all spaces are
+    #  'empty' and marked by a '.'
+    def new_board(self):
+        return [ ['.'] * self.ranks for x in range(self.files) ]
+
+
+# board geometries made so far, by (files, ranks)
+GEOMETRIES = {}
+
+
+# This method returns the BoardGeometry for a board size, making it the first
+#  time it is asked for.
+def get_geometry(files=8, ranks=8):
+    geometry = GEOMETRIES.get( (files, ranks) )
+    if geometry is None:
+        with TABLES_LOCK:
+            geometry = GEOMETRIES.setdefault( (files, ranks), BoardGeometry(files, ranks) )
+    return geometry
+
+
+# This method reads a board size such as '8x8' or '200x150' (files x ranks)
+#  and returns its BoardGeometry.
+def parse_board_size(text):
+
+    files, separator, ranks = str(text).lower().partition('x')
+    if not separator or not files.isdigit() or not ranks.isdigit():
+        raise ValueError('Board size {} not accepted.'.format(text))
+
+    return get_geometry(int(files), int(ranks))
+
+
+# the standard 8x8 board
+DEFAULT_GEOMETRY = get_geometry(8, 8)
+
+
+# This method returns a new dictionary for collecting search statistics: the
+#  counters in SEARCH_COUNTERS, all starting at 0, and a 'timings'
+#  dictionary of seconds spent on each phase of a run. The searches take it
+#  as their stats parameter and add to it, so one dictionary can total
+#  several searches. Searches given stats=None skip the counting.
+def new_stats():
+    stats = dict.fromkeys(SEARCH_COUNTERS, 0)
+    stats['timings'] = {}
+    return stats
+
+
+# This method adds one search's counters to stats.
+def count_search(stats, popped, pushed, duplicates, max_frontier, movegen_calls):
+    stats['popped'] += popped
+    stats['pushed'] += pushed
+    stats['duplicates'] += duplicates
+    stats['max_frontier'] = max(stats['max_frontier'], max_frontier)
+    stats['movegen_calls'] += movegen_calls
+
+
+# This method adds the given phase timings (in seconds) to stats.
+def add_timings(stats, **seconds):
+    for phase, phase_seconds in seconds.items():
+        stats['timings'][phase] = stats['timings'].get(phase, 0) + phase_seconds
+
+
+# This method prints the counters and timings in stats.
+def print_stats(stats):
+
+    print('\nSearch stats:')
+    for counter in SEARCH_COUNTERS:
+        print('  {:14} {:>12,}'.format(counter, stats[counter]))
+    for phase, seconds in stats['timings'].items():
+        print('  {:14} {:>12.3f} ms'.format(phase, seconds * 1000))
+
 
 # This class represents a space on the chess board for our queue.
 #  This stores x and y attributes, a chess position, and the number
@@ -345,14 +2094,18 @@ class Knight(ChessPiece):
 #  of opposing pawns on the board can also be provided for
 #  use in a priority queue.
 class Space:
-    
-    def __init__(self, x, y, moves, past_spaces=[], pawns=[]):
+
+    __slots__ = ('x', 'y', 'pos', 'moves', 'past_spaces', 'pawns')
+
+    def __init__(self, x, y, moves, past_spaces=None, pawns=None):
         self.x = x
         self.y = y
         self.pos = str( chess_columns_Na.get(x)) + str(y)
         self.moves = moves
-        self.past_spaces = past_spaces
-        self.pawns = pawns
+
+        # every space gets its own lists, so spaces never share them
+        self.past_spaces = past_spaces if past_spaces is not None else []
+        self.pawns = pawns if pawns is not None else []
     
     # This method returns a priority value based on whether it is
     #  a "capture" space. "Capture" spaces will be pushed to the
@@ -371,62 +2124,190 @@ class Space:
         return index
 
 
+# A node of the BFS_pq search: the square reached, the number of moves it
+#  took, the bitboards of the squares on the path to it and of the pawns
+#  left on the board, and the node it was reached from. Nodes share their
+#  parents instead of copying the path, and the list of moves is only
+#  rebuilt (by following parent) once the search is done.
+class PathNode:
+
+    __slots__ = ('square', 'moves', 'path', 'pawns', 'parent')
+
+    def __init__(self, square, moves, path, pawns, parent=None):
+        self.square = square
+        self.moves = moves
+        self.path = path
+        self.pawns = pawns
+        self.parent = parent
+
+    # This method returns the list of positions from the start of the
+    #  search to this node.
+    def positions(self):
+        positions = []
+        node = self
+        while node is not None:
+            positions.append( square_name(node.square) )
+            node = node.parent
+        positions.reverse()
+        return positions
+
+
 # This method implements a queue and conducts a Breadth-first search 
 #  to find the minimum number of moves it takes to get from start to
 #  target. This method also takes piece type, and opposing pieces as 
 #  parameters. The minimum number of moves is returned as an integer.
-def BFS(start, target, piece_type, opp_pieces):
-    
-    # keep a list of visited spaces
-    visited = []
-    
-    # initialize queue 
-    q = Queue()
-    
-    # add the starting space
-    q.put(start)
-    
+#  If bidirectional is True, the search runs from both ends at once
+#  (see bidirectional_search). If stats is a dictionary from new_stats,
+#  the search counters are added to it.
+def BFS(start, target, piece_type, opp_pieces, bidirectional=False, stats=None):
+
+    moves_from = move_function(piece_type)
+
+    # bitboard of the opposing pieces, which block sliding pieces
+    occupancy = positions_to_bitboard(opp_pieces)
+
+    # bitboard indexes of the start and target spaces
+    start_square = (start.y - 1) * 8 + start.x - 1
+    target_square = (target.y - 1) * 8 + target.x - 1
+
+    if start_square == target_square:
+        return start.moves
+
+    # most answers don't need a search at all (see closed_form_distance)
+    known = closed_form_distance(piece_type, start_square, target_square, occupancy)
+    if known is not None:
+        return start.moves + known
+
+    if bidirectional:
+        moves = bidirectional_search(piece_type, start_square, target_square, occupancy, stats)[0]
+        return start.moves + moves if moves >= 0 else 0
+
+    # moves[square] is the number of moves to reach square, and visited is
+    #  the bitboard of squares that have been queued
+    moves = bytearray(64)
+    moves[start_square] = start.moves
+    visited = 1 << start_square
+
+    # the queue holds plain square indexes
+    q = deque([start_square])
+    result = 0
+
+    # search counters, only kept when stats are wanted
+    popped = pushed = duplicates = max_frontier = 0
+
     # begin Breadth-first search
-    while(not q.empty()):
-        
-        # pop first space in queue
-        front = q.get()
-        
-        # make a temp piece to calculate the valid next spaces
-        if piece_type == 'QUEEN':
-            temp_piece = Queen( chess_columns_Na.get(front.x) + str(front.y) )
-            
-        if piece_type == 'ROOK':
-            temp_piece = Rook( chess_columns_Na.get(front.x) + str(front.y) )
-            
-        if piece_type == 'KNIGHT':
-            temp_piece = Knight( chess_columns_Na.get(front.x) + str(front.y) )
-            
-        # get valid next spaces for the piece in the current position
-        valid_next_spaces = temp_piece.calculate_possible_moves(opp_pieces)
-        
-        # return # of moves if target position is reached
-        if front.x == target.x and front.y == target.y:
-            return front.moves
-        
-        # otherwise, begin traversing all valid next spaces
-        for i in range(0, len(valid_next_spaces)):
-            
-            next_x = chess_columns_aN.get(valid_next_spaces[i][0])
-            next_y = int(valid_next_spaces[i][1])
-            
-            # create string representation of next position
-            search = '{}{}'.format(chess_columns_Na.get(next_x), next_y)
-            
-            # if next space hasn't been visited already and is a valid position, add it to the queue
-            if search not in visited and is_valid_position(search):
-                
-                next = Space(next_x, next_y, front.moves+1)
-                q.put(next)
-                visited.append(search)
-              
-    # this line would be reached if the queue gets empty, which it shouldn't  
-    return 0
+    while q:
+
+        # pop first square in queue
+        square = q.popleft()
+        next_moves = moves[square] + 1
+
+        # add every unvisited square the piece can move to from here
+        all_squares = moves_from(square, occupancy)
+        next_squares = all_squares & ~visited
+
+        if stats is not None:
+            popped += 1
+            pushed += bin(next_squares).count('1')
+            duplicates += bin(all_squares & visited).count('1')
+            max_frontier = max(max_frontier, len(q) + 1)
+
+        # return # of moves as soon as the target position is reached
+        if next_squares >> target_square & 1:
+            result = next_moves
+            break
+
+        visited |= next_squares
+        for next_square in bitboard_squares(next_squares):
+            moves[next_square] = next_moves
+            q.append(next_square)
+
+    if stats is not None:
+        count_search(stats, popped, pushed, duplicates, max_frontier, popped)
+
+    # result stays 0 if the queue gets empty, which it shouldn't
+    return result
+
+
+# This method conducts a bidirectional Breadth-first search for the minimum
+#  number of moves it takes the given piece type to get from start to target
+#  (square indexes), with the opposing pieces in occupancy in the way.
+#  One search runs forward from start and one runs backward from target,
+#  always growing the side with the smaller frontier by a whole layer, until
+#  they meet. A tuple of the number of moves (-1 if target can't be reached)
+#  and the number of squares expanded forward and backward is returned.
+#
+#  Searching backward needs the squares a piece can come from. A piece on
+#  square a can move to square b exactly when no piece stands strictly
+#  between them (the piece on b itself, if any, is captured and ends the
+#  move), and that condition doesn't depend on the direction of travel.
+#  Knight jumps are symmetric as well, so the squares a piece can reach b
+#  from are the squares it can move to from b.
+#  If stats is a dictionary from new_stats, the search counters are added
+#  to it (both sides together).
+def bidirectional_search(piece_type, start, target, occupancy=0, stats=None):
+
+    moves_from = move_function(piece_type)
+
+    if start == target:
+        return (0, 0, 0)
+
+    # per side: moves from that side's end, visited bitboard, frontier,
+    #  current depth, and number of squares expanded
+    distances = ( {start: 0}, {target: 0} )
+    visited = [1 << start, 1 << target]
+    frontiers = [[start], [target]]
+    depths = [0, 0]
+    expanded = [0, 0]
+    result = -1
+
+    # search counters, only kept when stats are wanted
+    pushed = duplicates = max_frontier = 0
+
+    while frontiers[0] and frontiers[1]:
+
+        # grow the side with the smaller frontier
+        side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+        other = 1 - side
+        depths[side] += 1
+
+        next_frontier = []
+        meet = -1
+        for front in frontiers[side]:
+            expanded[side] += 1
+            all_squares = moves_from(front, occupancy)
+            reached = all_squares & ~visited[side]
+
+            if stats is not None:
+                pushed += bin(reached).count('1')
+                duplicates += bin(all_squares & visited[side]).count('1')
+
+            visited[side] |= reached
+
+            # squares the other side has already reached join the two searches
+            for square in bitboard_squares(reached & visited[other]):
+                total = depths[side] + distances[other][square]
+                if meet < 0 or total < meet:
+                    meet = total
+
+            for square in bitboard_squares(reached):
+                distances[side][square] = depths[side]
+                next_frontier.append(square)
+
+        if stats is not None:
+            max_frontier = max(max_frontier, len(frontiers[side]), len(next_frontier))
+
+        if meet >= 0:
+            result = meet
+            break
+
+        frontiers[side] = next_frontier
+
+    if stats is not None:
+        count_search(stats, expanded[0] + expanded[1], pushed, duplicates, max_frontier, expanded[0] + expanded[1])
+
+    # result stays -1 if one side ran out of squares, so target can't be reached
+    return (result, expanded[0], expanded[1])
 
 
 # This method implements a priority queue and conducts a Breadth-first 
@@ -434,73 +2315,1234 @@ def BFS(start, target, piece_type, opp_pieces):
 #  to capture all the opposing pieces on the board. The pqueue
 #  prioritizes spaces where a capture is available. The minimum
 #  number of moves and the actual list of moves are returned as a tuple.
-def BFS_pq(start, piece_type, opp_pieces):
-        
+#  The search is over PathNodes, which never go back to a square already
+#  on their own path. If stats is a dictionary from new_stats, the search
+#  counters are added to it.
+def BFS_pq(start, piece_type, opp_pieces, stats=None):
+
+    # bitboards of the pawns that have to be captured, and of the squares
+    #  the start space has already been through
+    targets = positions_to_bitboard(opp_pieces)
+    past = positions_to_bitboard(start.past_spaces)
+
+    # a pawn the piece can't reach even on an empty board (a bishop's pawn on
+    #  the other colour) would leave the search trying every path first
+    empty = empty_board_distances(piece_type)[square_index(start.pos)]
+    for square in bitboard_squares(targets):
+        if empty[square] < 0 or empty[square] == UNREACHABLE:
+            return 0
+
     # initialize heap for priority queue
     h = []
     
     # counter used for prioritization
     heap_index = 1
-
-    # add the starting space as a tuple
-    heapq.heappush(h, (start.prioritize(heap_index), start) )
-    
+    result = 0
+
+    # search counters, only kept when stats are wanted
+    popped = pushed = duplicates = max_frontier = 0
+    moves_from = move_function(piece_type)
+
+    # add the starting node as a tuple (capturing the pawn on the start
+    #  space, if there is one)
+    start_square = square_index(start.pos)
+    start_pawns = positions_to_bitboard(start.pawns)
+    root = PathNode(start_square, start.moves, past | 1 << start_square, start_pawns & ~(1 << start_square))
+    heapq.heappush(h, (-heap_index if start_pawns >> start_square & 1 else heap_index, root) )
         
     # begin Breadth-first search
-    while(len(h) > 0):
-                
-        # pop first space in pqueue
-        front = heapq.heappop(h)
-        
-        # update front's list of past spaces to include current space
-        past_spaces = front[1].past_spaces.copy()
-        past_spaces.append( front[1].pos )
-        front[1].past_spaces = past_spaces
-        
-        # make a temp piece to calculate the valid next spaces
-        if piece_type == 'QUEEN':
-            temp_piece = Queen( front[1].pos )
-            
-        if piece_type == 'ROOK':
-            temp_piece = Rook( front[1].pos )
-            
-        if piece_type == 'KNIGHT':
-            temp_piece = Knight( front[1].pos )
-            
-        # remove pawn from front's pawn list if captured
-        if front[1].pos in front[1].pawns:
-            front[1].pawns.remove(front[1].pos)        
-            
-        # get valid next spaces for the piece in the current position
-        valid_next_spaces = temp_piece.calculate_possible_moves(front[1].pawns)
-        
+    while h:
+
+        if stats is not None:
+            popped += 1
+            max_frontier = max(max_frontier, len(h))
+
+        # pop first node in pqueue
+        front = heapq.heappop(h)[1]
+
         # return number of moves if all pawn spaces have been reached
-        check = all(item in front[1].past_spaces for item in opp_pieces)
-        
-        if check:
+        if targets & ~front.path == 0:
             # return tuple containing # of moves, and list of moves
-            return (front[1].moves, front[1].past_spaces)
-        
-        # otherwise, traverse all valid next spaces
-        for i in range(0, len(valid_next_spaces)):
+            result = (front.moves, start.past_spaces + front.positions())
+            break
+
+        # get the squares the piece can move to from the current position,
+        #  blocked by the pawns that are left on the board
+        next_squares = moves_from(front.square, front.pawns)
+
+        # squares already on this node's path are not visited again
+        if stats is not None:
+            duplicates += bin(next_squares & front.path).count('1')
+            pushed += bin(next_squares & ~front.path).count('1')
+
+        # otherwise, traverse all valid next squares, prioritizing captures
+        for next_square in bitboard_squares(next_squares & ~front.path):
             
             # increment heap index for prioritization
             heap_index = heap_index + 1
-            
-            # calculate the next target space
-            next_x = chess_columns_aN.get(valid_next_spaces[i][0])
-            next_y = int(valid_next_spaces[i][1])
-            
-            # create string representation of next position
-            search = '{}{}'.format(chess_columns_Na.get(next_x), next_y)
-            
-            # if next space hasn't been visited already and is a valid position,, add it to the pqueue
-            if search not in front[1].past_spaces and is_valid_position(search):
-                next = Space(next_x, next_y, front[1].moves+1, front[1].past_spaces, front[1].pawns.copy())
-                heapq.heappush(h, (next.prioritize(heap_index), next) )
-       
-    # this line would be reached if the heap gets empty, which it shouldn't     
-    return 0
+
+            bit = 1 << next_square
+            next = PathNode(next_square, front.moves + 1, front.path | bit, front.pawns & ~bit, front)
+            heapq.heappush(h, (-heap_index if front.pawns & bit else heap_index, next) )
+
+    if stats is not None:
+        count_search(stats, popped, pushed + 1, duplicates, max_frontier, popped)
+
+    # result stays 0 if the heap gets empty, which it shouldn't once every
+    #  pawn can be reached
+    return result
+
+
+# This method conducts a Breadth-first search over the whole board and returns
+#  a list with the minimum number of moves it takes the given piece type to get
+#  from square to every square (-1 if a square can't be reached). Opposing
+#  pieces in occupancy block sliding pieces and can be captured, but they
+#  are not removed from the board.
+#  If parents is True, a tuple of the distances and a list of parent squares
+#  is returned instead: parent[s] is the square a shortest path reaches s
+#  from (-1 for square itself and for squares that can't be reached).
+#  If stats is a dictionary from new_stats, the search counters are added
+#  to it (the frontier is a whole layer). Knight distances don't need a
+#  search unless parents are wanted, so nothing is counted for them.
+def distance_map(piece_type, square, occupancy=0, parents=False, stats=None):
+
+    # pawns never change the distances of pieces that only leap, so they
+    #  come from the empty-board table without a search (a loaded tablebase
+    #  stores squares that can't be reached as UNREACHABLE)
+    if not parents and not PIECE_SPECS[piece_type].slides:
+        return [ -1 if moves == UNREACHABLE else moves for moves in empty_board_distances(piece_type)[square] ]
+
+    moves_from = move_function(piece_type)
+    distances = [-1] * 64
+    distances[square] = 0
+    parent = [-1] * 64
+
+    # expand the search one move (one layer of squares) at a time
+    visited = 1 << square
+    frontier = [square]
+    moves = 0
+
+    # search counters, only kept when stats are wanted: generated counts
+    #  every move, so the duplicates are the moves that didn't reach a new
+    #  square
+    popped = pushed = generated = max_frontier = 0
+
+    while frontier:
+        moves += 1
+
+        if stats is not None:
+            popped += len(frontier)
+            max_frontier = max(max_frontier, len(frontier))
+
+        if parents:
+            # record which square of the current layer reached each square first
+            next_frontier = []
+            for front in frontier:
+                all_squares = moves_from(front, occupancy)
+                reached = all_squares & ~visited
+                visited |= reached
+                if stats is not None:
+                    generated += bin(all_squares).count('1')
+                for next_square in bitboard_squares(reached):
+                    parent[next_square] = front
+                    next_frontier.append(next_square)
+            frontier = next_frontier
+
+        else:
+            # collect every square reachable from the current layer
+            reached = 0
+            if stats is None:
+                for front in frontier:
+                    reached |= moves_from(front, occupancy)
+            else:
+                for front in frontier:
+                    all_squares = moves_from(front, occupancy)
+                    generated += bin(all_squares).count('1')
+                    reached |= all_squares
+
+            # the squares seen for the first time make up the next layer
+            reached &= ~visited
+            visited |= reached
+            frontier = list(bitboard_squares(reached))
+
+        pushed += len(frontier)
+        for next_square in frontier:
+            distances[next_square] = moves
+
+    if stats is not None:
+        count_search(stats, popped, pushed, generated - pushed, max_frontier, popped)
+
+    if parents:
+        return (distances, parent)
+    return distances
+
+
+# This method returns the list of squares on a shortest path for the given
+#  piece type from source to target, not including source (None if target
+#  can't be reached). stats works as in distance_map.
+def shortest_path(piece_type, source, target, occupancy=0, stats=None):
+
+    distances, parent = distance_map(piece_type, source, occupancy, parents=True, stats=stats)
+    if distances[target] < 0:
+        return None
+
+    # walk back from the target to rebuild the path
+    path = []
+    square = target
+    while square != source:
+        path.append(square)
+        square = parent[square]
+    path.reverse()
+
+    return path
+
+
+# This class is a distance map (as from distance_map) that is kept up to date
+#  as pawns are placed and taken off the board, without searching the whole
+#  board again. distance_map[s] is the minimum number of moves from square
+#  to s (-1 if s can't be reached), and layers[k] is the bitboard of squares
+#  that take k moves.
+#
+#  A pawn only changes the slides that pass through its square. On each line
+#  through the pawn, the squares a slider on the pawn's square can see on
+#  one side gain (or lose) a move to every such square on the other side,
+#  and nothing else changes. So:
+#   - remove_blocker: distances can only drop. The squares on one side of a
+#     line can now be reached one move after the nearest square on the
+#     other side; those that are closer than before move down to their new
+#     layer, and the drop spreads outward one layer at a time.
+#   - add_blocker: distances can only grow. A square keeps its distance k
+#     if it can still move to a square of layer k - 1, so going up the
+#     layers from the lost moves, every square that can't is taken out and
+#     the squares it leads to are checked in turn. The squares taken out
+#     are then put back, one layer at a time, from the squares that stayed.
+#  Moves are made for sets of squares (one move generation per square on
+#  the 8x8 board, one fill per set on other boards, as in
+#  BoardGeometry.layers), and only for the squares whose distance can
+#  change. Pieces that only leap never change.
+#  geometry is the BoardGeometry of the board (8x8 by default), and stats
+#  works as in distance_map: updates add the squares they made moves for
+#  (popped), the squares whose distance changed (pushed), and their number
+#  of move generations.
+class DistanceMap:
+
+    def __init__(self, piece_type, square, occupancy=0, geometry=None, stats=None):
+
+        self.piece_type = piece_type
+        self.square = square
+        self.occupancy = occupancy
+        self.geometry = geometry if geometry is not None else DEFAULT_GEOMETRY
+        self.stats = stats
+
+        # the lines it slides along, as (forward, backward) pairs of slides:
+        #  directions (indexes of RAY_TABLE) on the 8x8 board, and (shift,
+        #  mask) pairs on other boards
+        slides = PIECE_SPECS[piece_type].slides
+        if self.geometry.standard:
+            shifts = [QUEEN_DIRECTIONS.index(direction) for direction in slides]
+        else:
+            shifts = self.geometry.piece_shifts(piece_type)[1]
+        self.lines = [ (shifts[i], shifts[slides.index( (-dc, -dr) )])
+                       for i, (dc, dr) in enumerate(slides) if dr > 0 or (dr == 0 and dc > 0) ]
+
+        if self.geometry.standard:
+            self.moves_from = move_function(piece_type)
+
+        self.layers = self.geometry.layers(piece_type, square, occupancy, stats=stats)
+        self.popped = self.pushed = self.calls = self.max_frontier = 0
+
+    # This method returns the minimum number of moves to square (-1 if it
+    #  can't be reached).
+    def __getitem__(self, square):
+        for moves, layer in enumerate(self.layers):
+            if layer >> square & 1:
+                return moves
+        return -1
+
+    # This method returns a copy of the map that is updated on its own.
+    def copy(self):
+        other = DistanceMap.__new__(DistanceMap)
+        other.__dict__.update(self.__dict__)
+        other.layers = list(self.layers)
+        return other
+
+    # This method returns a list of the minimum number of moves to every
+    #  square, as distance_map does.
+    def distances(self):
+        distances = [-1] * self.geometry.size
+        for moves, layer in enumerate(self.layers):
+            for square in self.geometry.squares(layer):
+                distances[square] = moves
+        return distances
+
+    # This method returns the squares that any of the pieces (a bitboard) can
+    #  move to with the current pawns.
+    def fill(self, pieces):
+
+        if self.geometry.standard:
+            moves = 0
+            for square in bitboard_squares(pieces):
+                moves |= self.moves_from(square, self.occupancy)
+                self.calls += 1
+        else:
+            moves = self.geometry.fill_moves(self.piece_type, pieces, self.occupancy)
+            self.calls += 1
+
+        self.popped += bin(pieces).count('1')
+        return moves
+
+    # This method returns the squares of candidates (a bitboard) that can
+    #  move to a square of layer with the current pawns.
+    def reaching(self, candidates, layer):
+
+        if not self.geometry.standard:
+            return candidates & self.fill(layer)
+
+        reaching = 0
+        for square in bitboard_squares(candidates):
+            if self.moves_from(square, self.occupancy) & layer:
+                reaching |= 1 << square
+        self.calls += bin(candidates).count('1')
+        self.popped += bin(candidates).count('1')
+        return reaching
+
+    # This method returns a list of (forward, backward) bitboards, one for
+    #  each line through square that the piece slides along: the squares a
+    #  slider on square can see in each direction, with occupancy in the way.
+    def sides(self, square, occupancy):
+
+        if not self.geometry.standard:
+            empty = self.geometry.full & ~occupancy
+            return [ (self.geometry.slide(1 << square, empty, *forward), self.geometry.slide(1 << square, empty, *backward))
+                     for forward, backward in self.lines ]
+
+        # forward rays run toward higher squares (see sliding_moves)
+        sides = []
+        for forward, backward in self.lines:
+            ahead = RAY_TABLE[forward][square]
+            blockers = ahead & occupancy
+            if blockers:
+                ahead ^= RAY_TABLE[forward][ (blockers & -blockers).bit_length() - 1 ]
+            behind = RAY_TABLE[backward][square]
+            blockers = behind & occupancy
+            if blockers:
+                behind ^= RAY_TABLE[backward][ blockers.bit_length() - 1 ]
+            sides.append( (ahead, behind) )
+        return sides
+
+    # This method returns the fewest moves to any square in bitboard (None
+    #  if none of them can be reached).
+    def nearest(self, bitboard):
+        for moves, layer in enumerate(self.layers):
+            if layer & bitboard:
+                return moves
+        return None
+
+    # This method moves the squares in bitboard to layer moves, taking them out
+    #  of any other layer.
+    def settle(self, bitboard, moves):
+
+        while len(self.layers) <= moves:
+            self.layers.append(0)
+        for layer in range(moves + 1, len(self.layers)):
+            self.layers[layer] &= ~bitboard
+        self.layers[moves] |= bitboard
+
+        self.pushed += bin(bitboard).count('1')
+        self.max_frontier = max(self.max_frontier, bin(bitboard).count('1'))
+
+    # This method adds the counters of the last update to stats.
+    def count(self):
+        if self.stats is not None:
+            count_search(self.stats, self.popped, self.pushed, 0, self.max_frontier, self.calls)
+        self.popped = self.pushed = self.calls = self.max_frontier = 0
+
+    # This method places a pawn on square and updates the distances.
+    def add_blocker(self, square):
+
+        if self.occupancy >> square & 1 or not self.lines:
+            self.occupancy |= 1 << square
+            return
+
+        # every square on one side of a line lost its moves to the other
+        #  side, so those one layer past a square on the other side may have
+        #  lost their only way in
+        layers = self.layers
+        suspects = [0] * (len(layers) + 1)
+        for sides in self.sides(square, self.occupancy):
+            for side, other in (sides, sides[::-1]):
+                for moves in range(len(layers) - 1):
+                    if layers[moves] & side:
+                        suspects[moves + 1] |= other & layers[moves + 1]
+        self.occupancy |= 1 << square
+
+        # take out every square that can't move to the layer before it
+        removed = 0
+        lowest = None
+        for moves in range(1, len(layers)):
+            suspect = suspects[moves] & layers[moves]
+            if suspect:
+                lost = suspect & ~self.reaching(suspect, layers[moves - 1])
+                if lost:
+                    layers[moves] ^= lost
+                    removed |= lost
+                    lowest = moves if lowest is None else lowest
+                    if moves + 1 < len(layers):
+                        suspects[moves + 1] |= self.fill(lost) & layers[moves + 1]
+
+        # put them back a layer at a time, from the squares that stayed (or
+        #  were just put back) next to them
+        if removed:
+            neighbours = self.fill(removed) | removed
+            moves = lowest
+            while removed and moves <= len(layers):
+                back = removed & self.fill(layers[moves - 1] & neighbours)
+                if back:
+                    removed ^= back
+                    self.settle(back, moves)
+                moves += 1
+
+            # what is left can't be reached any more
+            self.pushed += bin(removed).count('1')
+            while not layers[-1]:
+                layers.pop()
+
+        self.count()
+
+    # This method takes the pawn off square and updates the distances.
+    def remove_blocker(self, square):
+
+        if not self.occupancy >> square & 1 or not self.lines:
+            self.occupancy &= ~(1 << square)
+            return
+        self.occupancy &= ~(1 << square)
+
+        # every square on one side of a line can now be reached one move
+        #  after the nearest square on the other side
+        improved = {}
+        for sides in self.sides(square, self.occupancy):
+            for side, other in (sides, sides[::-1]):
+                nearest = self.nearest(side)
+                if nearest is not None:
+                    improved[nearest + 1] = improved.get(nearest + 1, 0) | other
+
+        # move the squares that are now closer down to their new layer, then
+        #  spread to the squares they can move to
+        if improved:
+            moves = min(improved)
+            reached = 0
+            for layer in self.layers[:moves]:
+                reached |= layer
+            while moves <= max(improved):
+                if moves < len(self.layers):
+                    reached |= self.layers[moves]
+                closer = improved.get(moves, 0) & ~reached
+                if closer:
+                    self.settle(closer, moves)
+                    reached |= closer
+                    improved[moves + 1] = improved.get(moves + 1, 0) | self.fill(closer)
+                moves += 1
+
+            while not self.layers[-1]:
+                self.layers.pop()
+
+        self.count()
+
+    # This method moves the pawns to the ones in the bitboard occupancy,
+    #  taking off and placing only the pawns that differ.
+    def set_occupancy(self, occupancy):
+        for square in self.geometry.squares(self.occupancy & ~occupancy):
+            self.remove_blocker(square)
+        for square in self.geometry.squares(occupancy & ~self.occupancy):
+            self.add_blocker(square)
+
+
+# This method returns a tuple of the square that takes the most moves to reach
+#  in a list of distances from distance_map, and that number of moves. Ties
+#  go to the square that is physically farthest from square, the start of
+#  the search.
+def farthest_in_map(distances, square):
+
+    column = square % 8
+    row = square // 8
+
+    farthest = max( range(64), key=lambda s: (distances[s], (s % 8 - column) ** 2 + (s // 8 - row) ** 2) )
+
+    return (farthest, distances[farthest])
+
+
+# This method returns a list where entry [mask] is the bitboard of the
+#  pawns whose indexes are set in the bitmask mask.
+def pawn_subsets(pawns):
+
+    subsets = [0] * (1 << len(pawns))
+
+    for mask in range(1, len(subsets)):
+        lowest = mask & -mask
+        subsets[mask] = subsets[mask ^ lowest] | 1 << pawns[lowest.bit_length() - 1]
+
+    return subsets
+
+
+# This method returns a list where entry [a][b] is the minimum number of moves
+#  it takes the given piece type to get from square a to square b on an empty
+#  board (-1 if b can't be reached, like a bishop's squares of the other
+#  colour). Pawns can only make a path longer, so these are lower bounds for
+#  the searches. The table is built once per piece type (from
+#  DISTANCE_FORMULAS for the knight).
+def empty_board_distances(piece_type):
+
+    table = EMPTY_BOARD_DISTANCES.get(piece_type)
+    if table is not None:
+        return table
+
+    with TABLES_LOCK:
+        if piece_type in DISTANCE_FORMULAS and piece_type not in EMPTY_BOARD_DISTANCES:
+            formula = DISTANCE_FORMULAS[piece_type]
+            EMPTY_BOARD_DISTANCES[piece_type] = [ [formula(a, b) for b in range(64)] for a in range(64) ]
+
+        # (asking for the parents makes distance_map search, where it would
+        #  read this table for pieces that only leap)
+        if piece_type not in EMPTY_BOARD_DISTANCES:
+            EMPTY_BOARD_DISTANCES[piece_type] = [distance_map(piece_type, square, parents=True)[0] for square in range(64)]
+
+        return EMPTY_BOARD_DISTANCES[piece_type]
+
+
+# A distance tablebase file holds the empty-board distance from every square
+#  to every square for one or more piece types, on one board size, one byte
+#  per distance (UNREACHABLE for squares that can't be reached). It starts
+#  with a header (TABLEBASE_HEADER: magic, version, files, ranks, number of
+#  piece types), then one TABLEBASE_ENTRY (piece type, offset) per piece
+#  type, then the tables: byte offset + a*size + b is the distance from
+#  square a to square b.
+TABLEBASE_MAGIC = b'CHESSDTB'
+TABLEBASE_VERSION = 2
+TABLEBASE_HEADER = struct.Struct('<8s4I')
+TABLEBASE_ENTRY = struct.Struct('<16sQ')
+UNREACHABLE = 255
+
+
+# This method writes a distance tablebase for the given piece types (all of
+#  them by default) on the board of geometry (8x8 by default) to path. The
+#  file is written next to path and then moved over it, so processes that
+#  have the old file mapped keep a complete copy.
+def write_tablebase(path, geometry=None, piece_types=None):
+
+    geometry = geometry or DEFAULT_GEOMETRY
+    piece_types = [piece_type.upper() for piece_type in piece_types or sorted(PIECE_CLASSES)]
+    size = geometry.size
+
+    offset = TABLEBASE_HEADER.size + TABLEBASE_ENTRY.size * len(piece_types)
+    header = TABLEBASE_HEADER.pack(TABLEBASE_MAGIC, TABLEBASE_VERSION, geometry.files, geometry.ranks, len(piece_types))
+    entries = []
+    for number, piece_type in enumerate(piece_types):
+        entries.append( TABLEBASE_ENTRY.pack(piece_type.encode('ascii'), offset + number * size * size) )
+
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as tablebase_file:
+        tablebase_file.write(header + b''.join(entries))
+
+        for piece_type in piece_types:
+            for square in range(size):
+
+                # pieces that slide like a rook need at most 2 moves on an
+                #  empty board, which lower_bound gets exactly
+                if geometry.standard or not set(ORTHOGONAL_DIRECTIONS) <= set(PIECE_SPECS[piece_type].slides):
+                    distances = geometry.distance_map(piece_type, square)
+                else:
+                    distances = [geometry.lower_bound(piece_type, square, target) for target in range(size)]
+
+                if max(distances) >= UNREACHABLE:
+                    os.remove(temporary_path)
+                    raise ValueError('Distances on a {}x{} board do not fit in a tablebase.'.format(geometry.files, geometry.ranks))
+                tablebase_file.write( bytes(UNREACHABLE if moves < 0 else moves for moves in distances) )
+
+    os.replace(temporary_path, path)
+
+
+# This class is a read-only view of one piece type's table in a tablebase.
+#  rows[a] is a memoryview of the distances from square a (indexing it gives
+#  ints), so lookups read straight from the mapped file.
+class DistanceRows:
+
+    __slots__ = ('view', 'size')
+
+    def __init__(self, view, size):
+        self.view = view
+        self.size = size
+
+    def __getitem__(self, square):
+        return self.view[square * self.size:(square + 1) * self.size]
+
+    def __len__(self):
+        return self.size
+
+
+# This class is a distance tablebase file (see write_tablebase) mapped into
+#  memory. Nothing is read up front: pages of the file are read by the
+#  operating system as they are used, and every process that maps the same
+#  file shares them. Files that aren't tablebases raise ValueError.
+class DistanceTablebase:
+
+    def __init__(self, path):
+
+        self.path = path
+        with open(path, 'rb') as tablebase_file:
+            try:
+                self.mmap = mmap.mmap(tablebase_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError('Tablebase {} is empty.'.format(path))
+        self.view = memoryview(self.mmap)
+
+        if len(self.view) < TABLEBASE_HEADER.size:
+            raise ValueError('{} is not a tablebase.'.format(path))
+        magic, version, self.files, self.ranks, count = TABLEBASE_HEADER.unpack_from(self.view)
+        if magic != TABLEBASE_MAGIC or version != TABLEBASE_VERSION:
+            raise ValueError('{} is not a version {} tablebase.'.format(path, TABLEBASE_VERSION))
+
+        self.size = self.files * self.ranks
+        self.offsets = {}
+        for number in range(count):
+            name, offset = TABLEBASE_ENTRY.unpack_from(self.view, TABLEBASE_HEADER.size + number * TABLEBASE_ENTRY.size)
+            if offset + self.size * self.size > len(self.view):
+                raise ValueError('Tablebase {} is truncated.'.format(path))
+            self.offsets[name.rstrip(b'\0').decode('ascii')] = offset
+
+    # This method returns the table of a piece type as DistanceRows.
+    def rows(self, piece_type):
+        offset = self.offsets[piece_type]
+        return DistanceRows(self.view[offset:offset + self.size * self.size], self.size)
+
+    # This method returns the empty-board distance from square a to square b
+    #  (UNREACHABLE if b can't be reached).
+    def distance(self, piece_type, a, b):
+        return self.view[self.offsets[piece_type] + a * self.size + b]
+
+
+# This method maps the tablebase file at path into memory and makes the
+#  program use it: empty_board_distances (8x8) and BoardGeometry's
+#  distance maps and lower bounds (other sizes) read from it instead of
+#  building or searching. Returns the DistanceTablebase.
+def load_tablebase(path):
+
+    tablebase = DistanceTablebase(path)
+
+    with TABLES_LOCK:
+        TABLEBASES[(tablebase.files, tablebase.ranks)] = tablebase
+        if (tablebase.files, tablebase.ranks) == (8, 8):
+            for piece_type in tablebase.offsets:
+                EMPTY_BOARD_DISTANCES[piece_type] = tablebase.rows(piece_type)
+
+    return tablebase
+
+
+# This method stops using every loaded tablebase. The empty-board tables are
+#  built again when they are next needed.
+def unload_tablebases():
+    with TABLES_LOCK:
+        TABLEBASES.clear()
+        EMPTY_BOARD_DISTANCES.clear()
+
+
+# This method returns a list where entry [left] is the list of the minimum
+#  numbers of moves from pawns[i] to each pawn, with the pawns in the
+#  bitmask left standing, for every bitmask left without pawn i. Only the
+#  map with every other pawn standing is searched: each smaller set of pawns
+#  copies the map of a set with one more pawn and takes that pawn off
+#  (DistanceMap.remove_blocker), which only touches the squares that get
+#  closer. geometry and stats work as in held_karp_collect.
+def capture_distances(piece_type, pawns, i, geometry=None, stats=None):
+
+    if geometry is None:
+        geometry = DEFAULT_GEOMETRY
+
+    # pawns the piece can't reach on an empty board (the other colour, for a
+    #  bishop) never block it, so only the others are taken off
+    reachable = 0
+    for layer in geometry.layers(piece_type, pawns[i], stats=stats):
+        reachable |= layer
+
+    others = [j for j in range(len(pawns)) if j != i and reachable >> pawns[j] & 1]
+    left = 0
+    occupancy = 0
+    for j in range(len(pawns)):
+        if j != i:
+            occupancy |= 1 << pawns[j]
+            if reachable >> pawns[j] & 1:
+                left |= 1 << j
+
+    rows = {}
+
+    # each set takes off pawns after the last one it took off, so every set
+    #  is made once
+    def take_off(distance_map, left, first):
+        rows[left] = [distance_map[pawn] for pawn in pawns]
+        for k in range(first, len(others)):
+            j = others[k]
+            smaller = distance_map.copy()
+            smaller.remove_blocker(pawns[j])
+            take_off(smaller, left ^ 1 << j, k + 1)
+
+    take_off(DistanceMap(piece_type, pawns[i], occupancy, geometry, stats), left, 0)
+
+    table = [None] * (1 << len(pawns))
+    for subset in range(len(table)):
+        if not subset >> i & 1:
+            table[subset] = rows[subset & left]
+    return table
+
+
+# This method finds the minimum number of moves it takes a chess piece to
+#  capture all the opposing pieces on the board, using the Held-Karp
+#  dynamic program over capture orders. start is the piece's square and
+#  pawns is a list of pawn squares. A tuple of the minimum number of moves
+#  and the list of squares visited (starting with start) is returned, or
+#  None if some pawn can't be reached.
+#
+#  cost[captured][j] is the fewest moves that capture exactly the pawns in
+#  the bitmask captured, ending with pawn j. Pawns block sliding pieces
+#  until they are captured, so the distances out of pawn i are found with
+#  the pawns still standing after captured (every set of them, see
+#  capture_distances). A path that happens to cross another pawn is never
+#  better than capturing that pawn first, which the program also tries, so
+#  the result is exact.
+#  If stats is a dictionary from new_stats, the counters of every distance
+#  map search and update (including the searches that rebuild the path) are
+#  added to it. geometry is the BoardGeometry of the board (8x8 by default).
+def held_karp_collect(piece_type, start, pawns, stats=None, geometry=None):
+
+    n = len(pawns)
+    if n == 0:
+        return (0, [start])
+
+    if geometry is None:
+        geometry = DEFAULT_GEOMETRY
+
+    # a pawn the piece can't reach on an empty board can't be captured (see
+    #  astar_collect)
+    for pawn in pawns:
+        if geometry.standard:
+            moves = empty_board_distances(piece_type)[start][pawn]
+        else:
+            moves = geometry.lower_bound(piece_type, start, pawn)
+        if moves < 0 or moves == UNREACHABLE:
+            return None
+
+    infinity = float('inf')
+    full = (1 << n) - 1
+
+    # standing[captured] is the bitboard of pawns left after captured
+    subsets = pawn_subsets(pawns)
+    standing = [subsets[full ^ captured] for captured in range(full + 1)]
+
+    # pieces that only leap jump over pawns, so their distances don't depend
+    #  on which pawns are left. On the 8x8 board, the distances out of each
+    #  pawn for every set of pawns left are made at once by taking pawns off
+    #  one distance map (capture_distances); on other boards, where a
+    #  search can stop at the last pawn and a whole-board update can't, each
+    #  set is searched when it is first needed.
+    blocking = bool(PIECE_SPECS[piece_type].slides)
+    incremental = blocking and geometry.standard
+    distance_cache = {}
+
+    # this returns the list of distances from pawn i to every pawn, with the
+    #  pawns left after captured standing
+    def distances_from(i, captured):
+        if incremental:
+            if i not in distance_cache:
+                distance_cache[i] = capture_distances(piece_type, pawns, i, geometry, stats)
+            return distance_cache[i][full ^ captured]
+
+        key = (i, standing[captured] if blocking else 0)
+        if key not in distance_cache:
+            distances = geometry.target_distances(piece_type, pawns[i], pawns, key[1], stats)
+            distance_cache[key] = [distances[pawn] for pawn in pawns]
+        return distance_cache[key]
+
+    cost = [[infinity] * n for i in range(full + 1)]
+    previous = [[-1] * n for i in range(full + 1)]
+
+    # first capture, straight from the start square
+    distances = geometry.target_distances(piece_type, start, pawns, standing[0], stats)
+    for j in range(n):
+        if distances[pawns[j]] >= 0:
+            cost[1 << j][j] = distances[pawns[j]]
+
+    # extend every capture order by one more pawn, smallest sets first
+    #  (cost is infinite for pawns that aren't in captured)
+    for captured in range(1, full):
+        costs = cost[captured]
+        for i in range(n):
+            if costs[i] == infinity:
+                continue
+
+            distances = distances_from(i, captured)
+            uncaptured = full ^ captured
+            while uncaptured:
+                bit = uncaptured & -uncaptured
+                uncaptured ^= bit
+                j = bit.bit_length() - 1
+
+                if distances[j] >= 0:
+                    moves = costs[i] + distances[j]
+                    if moves < cost[captured | bit][j]:
+                        cost[captured | bit][j] = moves
+                        previous[captured | bit][j] = i
+
+    # pick the cheapest final capture
+    last = min(range(n), key=lambda j: cost[full][j])
+    if cost[full][last] == infinity:
+        return None
+
+    # rebuild the capture order by following previous back to the start
+    order = []
+    captured = full
+    while last != -1:
+        order.append(last)
+        captured, last = captured ^ (1 << last), previous[captured][last]
+    order.reverse()
+
+    # rebuild the moves between consecutive captures
+    path = [start]
+    captured = 0
+    for j in order:
+        path.extend( geometry.shortest_path(piece_type, path[-1], pawns[j], standing[captured], stats) )
+        captured |= 1 << j
+
+    return (cost[full][order[-1]], path)
+
+
+# This method returns the estimate astar_collect and anytime_collect use:
+#  estimate(square, left) is a lower bound on the moves it takes to capture
+#  the pawns in the bitmask left (indexes into pawns) from square, which is
+#  start or one of the pawns. It is the larger of
+#   - the empty-board distance to the farthest pawn left, and
+#   - the empty-board distance to the nearest pawn left, plus the weight
+#     of a minimum spanning tree over the pawns left (every order of
+#     captures after the first one is a path that spans them).
+#  None is returned if some pawn can't be reached from start at all.
+def capture_estimate(piece_type, start, pawns, geometry=None):
+
+    if geometry is None:
+        geometry = DEFAULT_GEOMETRY
+    n = len(pawns)
+
+    # empty[a][b] is a lower bound on the moves from a to b (read from the
+    #  tablebase, if one is loaded, by empty_board_distances and lower_bound)
+    if geometry.standard:
+        empty = empty_board_distances(piece_type)
+    else:
+        empty = { a: { b: geometry.lower_bound(piece_type, a, b) for b in pawns } for a in [start] + pawns }
+
+    # a pawn the piece can't reach on an empty board (a bishop's pawn on the
+    #  other colour) can't be captured at all. The others can all reach
+    #  each other through the start, pawns or not, since a one-square step
+    #  of any path can't be blocked.
+    for pawn in pawns:
+        if empty[start][pawn] < 0 or empty[start][pawn] == UNREACHABLE:
+            return None
+
+    # weight of the minimum spanning tree over the pawns in left (Prim's
+    #  algorithm on empty-board distances), saved per bitmask
+    spanning_trees = {}
+
+    def spanning_tree(left):
+        if left not in spanning_trees:
+            squares = [pawns[i] for i in range(n) if left >> i & 1]
+            row = empty[squares[0]]
+            connect = [row[square] for square in squares[1:]]
+            weight = 0
+            while connect:
+                nearest = connect.index(min(connect))
+                weight += connect.pop(nearest)
+                row = empty[ squares.pop(nearest + 1) ]
+                for i in range(len(connect)):
+                    connect[i] = min(connect[i], row[squares[i + 1]])
+            spanning_trees[left] = weight
+        return spanning_trees[left]
+
+    def estimate(square, left):
+        row = empty[square]
+        distances = [ row[pawns[i]] for i in range(n) if left >> i & 1 ]
+        return max(min(distances) + spanning_tree(left), max(distances))
+
+    return estimate
+
+
+# This method finds the minimum number of moves it takes a chess piece to
+#  capture all the opposing pieces on the board with an A* search. start is
+#  the piece's square and pawns is a list of pawn squares. A tuple of the
+#  minimum number of moves and the list of squares visited (starting with
+#  start) is returned, or None if some pawn can't be reached.
+#
+#  A state is the square of the last capture (or the start) plus the bitmask
+#  of pawns left, packed into one integer (left << 6 | square on the 8x8
+#  board). Its children are the captures of each pawn left, costing the
+#  distance to that pawn with the pawns left blocking the way (as in
+#  held_karp_collect). Each state is expanded at most once. The estimate of
+#  the moves still needed comes from capture_estimate.
+#  Pawns can only make distances longer, so neither estimate is too high,
+#  and neither drops by more than the cost of a capture, so the first goal
+#  state taken off the heap is optimal.
+#  stats and geometry work as in held_karp_collect. On boards other than
+#  8x8 the empty-board distances are replaced by BoardGeometry.lower_bound,
+#  and a state packs the square into as many bits as the board needs.
+def astar_collect(piece_type, start, pawns, stats=None, geometry=None):
+
+    n = len(pawns)
+    if n == 0:
+        return (0, [start])
+
+    if geometry is None:
+        geometry = DEFAULT_GEOMETRY
+
+    estimate = capture_estimate(piece_type, start, pawns, geometry)
+    if estimate is None:
+        return None
+
+    full = (1 << n) - 1
+    square_bits = (geometry.size - 1).bit_length()
+    square_mask = (1 << square_bits) - 1
+
+    # standing[left] is the bitboard of the pawns in the bitmask left
+    standing = pawn_subsets(pawns)
+
+    # pieces that only leap jump over pawns, so their distances don't depend
+    #  on which pawns are left
+    blocking = bool(PIECE_SPECS[piece_type].slides)
+    distance_cache = {}
+
+    def distances_from(square, left):
+        key = (square, standing[left] if blocking else 0)
+        if key not in distance_cache:
+            distance_cache[key] = geometry.target_distances(piece_type, square, pawns, key[1], stats)
+        return distance_cache[key]
+
+    start_state = full << square_bits | start
+    best = {start_state: 0}
+    parent = {start_state: -1}
+    closed = set()
+
+    # heap entries are (moves + estimate, -moves, state): ties go to the
+    #  deeper state, which is closer to a goal
+    heap = [(estimate(start, full), 0, start_state)]
+
+    while heap:
+        f, moves, state = heapq.heappop(heap)
+        if state in closed:
+            continue
+        closed.add(state)
+
+        square = state & square_mask
+        left = state >> square_bits
+        moves = -moves
+
+        # every pawn has been captured
+        if left == 0:
+            break
+
+        distances = distances_from(square, left)
+        bits = left
+        while bits:
+            bit = bits & -bits
+            bits ^= bit
+            pawn = pawns[bit.bit_length() - 1]
+
+            if distances[pawn] < 0:
+                continue
+
+            next_state = (left ^ bit) << square_bits | pawn
+            next_moves = moves + distances[pawn]
+            if next_state in closed or best.get(next_state, next_moves + 1) <= next_moves:
+                continue
+
+            best[next_state] = next_moves
+            parent[next_state] = state
+            next_estimate = estimate(pawn, left ^ bit) if left ^ bit else 0
+            heapq.heappush(heap, (next_moves + next_estimate, -next_moves, next_state))
+
+    else:
+        # this line would be reached if some pawn can't be captured
+        return None
+
+    # walk the parents back to the start to get the capture order
+    order = []
+    while state != -1:
+        order.append(state)
+        state = parent[state]
+    order.reverse()
+
+    # rebuild the moves between consecutive captures
+    path = [start]
+    for state in order[1:]:
+        path.extend( geometry.shortest_path(piece_type, path[-1], state & square_mask, standing[parent[state] >> square_bits], stats) )
+
+    return (moves, path)
+
+
+# This method finds a short way for a chess piece to capture all the
+#  opposing pieces on the board within a budget, and keeps improving it
+#  until the budget runs out. It returns a tuple of the fewest moves found,
+#  the list of squares visited (as in astar_collect), and a proven lower
+#  bound on the minimum: when the two are equal the result is optimal.
+#  None is returned if some pawn can't be reached.
+#
+#  It is a depth-first branch and bound over the same states as
+#  astar_collect. The children of a state are tried nearest capture first,
+#  so the first solution is the greedy one (always capture the nearest pawn
+#  left), and after that any state whose moves plus estimate (from
+#  capture_estimate) can't beat the best solution is skipped. A state
+#  already reached in as few moves is skipped too. When the search is
+#  stopped, every capture order it hasn't ruled out runs through a state
+#  still on its stack, so the lowest moves plus estimate there is a lower
+#  bound; when it finishes, the best solution is optimal.
+#  The search stops after time_budget seconds, after expanding node_budget
+#  states, or once stop (a threading.Event, set from a signal handler for
+#  example) is set, but never before the first solution is found. Without
+#  any of them it runs until it is done, like astar_collect.
+#  stats and geometry work as in held_karp_collect.
+def anytime_collect(piece_type, start, pawns, time_budget=None, node_budget=None, stop=None, stats=None, geometry=None):
+
+    n = len(pawns)
+    if n == 0:
+        return (0, [start], 0)
+
+    if geometry is None:
+        geometry = DEFAULT_GEOMETRY
+
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+
+    estimate = capture_estimate(piece_type, start, pawns, geometry)
+    if estimate is None:
+        return None
+
+    full = (1 << n) - 1
+    square_bits = (geometry.size - 1).bit_length()
+
+    # this returns the bitboard of the pawns in the bitmask left (a list of
+    #  every subset, as astar_collect uses, is too big for many pawns)
+    def standing(left):
+        bitboard = 0
+        while left:
+            bit = left & -left
+            left ^= bit
+            bitboard |= 1 << pawns[bit.bit_length() - 1]
+        return bitboard
+
+    # pieces that only leap jump over pawns, so their distances don't depend
+    #  on which pawns are left
+    blocking = bool(PIECE_SPECS[piece_type].slides)
+    distance_cache = {}
+
+    def distances_from(square, left):
+        key = (square, standing(left) if blocking else 0)
+        if key not in distance_cache:
+            distance_cache[key] = geometry.target_distances(piece_type, square, pawns, key[1], stats)
+        return distance_cache[key]
+
+    # nodes[k] is (square, pawns left, moves, parent node), and the stack
+    #  holds (moves + estimate, node) for the nodes still to expand
+    nodes = [(start, full, 0, -1)]
+    stack = [(estimate(start, full), 0)]
+    fewest = {full << square_bits | start: 0}
+    best = -1
+    best_moves = float('inf')
+    expanded = 0
+
+    while stack:
+        if best >= 0 and ( (deadline is not None and time.perf_counter() >= deadline)
+                           or (node_budget is not None and expanded >= node_budget)
+                           or (stop is not None and stop.is_set()) ):
+            break
+
+        f, node = stack.pop()
+        square, left, moves, parent = nodes[node]
+        if f >= best_moves or fewest[left << square_bits | square] < moves:
+            continue
+        expanded += 1
+
+        distances = distances_from(square, left)
+        children = []
+        bits = left
+        while bits:
+            bit = bits & -bits
+            bits ^= bit
+            pawn = pawns[bit.bit_length() - 1]
+            if distances[pawn] < 0:
+                continue
+
+            next_moves = moves + distances[pawn]
+            if left == bit:
+                if next_moves < best_moves:
+                    nodes.append( (pawn, 0, next_moves, node) )
+                    best = len(nodes) - 1
+                    best_moves = next_moves
+                continue
+
+            state = (left ^ bit) << square_bits | pawn
+            next_f = next_moves + estimate(pawn, left ^ bit)
+            if next_f >= best_moves or fewest.get(state, next_moves + 1) <= next_moves:
+                continue
+            fewest[state] = next_moves
+            children.append( (distances[pawn], next_f, pawn, left ^ bit, next_moves) )
+
+        # the nearest capture goes on the stack last, so it is tried first
+        children.sort(reverse=True)
+        for distance, next_f, pawn, next_left, next_moves in children:
+            nodes.append( (pawn, next_left, next_moves, node) )
+            stack.append( (next_f, len(nodes) - 1) )
+
+    if best < 0:
+        return None
+
+    lower_bound = min( [best_moves] + [f for f, node in stack] )
+
+    # walk the parents back to the start to get the capture order
+    order = []
+    node = best
+    while node != -1:
+        order.append( nodes[node] )
+        node = nodes[node][3]
+    order.reverse()
+
+    # rebuild the moves between consecutive captures
+    path = [start]
+    for (square, left, moves, parent), (pawn, next_left, next_moves, node) in zip(order, order[1:]):
+        path.extend( geometry.shortest_path(piece_type, square, pawn, standing(left), stats) )
+
+    return (best_moves, path, lower_bound)
+
+
+# This method shortens route, a list of node numbers that starts at node 0
+#  and visits every other node once, for the moves cost[a][b] from node a to
+#  node b (cost must be symmetric). The route is changed in place, with
+#  2-opt moves (reverse a stretch of the route) and Or-opt moves (move a
+#  stretch of 1 to 3 nodes elsewhere, either way round), until none of them
+#  makes it shorter. The first node stays first, and the route ends
+#  anywhere.
+def improve_route(route, cost):
+
+    improved = True
+    while improved:
+        improved = False
+
+        # 2-opt: reverse route[i..k]
+        for i in range(1, len(route) - 1):
+            for k in range(i + 1, len(route)):
+                before, first, last = route[i - 1], route[i], route[k]
+                change = cost[before][last] - cost[before][first]
+                if k + 1 < len(route):
+                    change += cost[first][route[k + 1]] - cost[last][route[k + 1]]
+                if change < 0:
+                    route[i:k + 1] = route[i:k + 1][::-1]
+                    improved = True
+
+        # Or-opt: take out route[i:i + length] and put it back between the
+        #  two nodes where it adds the fewest moves
+        for length in (1, 2, 3):
+            for i in range(1, len(route) - length + 1):
+                stretch = route[i:i + length]
+                rest = route[:i] + route[i + length:]
+                saved = cost[route[i - 1]][stretch[0]]
+                if i + length < len(route):
+                    saved += cost[stretch[-1]][route[i + length]] - cost[route[i - 1]][route[i + length]]
+
+                best = (0, None)
+                for j in range(len(rest)):
+                    for ends in ( (stretch[0], stretch[-1]), (stretch[-1], stretch[0]) ):
+                        added = cost[rest[j]][ends[0]]
+                        if j + 1 < len(rest):
+                            added += cost[ends[1]][rest[j + 1]] - cost[rest[j]][rest[j + 1]]
+                        if added - saved < best[0]:
+                            best = (added - saved, (j, ends[0] != stretch[0]))
+
+                if best[1] is not None:
+                    j, reverse = best[1]
+                    route[:] = rest[:j + 1] + (stretch[::-1] if reverse else stretch) + rest[j + 1:]
+                    improved = True
+
+    return route
+
+
+# This method finds a short (not always the shortest) way for a chess piece
+#  to capture all the opposing pieces on the board, for more pawns than the
+#  exact solvers can take (it is meant for 20 to 64). It returns a tuple of
+#  the number of moves, the list of squares visited (as in astar_collect),
+#  and the lower bound from capture_estimate, or None if some pawn can't be
+#  reached.
+#
+#  It starts from the greedy order (always capture the nearest pawn left,
+#  with the pawns left blocking the way). It then looks for a shorter order
+#  with improve_route, using the distances between pawns with every pawn
+#  still standing: taking pawns off can only shorten a distance, so these
+#  are upper bounds on the real ones. The improved order is played out
+#  again with the pawns taken off as they are captured, and kept if it is
+#  shorter than the greedy one (an order the standing pawns block is
+#  dropped). This takes about 4 distance map searches per pawn.
+#  stats and geometry work as in held_karp_collect.
+def heuristic_collect(piece_type, start, pawns, stats=None, geometry=None):
+
+    n = len(pawns)
+    if n == 0:
+        return (0, [start], 0)
+
+    if geometry is None:
+        geometry = DEFAULT_GEOMETRY
+
+    estimate = capture_estimate(piece_type, start, pawns, geometry)
+    if estimate is None:
+        return None
+
+    occupancy = 0
+    for pawn in pawns:
+        occupancy |= 1 << pawn
+
+    # this returns the squares visited when the pawns are captured in order
+    #  (a list of indexes into pawns), or None if a pawn is blocked off
+    def play(order):
+        path = [start]
+        standing = occupancy
+        for j in order:
+            moves = geometry.shortest_path(piece_type, path[-1], pawns[j], standing, stats)
+            if moves is None:
+                return None
+            path.extend(moves)
+            standing &= ~(1 << pawns[j])
+        return path
+
+    # greedy order: the nearest pawn left, with the pawns left in the way
+    order = []
+    square = start
+    left = list(range(n))
+    standing = occupancy
+    while left:
+        distances = geometry.target_distances(piece_type, square, [pawns[j] for j in left], standing, stats)
+        reachable = [ j for j in left if distances[pawns[j]] >= 0 ]
+        if not reachable:
+            return None
+        j = min( reachable, key=lambda j: distances[pawns[j]] )
+        order.append(j)
+        left.remove(j)
+        square = pawns[j]
+        standing &= ~(1 << square)
+    best_path = play(order)
+
+    # cost[a][b] is the distance from node a to node b (node 0 is start,
+    #  node j + 1 is pawns[j]) with every pawn but a standing; pawns it
+    #  can't reach that way get a distance longer than any real one
+    cost = []
+    for square in [start] + pawns:
+        distances = geometry.target_distances(piece_type, square, pawns, occupancy & ~(1 << square), stats)
+        cost.append( [0] + [ distances[pawn] if distances[pawn] >= 0 else geometry.size for pawn in pawns ] )
+
+    route = improve_route([0] + [j + 1 for j in order], cost)
+    if route[1:] != [j + 1 for j in order]:
+        path = play([node - 1 for node in route[1:]])
+        if path is not None and len(path) < len(best_path):
+            best_path = path
+
+    return (len(best_path) - 1, best_path, estimate(start, (1 << n) - 1))
 
 
 # This method checks if a given postion is a real position on the board
@@ -515,66 +3557,173 @@ def is_valid_position(pos):
     return True
 
 
+# This method returns the bitboard index (0-63) of a position such as 'e4'.
+def square_index(position):
+    return (int(position[1]) - 1) * 8 + chess_columns_aN.get(position[0].lower()) - 1
+
+
+# This method returns the position (ex: 'e4') of a bitboard index.
+def square_name(square):
+    return chess_columns_Na.get(square % 8 + 1) + str(square // 8 + 1)
+
+
+# This method converts a list of positions into a bitboard.
+def positions_to_bitboard(positions):
+    bitboard = 0
+    for pos in positions:
+        bitboard |= 1 << square_index(pos)
+    return bitboard
+
+
+# This method yields the squares set in a bitboard, lowest square first.
+def bitboard_squares(bitboard):
+    while bitboard:
+        lowest = bitboard & -bitboard
+        yield lowest.bit_length() - 1
+        bitboard ^= lowest
+
+
+# This method converts a bitboard into a list of positions, ordered from
+#  a1 to h8 along each row.
+def bitboard_to_positions(bitboard):
+    return [square_name(square) for square in bitboard_squares(bitboard)]
+
+
 # This method generates a chessboard and returns a list of lists
 #  where all spaces are 'empty' and marked by a '.'
-def new_board():
+#  The board is 8x8 unless a BoardGeometry is given.
+def new_board(geometry=None):
+    if geometry is not None:
+        return geometry.new_board()
     board = []
     for x in range(0,8):
         board.append( ['.','.','.','.','.','.','.','.'] )
     return board
 
 
+# This method returns the BoardGeometry of a board from new_board.
+def board_geometry(board):
+    return get_geometry(len(board), len(board[0]))
+
+
 # This method takes a board parameter and prints out a string
 #  representation of the chessboard in its current state.
+#  Boards of any size are printed, with the columns as wide as the
+#  longest file name.
 def print_board(board):
-    for row in range(7, -1, -1):    
-        row_string = str(row+1) + ' '
-        for col in range(0,8):
-            row_string = row_string + board[col][row] + ' '
+
+    geometry = board_geometry(board)
+    names = [ geometry.file_name(col) for col in range(geometry.files) ]
+    width = max( len(name) for name in names )
+    label = len( str(geometry.ranks) )
+
+    for row in range(geometry.ranks - 1, -1, -1):
+        row_string = str(row+1).rjust(label) + ' '
+        for col in range(0, geometry.files):
+            row_string = row_string + board[col][row].ljust(width) + ' '
         print(row_string)
-    print('  a b c d e f g h')
+    print( ' ' * label + ' ' + ' '.join( name.ljust(width) for name in names ).rstrip() )
 
 
 # This method checks a postion on a board and returns its current value.
 #  This value may be a chess piece or '.'
 def get_position(board, position):
-    return board[ chess_columns_aN.get(position[0])-1 ][ int(position[1])-1 ]
+    file, rank = board_geometry(board).parse_position(position)
+    return board[file][rank]
 
 
-# This method generates 8 pawns and randomly places them on the given board.
+# This method generates pawns (8 by default) and randomly places them on the
+#  empty spaces of the given board. The pawns are drawn with a partial
+#  Fisher-Yates shuffle of the empty spaces, so no draw is ever rejected.
+#  rng is the random number generator to draw from (a random.Random, for
+#  repeatable boards), or the random module if it is left out. A count
+#  that isn't a whole number from 0 to the number of empty spaces raises
+#  ValueError.
 #  This method returns a list of the pawns' postions.
-def set_pawns(board):
+def set_pawns(board, count=8, rng=None):
 
-    # the list of pawn positions to be returned
-    pawns = []
+    if rng is None:
+        rng = random
+
+    # the empty spaces, in the same order for the same board
+    geometry = board_geometry(board)
+    empty = [ geometry.file_name(x) + str(y+1) for x in range(geometry.files) for y in range(geometry.ranks) if board[x][y] == '.' ]
+    if not isinstance(count, int) or isinstance(count, bool) or not 0 <= count <= len(empty):
+        raise ValueError('Pawn count {} not accepted (0 to {}).'.format(count, len(empty)))
+
+    # shuffle a random empty space into each of the first count places
+    for i in range(count):
+        j = rng.randrange(i, len(empty))
+        empty[i], empty[j] = empty[j], empty[i]
+
+    # place the pawns and return their positions
+    pawns = empty[:count]
+    for pos in pawns:
+        file, rank = geometry.parse_position(pos)
+        board[file][rank] = 'p'
 
-    # generate random positions for the 8 pawns
-    while len(pawns) < 8:
-        pos = chess_columns_Na.get(random.randint(1,8)) + str(random.randint(1,8))
-        
-        # if no other piece is in the position, place the pawn and add its position to the list
-        if get_position(board, pos) == '.':
-            board[ chess_columns_aN.get(pos[0])-1 ][ int(pos[1])-1 ] = 'p'
-            pawns.append(pos)
-            
     return pawns
 
 
+# This method generates count random scenarios, each a tuple of a start square
+#  and a bitboard of pawns (count of them, never on the start square). The
+#  same seed always gives the same scenarios. If start is given, every
+#  scenario starts from that square. Scenarios are generated one at a time,
+#  so any number of them can be streamed.
+#  Each scenario is a partial Fisher-Yates shuffle of the 64 squares (or
+#  the size squares of a larger board): the first square drawn is the
+#  start, and the next ones are the pawns.
+def generate_scenarios(count, pawns=8, seed=None, start=None, size=64):
+
+    rng = random.Random(seed)
+    squares = list(range(size))
+    pawns = max(0, min(pawns, size - 1))
+
+    for n in range(count):
+
+        # draw the start square into place 0 (or put the given one there)
+        i = rng.randrange(size) if start is None else squares.index(start)
+        squares[0], squares[i] = squares[i], squares[0]
+
+        # draw the pawns into places 1 to pawns
+        pawn_mask = 0
+        for k in range(1, pawns + 1):
+            j = rng.randrange(k, size)
+            squares[k], squares[j] = squares[j], squares[k]
+            pawn_mask |= 1 << squares[k]
+
+        yield (squares[0], pawn_mask)
+
+
+# This method calculates and returns the space on the board that takes the given
+#  piece the most moves to reach, with the given opposing pieces in the way,
+#  and that number of moves.
+def get_farthest_by_moves(piece, opp_pieces=[]):
+
+    distances = distance_map(piece.piece_type, piece.square, positions_to_bitboard(opp_pieces))
+    farthest, moves = farthest_in_map(distances, piece.square)
+
+    return [square_name(farthest), moves]
+
+
 # This method calculates and returns the farthest space on the board from the given piece.
+#  The farthest space is always a corner, so only the corners are checked, in
+#  the order a1, a8, h1, h8 (on the 8x8 board) so ties go to the first one.
 def get_farthest(piece):
 
     # the list to be returned
     farthest = ['',0]
+    geometry = piece.geometry
 
-    # calculate the distance between each space and the given piece
-    for x in range(1,9):
-        for y in range(1,9):
+    # calculate the distance between each corner and the given piece
+    for x in (1, geometry.files):
+        for y in (1, geometry.ranks):
             distance = math.dist( [piece.column, piece.row], [x,y] )
             
             # update the list when this space is farther from the piece than what is 
             #  currently in the list
             if distance > farthest[1]:
-                farthest[0] = chess_columns_Na.get(x) + str(y)
+                farthest[0] = geometry.file_name(x - 1) + str(y)
                 farthest[1] = distance
                 
     return farthest
@@ -0,0 +1,166 @@
+import numpy as np
+
+import chess
+
+# This module has vectorized versions of the chess program's move generation
+#  and searches, for analytics over many boards at once. It needs NumPy,
+#  which the rest of the program does not.
+#  Boards are NumPy uint64 arrays of bitboards, using the same square numbers
+#  as chess.py (a1 = 0, h8 = 63). Move sets are computed for whole sets of
+#  squares at once with shift-and-mask fills (Kogge-Stone), so there are no
+#  Python loops over boards or squares: each step works on every board.
+#
+# Example:
+#  occupancy = positions_to_bitboards([['d4', 'e5'], ['a2']])
+#  distances = batch_distance_maps('QUEEN', [0, 63], occupancy)
+
+
+# the a file, and every square
+FILE_A = np.uint64(0x0101010101010101)
+ALL_FILES = ~np.uint64(0)
+
+# (leap shifts, slide shifts) by piece spec, see piece_shifts
+PIECE_SHIFTS = {}
+
+
+# This method returns the (shift, mask) for a move of dc files and dr ranks:
+#  a positive shift moves toward higher squares, and the mask removes the
+#  files a move from the other side of the board wrapped onto (the first dc
+#  files when dc > 0, the last -dc when it is < 0).
+def move_shift(dc, dr):
+
+    mask = ALL_FILES
+    for file in range(8):
+        if file < dc or file >= 8 + dc:
+            mask &= ~(FILE_A << np.uint64(file))
+
+    return (dr * 8 + dc, mask)
+
+
+# This method returns a tuple of the (shift, mask) pairs of the given piece
+#  type's leaps and of its slides, made from its chess.PieceSpec the first
+#  time they are needed.
+def piece_shifts(piece_type):
+
+    spec = chess.PIECE_SPECS[piece_type]
+    shifts = PIECE_SHIFTS.get(spec)
+    if shifts is None:
+        shifts = ( tuple(move_shift(dc, dr) for dc, dr in spec.leaps),
+                   tuple(move_shift(dc, dr) for dc, dr in spec.slides) )
+        PIECE_SHIFTS[spec] = shifts
+    return shifts
+
+
+# This method shifts an array of bitboards by amount squares (left when
+#  amount is positive, right when it is negative).
+def shift(bitboards, amount):
+    if amount > 0:
+        return bitboards << np.uint64(amount)
+    return bitboards >> np.uint64(-amount)
+
+
+# This method returns the squares every piece in pieces can slide to in one
+#  direction, stopping at (and including) the first occupied square. The
+#  pieces are grown through the empty squares in steps of 1, 2 and 4 squares
+#  (an occluded fill), then moved one more square onto the blocker.
+def slide(pieces, empty, amount, mask):
+
+    empty = empty & mask
+    pieces = pieces | (empty & shift(pieces, amount))
+    empty = empty & shift(empty, amount)
+    pieces = pieces | (empty & shift(pieces, 2 * amount))
+    empty = empty & shift(empty, 2 * amount)
+    pieces = pieces | (empty & shift(pieces, 4 * amount))
+
+    return shift(pieces, amount) & mask
+
+
+# This method returns, for each board, the bitboard of squares that any of
+#  the given piece type's pieces can move to. pieces and occupancy are uint64
+#  arrays with one bitboard per board.
+def batch_moves(piece_type, pieces, occupancy):
+
+    pieces = np.asarray(pieces, dtype=np.uint64)
+    moves = np.zeros_like(pieces)
+    leaps, slides = piece_shifts(piece_type)
+
+    for amount, mask in leaps:
+        moves |= shift(pieces, amount) & mask
+
+    empty = ~np.asarray(occupancy, dtype=np.uint64)
+    for amount, mask in slides:
+        moves |= slide(pieces, empty, amount, mask)
+
+    return moves
+
+
+# This method converts an array of N bitboards into an (N, 64) boolean
+#  matrix where column k is set when square k is in the bitboard.
+def bitboards_to_matrix(bitboards):
+    as_bytes = np.asarray(bitboards, dtype='<u8').view(np.uint8).reshape(-1, 8)
+    return np.unpackbits(as_bytes, axis=1, bitorder='little').astype(bool)
+
+
+# This method converts a list of pawn position lists (ex: [['e4', 'd5'], []])
+#  into a uint64 array of occupancy bitboards.
+def positions_to_bitboards(position_lists):
+    return np.array([chess.positions_to_bitboard(positions) for positions in position_lists], dtype=np.uint64)
+
+
+# This method runs a Breadth-first search on every board at once, one layer
+#  per step, and returns an (N, 64) int16 array with the minimum number of
+#  moves from each board's start square to every square (-1 if a square
+#  can't be reached). Pawns block sliding pieces and can be captured but are
+#  not removed, as in chess.distance_map.
+def batch_distance_maps(piece_type, starts, occupancy):
+
+    starts = np.asarray(starts, dtype=np.int64)
+    occupancy = np.asarray(occupancy, dtype=np.uint64)
+
+    distances = np.full( (len(starts), 64), -1, dtype=np.int16 )
+    distances[np.arange(len(starts)), starts] = 0
+
+    frontier = np.left_shift( np.uint64(1), starts.astype(np.uint64) )
+    visited = frontier.copy()
+    moves = 0
+
+    # boards whose search has finished have an empty frontier and drop out
+    while frontier.any():
+        moves += 1
+        reached = batch_moves(piece_type, frontier, occupancy) & ~visited
+        visited |= reached
+        distances[ bitboards_to_matrix(reached) ] = moves
+        frontier = reached
+
+    return distances
+
+
+# This method returns the minimum number of moves from each board's start
+#  square to its target square (-1 if the target can't be reached).
+def batch_bfs(piece_type, starts, targets, occupancy):
+    distances = batch_distance_maps(piece_type, starts, occupancy)
+    return distances[ np.arange(len(distances)), np.asarray(targets, dtype=np.int64) ]
+
+
+# This method is the batch version of chess.get_farthest: for each square in
+#  squares it returns the farthest square on the board (ties going to the same
+#  square get_farthest picks) and its distance, as two arrays.
+def batch_get_farthest(squares):
+
+    squares = np.asarray(squares, dtype=np.int64)
+    columns = squares % 8 + 1
+    rows = squares // 8 + 1
+
+    # candidate spaces in the order get_farthest checks them: a1, a2, ..., h8
+    candidate_columns = np.repeat(np.arange(1, 9), 8)
+    candidate_rows = np.tile(np.arange(1, 9), 8)
+
+    # compare squared distances, which are exact integers, and take the first
+    #  maximum like get_farthest does
+    squared = (columns[:, None] - candidate_columns) ** 2 + (rows[:, None] - candidate_rows) ** 2
+    farthest = np.argmax(squared, axis=1)
+
+    farthest_squares = (candidate_rows[farthest] - 1) * 8 + candidate_columns[farthest] - 1
+    distances = np.sqrt( squared[np.arange(len(squares)), farthest] )
+
+    return (farthest_squares, distances)
@@ -1,5 +1,32 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import random
+import signal
+import tempfile
+import threading
 import unittest
-from chess import Queen, Rook, Knight, Space, is_valid_position, get_farthest, target_mode, collector_mode
+import unittest.mock
+
+try:
+    import numpy
+    import chess_numpy
+except ImportError:
+    numpy = None
+import chess
+from chess import Queen, Rook, Knight, Space, BFS, is_valid_position, get_farthest, target_mode, collector_mode, \
+    square_index, square_name, positions_to_bitboard, bitboard_to_positions, sliding_moves, rook_moves, queen_moves, \
+    load_sliding_tables, ROOK_RAYS, QUEEN_RAYS, generate_moves, bitboard_squares, held_karp_collect, \
+    astar_collect, distance_map, get_farthest_by_moves, bidirectional_search, \
+    run_batch, solve_scenario, solve_batch_line, set_pawns, generate_scenarios, write_scenarios, new_board, new_stats, BFS_pq, \
+    knight_distance, closed_form_distance, BoardGeometry, get_geometry, parse_board_size, print_board, \
+    write_tablebase, load_tablebase, unload_tablebases, empty_board_distances, UNREACHABLE, \
+    SolverServer, parse_address, Solver, Bishop, King, PIECE_CLASSES, PIECE_SPECS, PieceSpec, register_piece, leaper, \
+    MOVE_FUNCTIONS, perft, legacy_moves, DistanceMap, capture_distances, pawn_subsets, anytime_collect, \
+    heuristic_collect, improve_route
 
 # This class tests the different chess piece and space objects in chess.py,
 #  as well as some of the helper methods and "run modes" in the program.
@@ -285,6 +312,12 @@ class TestChess(unittest.TestCase):
         self.assertEqual( test_space1.pawns, test_pawns )
 
 
+        # spaces don't share their default lists
+        test_space0.pawns.append('a1')
+        self.assertEqual( Space( 5, 4, 2 ).pawns, [] )
+        self.assertFalse( hasattr(test_space0, '__dict__') )
+
+
     # Test Space's prioritize method used for the priority queue
     def test_Space_2(self):
 
@@ -348,6 +381,1069 @@ class TestChess(unittest.TestCase):
             self.assertEqual( get_farthest(test_piece)[0], positions.get(test_piece.position) )
 
 
+    # Test conversions between positions, square indexes and bitboards
+    def test_bitboard_0(self):
+
+        # every position maps to a unique square and back again
+        squares = set()
+
+        for x in 'abcdefgh':
+            for y in '12345678':
+                square = square_index(x + y)
+                squares.add(square)
+                self.assertEqual( square_name(square), x + y )
+
+        self.assertEqual( squares, set(range(64)) )
+
+        # a few known squares
+        self.assertEqual( square_index('a1'), 0 )
+        self.assertEqual( square_index('h1'), 7 )
+        self.assertEqual( square_index('a8'), 56 )
+        self.assertEqual( square_index('h8'), 63 )
+
+        # positions come back ordered from a1 to h8 along each row
+        bitboard = positions_to_bitboard( ['h8', 'e4', 'a1', 'b1'] )
+        self.assertEqual( bitboard, (1 << 63) | (1 << 28) | (1 << 1) | 1 )
+        self.assertEqual( bitboard_to_positions(bitboard), ['a1', 'b1', 'e4', 'h8'] )
+        self.assertEqual( bitboard_to_positions(0), [] )
+
+
+    # Test that calculate_moves returns the same moves as a bitboard
+    #  that calculate_possible_moves returns as a list
+    def test_calculate_moves_0(self):
+
+        pawns = ['e6', 'c2', 'g4', 'b7']
+        occupancy = positions_to_bitboard(pawns)
+
+        for x in 'abcdefgh':
+            for y in '12345678':
+                for test_piece in ( Queen(x + y), Rook(x + y), Knight(x + y) ):
+                    moves = test_piece.calculate_moves(occupancy)
+                    self.assertEqual( bitboard_to_positions(moves), test_piece.calculate_possible_moves(pawns) )
+
+        # the knight's moves from d2 come back in board order
+        self.assertEqual( Knight('d2').calculate_possible_moves(), ['b1', 'f1', 'b3', 'f3', 'c4', 'e4'] )
+
+        # the rook on a1 sees up to and including the pawns on a3 and c1
+        moves = Rook('a1').calculate_moves( positions_to_bitboard(['a3', 'c1']) )
+        self.assertEqual( bitboard_to_positions(moves), ['b1', 'c1', 'a2', 'a3'] )
+
+
+    # Test the occupancy-indexed rook and queen lookups against the ray walk,
+    #  including tables loaded back from a cache file
+    def test_sliding_tables_0(self):
+
+        boards = [ 0,
+                   positions_to_bitboard(['e5','f4','e3','d4']),
+                   positions_to_bitboard(['a2','b7','c3','d8','e1','f6','g5','h4','d5','e6']) ]
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_path = os.path.join(cache_dir, 'tables.bin')
+
+            # the first load builds and writes the cache, the second reads it
+            for i in range(2):
+                load_sliding_tables(cache_path)
+                self.assertTrue( os.path.exists(cache_path) )
+
+                for occupancy in boards:
+                    for square in range(64):
+                        self.assertEqual( rook_moves(square, occupancy), sliding_moves(square, occupancy, ROOK_RAYS) )
+                        self.assertEqual( queen_moves(square, occupancy), sliding_moves(square, occupancy, QUEEN_RAYS) )
+
+            # a damaged cache file (or one cut short) is rebuilt instead of loaded
+            with open(cache_path, 'rb') as cache_file:
+                data = cache_file.read()
+            for damaged in (b'not a table', data[:-8]):
+                with open(cache_path, 'wb') as cache_file:
+                    cache_file.write(damaged)
+                load_sliding_tables(cache_path)
+                self.assertEqual( queen_moves(0, 0), sliding_moves(0, 0, QUEEN_RAYS) )
+
+            # a cache that can't be written is reported on stderr, so it
+            #  doesn't mix with results on stdout
+            output, errors = io.StringIO(), io.StringIO()
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(errors):
+                load_sliding_tables(cache_dir)
+            self.assertEqual( output.getvalue(), '' )
+            self.assertIn( 'Could not write table cache', errors.getvalue() )
+
+
+    # Check that path is a legal way for the piece to capture every pawn,
+    #  with pawns blocking sliding pieces until they are captured
+    def check_collect_path(self, piece_type, start, pawns, moves, path):
+
+        self.assertEqual( path[0], start )
+        self.assertEqual( len(path), moves + 1 )
+
+        standing = set(pawns)
+        for i in range(1, len(path)):
+            occupancy = 0
+            for pawn in standing:
+                occupancy |= 1 << pawn
+            self.assertTrue( generate_moves(piece_type, path[i-1], occupancy) >> path[i] & 1 )
+            standing.discard(path[i])
+
+        self.assertEqual( standing, set() )
+
+
+    # Minimum number of moves to capture every pawn, found by a plain
+    #  Breadth-first search over (square, pawns left) states
+    def reference_collect(self, piece_type, start, pawns):
+
+        all_pawns = (1 << len(pawns)) - 1
+        seen = {(start, all_pawns)}
+        layer = [(start, all_pawns)]
+        moves = 0
+
+        while layer:
+            next_layer = []
+            for square, left in layer:
+                if left == 0:
+                    return moves
+                occupancy = 0
+                for i in range(len(pawns)):
+                    if left >> i & 1:
+                        occupancy |= 1 << pawns[i]
+                for next_square in bitboard_squares( generate_moves(piece_type, square, occupancy) ):
+                    next_left = left
+                    if next_square in pawns:
+                        next_left &= ~(1 << pawns.index(next_square))
+                    if (next_square, next_left) not in seen:
+                        seen.add( (next_square, next_left) )
+                        next_layer.append( (next_square, next_left) )
+            layer = next_layer
+            moves += 1
+
+
+    # Test the Held-Karp collector against the reference search
+    def test_held_karp_0(self):
+
+        # start square followed by pawn squares
+        boards = [ [28, 0, 63, 7, 56],
+                   [0, 1, 8, 9, 2, 16],
+                   [35, 27, 36, 34, 43, 44, 26, 42, 20],
+                   [63, 62, 55, 54, 61, 53, 47],
+                   [12, 5, 30, 41, 58, 19] ]
+
+        for piece_type in ('QUEEN', 'ROOK', 'KNIGHT'):
+            for board in boards:
+                start, pawns = board[0], board[1:]
+                moves, path = held_karp_collect(piece_type, start, pawns)
+
+                self.assertEqual( moves, self.reference_collect(piece_type, start, pawns) )
+                self.check_collect_path(piece_type, start, pawns, moves, path)
+
+        # no pawns, no moves
+        self.assertEqual( held_karp_collect('QUEEN', 10, []), (0, [10]) )
+
+
+    # Test the A* collector against the reference search and Held-Karp
+    def test_astar_0(self):
+
+        # start square followed by pawn squares
+        boards = [ [28, 0, 63, 7, 56],
+                   [0, 1, 8, 9, 2, 16],
+                   [35, 27, 36, 34, 43, 44, 26, 42, 20],
+                   [63, 62, 55, 54, 61, 53, 47],
+                   [12, 5, 30, 41, 58, 19] ]
+
+        for piece_type in ('QUEEN', 'ROOK', 'KNIGHT'):
+            for board in boards:
+                start, pawns = board[0], board[1:]
+                moves, path = astar_collect(piece_type, start, pawns)
+
+                self.assertEqual( moves, self.reference_collect(piece_type, start, pawns) )
+                self.check_collect_path(piece_type, start, pawns, moves, path)
+
+            # larger boards are checked against Held-Karp
+            for board in ( [4, 9, 14, 19, 24, 29, 34, 39, 44, 49, 54],
+                           [60, 1, 3, 5, 7, 17, 19, 21, 23, 41, 43] ):
+                start, pawns = board[0], board[1:]
+                moves, path = astar_collect(piece_type, start, pawns)
+
+                self.assertEqual( moves, held_karp_collect(piece_type, start, pawns)[0] )
+                self.check_collect_path(piece_type, start, pawns, moves, path)
+
+        # no pawns, no moves
+        self.assertEqual( astar_collect('KNIGHT', 10, []), (0, [10]) )
+
+
+    # Test the anytime collector against A*, with and without a budget
+    def test_anytime_0(self):
+
+        for piece_type in ('QUEEN', 'ROOK', 'KNIGHT', 'CHANCELLOR'):
+            for square, pawn_mask in generate_scenarios(10, 7, seed=8):
+                pawns = list( bitboard_squares(pawn_mask) )
+                optimum = astar_collect(piece_type, square, pawns)[0]
+
+                # with no budget the search finishes and proves its result
+                moves, path, lower_bound = anytime_collect(piece_type, square, pawns)
+                self.assertEqual( (moves, lower_bound), (optimum, optimum) )
+                self.check_collect_path(piece_type, square, pawns, moves, path)
+
+                # stopped at once, it still has the greedy solution and a
+                #  lower bound on either side of the optimum
+                stop = threading.Event()
+                stop.set()
+                for budget in ( {'node_budget': 0}, {'time_budget': 0}, {'stop': stop} ):
+                    moves, path, lower_bound = anytime_collect(piece_type, square, pawns, **budget)
+                    self.assertLessEqual( lower_bound, optimum )
+                    self.assertLessEqual( optimum, moves )
+                    self.check_collect_path(piece_type, square, pawns, moves, path)
+
+        # more pawns than the exact solvers can take
+        square, pawn_mask = next( generate_scenarios(1, 40, seed=3) )
+        pawns = list( bitboard_squares(pawn_mask) )
+        moves, path, lower_bound = anytime_collect('KNIGHT', square, pawns, node_budget=2000)
+        self.assertLessEqual( lower_bound, moves )
+        self.check_collect_path('KNIGHT', square, pawns, moves, path)
+
+        self.assertEqual( anytime_collect('QUEEN', 10, []), (0, [10], 0) )
+        self.assertIsNone( anytime_collect('BISHOP', 0, [1]) )
+
+        rook = Solver('ROOK')
+        self.assertEqual( rook.collect('a1', ['a8', 'h8'], 'anytime', node_budget=5),
+                          {'min_moves': 2, 'path': ['a1', 'a8', 'h8'], 'lower_bound': 2, 'optimal': True} )
+        for call in ( lambda: rook.collect('a1', ['a8'], time_budget=1), lambda: rook.collect('a1', ['a8'], 'anytime', node_budget=-1),
+                      lambda: rook.collect('a1', ['a8'], 'anytime', time_budget='1') ):
+            with self.assertRaises(ValueError):
+                call()
+
+
+    # Test the heuristic collector against A*, and with many pawns
+    def test_heuristic_0(self):
+
+        # a route through points on a line, given out of order
+        points = [0, 5, 1, 4, 2, 3]
+        cost = [ [abs(a - b) for b in points] for a in points ]
+        self.assertEqual( improve_route([0, 1, 2, 3, 4, 5], cost), [0, 2, 4, 5, 3, 1] )
+
+        for piece_type in ('QUEEN', 'ROOK', 'KNIGHT', 'CHANCELLOR'):
+            for square, pawn_mask in generate_scenarios(10, 7, seed=9):
+                pawns = list( bitboard_squares(pawn_mask) )
+                optimum = astar_collect(piece_type, square, pawns)[0]
+
+                moves, path, lower_bound = heuristic_collect(piece_type, square, pawns)
+                self.assertLessEqual( lower_bound, optimum )
+                self.assertLessEqual( optimum, moves )
+                self.check_collect_path(piece_type, square, pawns, moves, path)
+
+            for square, pawn_mask in generate_scenarios(2, 40, seed=9):
+                pawns = list( bitboard_squares(pawn_mask) )
+                moves, path, lower_bound = heuristic_collect(piece_type, square, pawns)
+                self.assertLessEqual( lower_bound, moves )
+                self.check_collect_path(piece_type, square, pawns, moves, path)
+
+        self.assertEqual( heuristic_collect('QUEEN', 10, []), (0, [10], 0) )
+        self.assertIsNone( heuristic_collect('BISHOP', 0, [1]) )
+
+        geometry = get_geometry(30, 30)
+        square, pawn_mask = next( generate_scenarios(1, 32, seed=9, size=geometry.size) )
+        result = Solver('ROOK', geometry).collect( geometry.square_name(square), geometry.bitboard_to_positions(pawn_mask), 'heuristic' )
+        self.assertEqual( len(result['path']), result['min_moves'] + 1 )
+        self.assertLessEqual( result['lower_bound'], result['min_moves'] )
+        self.assertEqual( result['optimal'], result['lower_bound'] == result['min_moves'] )
+
+
+    # Test BFS with some known minimum numbers of moves
+    def test_BFS_0(self):
+
+        # piece type, start, target, pawns, minimum # of moves
+        searches = [ ('QUEEN', 'a1', 'h8', [], 1),
+                     ('QUEEN', 'a1', 'h8', ['d4'], 2),
+                     ('QUEEN', 'a1', 'a1', [], 0),
+                     ('ROOK', 'a1', 'h8', [], 2),
+                     ('ROOK', 'a1', 'h8', ['a5', 'e1'], 3),
+                     ('ROOK', 'a1', 'a8', ['a5'], 2),
+                     ('KNIGHT', 'a1', 'h8', [], 6),
+                     ('KNIGHT', 'a1', 'b2', [], 4),
+                     ('KNIGHT', 'a1', 'b2', ['b3', 'c2'], 4) ]
+
+        for piece_type, start, target, pawns, moves in searches:
+            start_space = Space( square_index(start) % 8 + 1, int(start[1]), 0 )
+            target_space = Space( square_index(target) % 8 + 1, int(target[1]), -1 )
+            self.assertEqual( BFS(start_space, target_space, piece_type, pawns), moves )
+
+
+    # Test distance_map against BFS for every target, and its parent squares
+    def test_distance_map_0(self):
+
+        pawns = ['b2', 'd4', 'e4', 'g6', 'c7', 'h3', 'f1', 'a5']
+        occupancy = positions_to_bitboard(pawns)
+
+        for piece_type in ('QUEEN', 'ROOK', 'KNIGHT'):
+            for start in ('a1', 'e5', 'h8'):
+                start_space = Space( square_index(start) % 8 + 1, int(start[1]), 0 )
+                distances, parent = distance_map(piece_type, square_index(start), occupancy, parents=True)
+
+                self.assertEqual( distances, distance_map(piece_type, square_index(start), occupancy) )
+
+                for square in range(64):
+                    target_space = Space( square % 8 + 1, square // 8 + 1, -1 )
+                    self.assertEqual( distances[square], BFS(start_space, target_space, piece_type, pawns) )
+
+                    # the parent is one move closer and one move away
+                    if square != square_index(start):
+                        self.assertEqual( distances[parent[square]], distances[square] - 1 )
+                        self.assertTrue( generate_moves(piece_type, parent[square], occupancy) >> square & 1 )
+
+
+    # Test get_farthest_by_moves on an empty board and behind pawns
+    def test_get_farthest_by_moves(self):
+
+        # on an empty board the queen needs at most 2 moves, the knight
+        #  needs 6 from a corner to the opposite corner
+        self.assertEqual( get_farthest_by_moves(Queen('a1'))[1], 2 )
+        self.assertEqual( get_farthest_by_moves(Knight('a1')), ['h8', 6] )
+
+        # a rook walled in by pawns needs 4 moves to reach h8
+        self.assertEqual( get_farthest_by_moves(Rook('a1'), ['a2', 'b1', 'h7', 'g8']), ['h8', 4] )
+
+
+    # Test bidirectional_search against distance_map, and BFS's option for it
+    def test_bidirectional_search_0(self):
+
+        boards = [ 0,
+                   positions_to_bitboard(['b2', 'd4', 'e4', 'g6', 'c7', 'h3', 'f1', 'a5']),
+                   positions_to_bitboard(['a2', 'b2', 'b1', 'g7', 'h7', 'g8', 'd5', 'e5']) ]
+
+        for piece_type in ('QUEEN', 'ROOK', 'KNIGHT'):
+            for occupancy in boards:
+                for start in (0, 27, 62):
+                    distances = distance_map(piece_type, start, occupancy)
+
+                    for target in range(64):
+                        moves, forward, backward = bidirectional_search(piece_type, start, target, occupancy)
+                        self.assertEqual( moves, distances[target] )
+
+        # both sides expand squares when the ends are far apart
+        moves, forward, backward = bidirectional_search('KNIGHT', 0, 63)
+        self.assertEqual( moves, 6 )
+        self.assertTrue( forward > 0 and backward > 0 )
+
+        start_space = Space(1, 1, 0)
+        target_space = Space(8, 8, -1)
+        self.assertEqual( BFS(start_space, target_space, 'ROOK', ['a5', 'e1'], bidirectional=True), 3 )
+        self.assertEqual( target_mode(Rook('c3'), bidirectional=True), 1 )
+
+        # the layered search on boards that aren't 8x8
+        for files, ranks in ( (12, 10), (5, 17) ):
+            geometry = BoardGeometry(files, ranks)
+            rng = random.Random(files)
+            for piece_type in ('QUEEN', 'BISHOP', 'KNIGHT', 'KING'):
+                occupancy = sum( 1 << square for square in rng.sample(range(geometry.size), 20) )
+                for start in (0, geometry.size // 2, geometry.size - 1):
+                    distances = geometry.distance_map(piece_type, start, occupancy & ~(1 << start))
+                    for target in range(geometry.size):
+                        moves = geometry.bidirectional_search(piece_type, start, target, occupancy & ~(1 << start))[0]
+                        self.assertEqual( moves, distances[target] )
+
+        stats = new_stats()
+        moves, forward, backward = BoardGeometry(30, 30).bidirectional_search('KNIGHT', 0, 899, stats=stats)
+        self.assertEqual( moves, 20 )
+        self.assertTrue( forward > 0 and backward > 0 )
+        self.assertEqual( stats['popped'], forward + backward )
+
+
+    # Test solve_scenario with given pawns in every mode
+    def test_solve_scenario_0(self):
+
+        pawns = ['e5', 'f5', 'f4', 'f3', 'e3', 'd3', 'd4', 'd5']
+
+        result = solve_scenario( {'piece': 'queen', 'position': 'e4', 'mode': 'target', 'pawns': pawns} )
+        self.assertEqual( result['target'], 'a8' )
+        self.assertEqual( result['min_moves'], 2 )
+
+        result = solve_scenario( {'piece': 'ROOK', 'position': 'a1', 'mode': 'target', 'pawns': ['a5', 'e1'], 'target': 'h8'} )
+        self.assertEqual( result['min_moves'], 3 )
+
+        result = solve_scenario( {'piece': 'KNIGHT', 'position': 'e4', 'mode': 'collect', 'pawns': ['d6', 'c4']} )
+        self.assertEqual( result['min_moves'], 2 )
+        self.assertEqual( result['path'][0], 'e4' )
+
+        # a budget picks the anytime solver
+        result = solve_scenario( {'piece': 'KNIGHT', 'position': 'e4', 'mode': 'collect', 'pawns': ['d6', 'c4'], 'node_budget': 10} )
+        self.assertEqual( (result['min_moves'], result['lower_bound'], result['optimal']), (2, 2, True) )
+
+        result = solve_scenario( {'piece': 'Knight', 'position': 'd2', 'id': 7} )
+        self.assertEqual( result['moves'], ['b1', 'f1', 'b3', 'f3', 'c4', 'e4'] )
+        self.assertEqual( result['id'], 7 )
+
+        # random pawns are placed when none are given
+        result = solve_scenario( {'piece': 'QUEEN', 'position': 'a1', 'mode': 'collect'} )
+        self.assertEqual( len(result['pawns']), 8 )
+        self.assertEqual( len(result['path']), result['min_moves'] + 1 )
+
+        # invalid scenarios
+        for scenario in ( {'piece': 'PAWN', 'position': 'e4'},
+                          {'piece': 'QUEEN', 'position': 'e9'},
+                          {'piece': 'QUEEN', 'position': 'e4', 'mode': 'fly'},
+                          {'piece': 'QUEEN', 'position': 'e4', 'mode': 'target', 'pawns': ['e4']},
+                          {'piece': 'QUEEN', 'position': 'e4', 'mode': 'collect', 'pawns': ['a1', 'a1']},
+                          {'piece': 'QUEEN', 'position': 'e4', 'mode': 'collect', 'pawn_count': -3},
+                          {'piece': 'QUEEN', 'position': 'e4', 'mode': 'collect', 'pawn_count': 64} ):
+            with self.assertRaises(ValueError):
+                solve_scenario(scenario)
+
+
+    # Test run_batch, including lines that can't be solved
+    def test_run_batch_0(self):
+
+        lines = [ '{"piece": "ROOK", "position": "a1", "mode": "collect", "pawns": ["a8", "h8"], "id": "x"}',
+                  '',
+                  'not json',
+                  '{"piece": "QUEEN", "position": "z1"}',
+                  '[1, 2]',
+                  '{"piece": "KNIGHT", "position": "a1", "mode": "target", "pawns": [], "target": "b2"}' ]
+
+        output = io.StringIO()
+        count = run_batch( io.StringIO('\n'.join(lines)), output )
+        results = [ json.loads(line) for line in output.getvalue().splitlines() ]
+
+        self.assertEqual( count, 5 )
+        self.assertEqual( len(results), 5 )
+        self.assertEqual( results[0]['id'], 'x' )
+        self.assertEqual( results[0]['min_moves'], 2 )
+        self.assertEqual( [result.get('line') for result in results[1:4]], [3, 4, 5] )
+        self.assertTrue( all('error' in result for result in results[1:4]) )
+        self.assertEqual( results[4]['min_moves'], 4 )
+        self.assertEqual( results[4]['line'], 6 )
+
+        # fields of the wrong type give one error each, and the run goes on
+        lines = [ '{"piece": "QUEEN", "position": "a1", "mode": "collect", "pawns": 5}',
+                  '{"piece": "QUEEN", "position": "a1", "mode": "collect", "seed": [1]}',
+                  '{"piece": "QUEEN", "position": "a1", "mode": "collect", "pawn_count": "3"}',
+                  '{"piece": "QUEEN", "position": "a1", "mode": "collect", "pawns": [5]}',
+                  '{"piece": "QUEEN", "position": "a1", "mode": "target", "target": 5}',
+                  '{"piece": "QUEEN", "position": "a1", "mode": "collect", "pawns": ["b3"]}' ]
+        output = io.StringIO()
+        run_batch( io.StringIO('\n'.join(lines)), output )
+        results = [ json.loads(line) for line in output.getvalue().splitlines() ]
+        self.assertTrue( all('error' in result for result in results[:5]) )
+        self.assertEqual( results[5]['min_moves'], 2 )
+
+
+    # Test run_batch with worker processes, in and out of order
+    def test_run_batch_1(self):
+
+        lines = []
+        for i in range(40):
+            scenario = {'piece': ('QUEEN', 'ROOK', 'KNIGHT')[i % 3],
+                        'position': square_name(i),
+                        'mode': ('collect', 'target')[i % 2],
+                        'pawns': [square_name((i + 7 * k) % 64) for k in range(1, 6)]}
+            lines.append( json.dumps(scenario) )
+        lines.insert(10, 'not json')
+        text = '\n'.join(lines)
+
+        expected = io.StringIO()
+        self.assertEqual( run_batch(io.StringIO(text), expected), 41 )
+
+        ordered = io.StringIO()
+        self.assertEqual( run_batch(io.StringIO(text), ordered, workers=2, chunk_size=3), 41 )
+        self.assertEqual( ordered.getvalue(), expected.getvalue() )
+
+        unordered = io.StringIO()
+        self.assertEqual( run_batch(io.StringIO(text), unordered, workers=2, ordered=False, chunk_size=5), 41 )
+        self.assertEqual( sorted(unordered.getvalue().splitlines()), sorted(expected.getvalue().splitlines()) )
+
+
+    # Test the vectorized move generation and searches against chess.py
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_chess_numpy_0(self):
+
+        pawn_lists = [ [], ['b2', 'd4', 'e4', 'g6', 'c7', 'h3', 'f1', 'a5'], ['a2', 'b2', 'b1', 'g7', 'h7', 'g8'] ]
+        boards = [ (start, pawns) for pawns in pawn_lists for start in (0, 7, 27, 36, 56, 63) ]
+
+        starts = [ start for start, pawns in boards ]
+        occupancy = chess_numpy.positions_to_bitboards( [pawns for start, pawns in boards] )
+
+        for piece_type in PIECE_SPECS:
+
+            # move sets of single pieces
+            pieces = numpy.array( [1 << start for start in starts], dtype=numpy.uint64 )
+            moves = chess_numpy.batch_moves(piece_type, pieces, occupancy)
+
+            # distance maps and single targets
+            distances = chess_numpy.batch_distance_maps(piece_type, starts, occupancy)
+            targets = chess_numpy.batch_bfs(piece_type, starts, [63 - start for start in starts], occupancy)
+
+            for i in range(len(boards)):
+                board_occupancy = int(occupancy[i])
+                expected = distance_map(piece_type, starts[i], board_occupancy)
+
+                self.assertEqual( int(moves[i]), generate_moves(piece_type, starts[i], board_occupancy) )
+                self.assertEqual( list(distances[i]), expected )
+                self.assertEqual( targets[i], expected[63 - starts[i]] )
+
+        # a set of pieces moves as the union of its pieces' moves
+        pieces = numpy.array( [1 | 1 << 63], dtype=numpy.uint64 )
+        moves = chess_numpy.batch_moves('ROOK', pieces, numpy.zeros(1, dtype=numpy.uint64))
+        self.assertEqual( int(moves[0]), generate_moves('ROOK', 0) | generate_moves('ROOK', 63) )
+
+        # farthest spaces match get_farthest for every square
+        farthest, distances = chess_numpy.batch_get_farthest( list(range(64)) )
+        for square in range(64):
+            expected = get_farthest( Queen(square_name(square)) )
+            self.assertEqual( square_name(int(farthest[square])), expected[0] )
+            self.assertAlmostEqual( distances[square], expected[1] )
+
+
+    # Test seeded scenario generation
+    def test_generate_scenarios_0(self):
+        scenarios = list( generate_scenarios(200, 8, seed=3) )
+        self.assertEqual( scenarios, list( generate_scenarios(200, 8, seed=3) ) )
+        self.assertNotEqual( scenarios, list( generate_scenarios(200, 8, seed=4) ) )
+
+        for square, pawn_mask in scenarios:
+            self.assertEqual( bin(pawn_mask).count('1'), 8 )
+            self.assertFalse( pawn_mask >> square & 1 )
+
+        # a fixed start square, and as many pawns as will fit
+        for square, pawn_mask in generate_scenarios(20, 63, seed=3, start=27):
+            self.assertEqual( square, 27 )
+            self.assertEqual( pawn_mask, (1 << 64) - 1 ^ 1 << 27 )
+
+
+    # Test seeded pawn placement and generated batch scenarios
+    def test_set_pawns_0(self):
+        boards = []
+        for i in range(2):
+            board = new_board()
+            board[3][3] = 'Q'
+            boards.append( set_pawns(board, 12, random.Random(5)) )
+            self.assertEqual( sum(row.count('p') for row in board), 12 )
+            self.assertEqual( board[3][3], 'Q' )
+        self.assertEqual( boards[0], boards[1] )
+        self.assertNotIn( 'd4', boards[0] )
+
+        # every empty space can take a pawn, but no more, and never fewer than 0
+        self.assertEqual( len(set_pawns(new_board(), 64)), 64 )
+        for count in (-3, 65, 2.5, '3'):
+            with self.assertRaises(ValueError):
+                set_pawns(new_board(), count)
+
+        output = io.StringIO()
+        write_scenarios(5, 3, seed=1, piece_type='rook', position='a1', mode='collect', output=output)
+        for line in output.getvalue().splitlines():
+            result = solve_scenario( json.loads(line) )
+            self.assertEqual( (result['piece'], result['position']), ('ROOK', 'a1') )
+            self.assertEqual( len(result['pawns']), 3 )
+
+        result = solve_scenario( {'piece': 'knight', 'position': 'b1', 'mode': 'collect', 'seed': 2, 'pawn_count': 4} )
+        self.assertEqual( result, solve_scenario( {'piece': 'knight', 'position': 'b1', 'mode': 'collect', 'seed': 2, 'pawn_count': 4} ) )
+        self.assertEqual( len(result['pawns']), 4 )
+
+
+    # Test BFS_pq against the exact collectors
+    def test_BFS_pq_0(self):
+
+        # the pawn on a4 blocks the rook until it is captured
+        start = Space(1, 1, 0, [], ['a4', 'a8'])
+        self.assertEqual( BFS_pq(start, 'ROOK', ['a4', 'a8']), (2, ['a1', 'a4', 'a8']) )
+
+        # spaces the start space has already passed through count as reached
+        start = Space(1, 1, 3, ['c1'], [])
+        self.assertEqual( BFS_pq(start, 'ROOK', ['c1']), (3, ['c1', 'a1']) )
+
+        for square, pawn_mask in generate_scenarios(10, 2, seed=8):
+            pawns = bitboard_to_positions(pawn_mask)
+            for piece_type in ('QUEEN', 'ROOK', 'KNIGHT'):
+                moves, path = BFS_pq(Space(square % 8 + 1, square // 8 + 1, 0, [], list(pawns)), piece_type, pawns)
+                self.assertEqual( moves, astar_collect(piece_type, square, [square_index(pos) for pos in pawns])[0] )
+                self.assertEqual( len(path), moves + 1 )
+
+
+    # Test closed-form distances against searches
+    def test_closed_form_distance_0(self):
+
+        # every knight distance on an empty board, including the corners
+        for square in range(64):
+            self.assertEqual( [knight_distance(square, target) for target in range(64)],
+                              distance_map('KNIGHT', square, parents=True)[0] )
+        self.assertEqual( knight_distance(square_index('a1'), square_index('b2')), 4 )
+        self.assertEqual( knight_distance(square_index('a1'), square_index('h8')), 6 )
+
+        # queen and rook answers are exact when there is one, and there is
+        #  one for most boards
+        answered = 0
+        for square, pawn_mask in generate_scenarios(200, 8, seed=6):
+            for piece_type in ('QUEEN', 'ROOK'):
+                distances = distance_map(piece_type, square, pawn_mask)
+                for target in range(64):
+                    moves = closed_form_distance(piece_type, square, target, pawn_mask)
+                    if moves is not None:
+                        self.assertEqual( moves, distances[target] )
+                        answered += 1
+        self.assertGreater( answered, 200 * 2 * 64 * 0.8 )
+
+        # a rook walled in on two sides needs a search
+        self.assertIsNone( closed_form_distance('ROOK', 0, 63, positions_to_bitboard(['a5', 'e1'])) )
+        self.assertEqual( closed_form_distance('ROOK', 0, 63, positions_to_bitboard(['a5'])), 2 )
+
+
+    # Test board geometry names, parsing and move generation
+    def test_board_geometry_0(self):
+
+        geometry = get_geometry(30, 200)
+        self.assertIs( geometry, get_geometry(30, 200) )
+        self.assertEqual( [geometry.file_name(f) for f in (0, 25, 26, 27, 29)], ['a', 'z', 'aa', 'ab', 'ad'] )
+        self.assertEqual( geometry.square_name(geometry.square_index('ab150')), 'ab150' )
+        self.assertEqual( geometry.parse_position('AD200'), (29, 199) )
+        for pos in ('ae1', 'a201', 'a0', 'a01', '1a', 'a', '', None):
+            self.assertFalse( geometry.is_valid_position(pos) )
+
+        self.assertEqual( parse_board_size('12x10').files, 12 )
+        self.assertTrue( parse_board_size('8X8').standard )
+        self.assertEqual( parse_board_size('256x1').files, 256 )
+        for text in ('8', '0x8', 'x', '8x8x8', '257x8', '8x257', '20000x20000'):
+            with self.assertRaises(ValueError):
+                parse_board_size(text)
+        with self.assertRaises(ValueError):
+            Solver('QUEEN', '300x300')
+        result = json.loads( solve_batch_line(1, json.dumps({'piece': 'QUEEN', 'position': 'a1', 'board': '20000x20000'})) )
+        self.assertEqual( result['error'], 'Board size 20000x20000 not accepted (1 to 256 files and ranks).' )
+
+        # whole-set fills give the table moves on the 8x8 board
+        geometry = BoardGeometry(8, 8)
+        for square, pawn_mask in generate_scenarios(100, 12, seed=2):
+            for piece_type in PIECE_SPECS:
+                self.assertEqual( geometry.fill_moves(piece_type, 1 << square, pawn_mask),
+                                  generate_moves(piece_type, square, pawn_mask) )
+
+        # pieces on other boards
+        geometry = get_geometry(12, 10)
+        self.assertEqual( Rook('l10', geometry).calculate_possible_moves()[-3:], ['i10', 'j10', 'k10'] )
+        self.assertEqual( sorted(Knight('a1', geometry).calculate_possible_moves()), ['b3', 'c2'] )
+        self.assertEqual( len(Queen('f5', geometry).calculate_possible_moves()), 11 + 9 + 5 + 5 + 4 + 4 )
+        self.assertEqual( target_mode(Queen('a1', geometry), bidirectional=True), 1 )
+        self.assertEqual( Solver('QUEEN', geometry).target('a1', bidirectional=True)['min_moves'], 2 )
+
+
+    # Test distances on boards that aren't 8x8 against a simple search
+    def test_board_geometry_1(self):
+
+        def reference(geometry, piece_type, square, pawns):
+            steps = [(1, 2), (2, 1), (-1, 2), (-2, 1), (1, -2), (2, -1), (-1, -2), (-2, -1)]
+            if piece_type != 'KNIGHT':
+                steps = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+                if piece_type == 'QUEEN':
+                    steps += [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+            distances = [-1] * geometry.size
+            distances[square] = 0
+            layer = [square]
+            while layer:
+                next_layer = []
+                for current in layer:
+                    for dx, dy in steps:
+                        x, y = current % geometry.files + dx, current // geometry.files + dy
+                        while 0 <= x < geometry.files and 0 <= y < geometry.ranks:
+                            target = y * geometry.files + x
+                            if distances[target] == -1:
+                                distances[target] = distances[current] + 1
+                                next_layer.append(target)
+                            if piece_type == 'KNIGHT' or target in pawns:
+                                break
+                            x, y = x + dx, y + dy
+                layer = next_layer
+            return distances
+
+        for files, ranks in ((1, 5), (3, 3), (5, 9), (13, 4), (27, 30)):
+            geometry = get_geometry(files, ranks)
+            for square, pawn_mask in generate_scenarios(5, min(6, geometry.size - 1), seed=files, size=geometry.size):
+                pawns = set( geometry.squares(pawn_mask) )
+                for piece_type in ('QUEEN', 'ROOK', 'KNIGHT'):
+                    expected = reference(geometry, piece_type, square, pawns)
+                    self.assertEqual( geometry.distance_map(piece_type, square, pawn_mask), expected )
+                    for target in (0, geometry.size - 1):
+                        path = geometry.shortest_path(piece_type, square, target, pawn_mask)
+                        if expected[target] == -1:
+                            self.assertIsNone( path )
+                        else:
+                            self.assertEqual( len(path), expected[target] )
+                            self.assertLessEqual( geometry.lower_bound(piece_type, square, target),
+                                                  expected[target] )
+
+        # the modes and batch scenarios run on large boards
+        geometry = get_geometry(200, 200)
+        self.assertEqual( target_mode( Knight('cv100', geometry), pawns=20 ), 1 )
+        self.assertEqual( collector_mode( Rook('a1', geometry), pawns=5 ), 1 )
+        result = solve_scenario({'piece': 'QUEEN', 'position': 'a1', 'mode': 'collect', 'board': '200x200',
+                                 'pawns': ['gr200', 'b2']})
+        self.assertEqual( (result['board'], result['min_moves']), ('200x200', 2) )
+
+        # the 8x8 board prints the same as before
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            print_board( new_board() )
+        self.assertEqual( output.getvalue().splitlines()[-1], '  a b c d e f g h' )
+        self.assertEqual( output.getvalue().splitlines()[-2], '1 . . . . . . . . ' )
+
+
+    # Test writing and loading distance tablebases
+    def test_tablebase_0(self):
+
+        geometry = get_geometry(3, 3)
+        expected = { piece_type: [geometry.distance_map(piece_type, square) for square in range(9)]
+                     for piece_type in PIECE_SPECS }
+        scenarios = list( generate_scenarios(20, 6, seed=8) )
+        collected = [ astar_collect(piece_type, square, list(bitboard_squares(pawn_mask)))
+                      for square, pawn_mask in scenarios for piece_type in ('QUEEN', 'ROOK', 'KNIGHT') ]
+
+        with tempfile.TemporaryDirectory() as directory:
+            standard_path = os.path.join(directory, 'standard.bin')
+            small_path = os.path.join(directory, 'small.bin')
+            write_tablebase(standard_path)
+            write_tablebase(small_path, geometry)
+
+            try:
+                load_tablebase(standard_path)
+                tablebase = load_tablebase(small_path)
+
+                # the middle square of a 3x3 board can't be reached by a knight
+                self.assertEqual( tablebase.distance('KNIGHT', 0, 4), UNREACHABLE )
+                for piece_type, distances in expected.items():
+                    for square in range(9):
+                        self.assertEqual( geometry.distance_map(piece_type, square), distances[square] )
+
+                self.assertEqual( empty_board_distances('QUEEN')[0][63], 1 )
+                # squares a camel can't reach are still -1 with the 8x8 tablebase
+                self.assertEqual( distance_map('CAMEL', 0)[1], -1 )
+                self.assertEqual( Solver('CAMEL').target('a1')['farthest_moves'], 5 )
+                self.assertEqual( [ astar_collect(piece_type, square, list(bitboard_squares(pawn_mask)))
+                                    for square, pawn_mask in scenarios for piece_type in ('QUEEN', 'ROOK', 'KNIGHT') ],
+                                  collected )
+            finally:
+                unload_tablebases()
+
+            # files that aren't tablebases
+            with open(small_path, 'r+b') as small_file:
+                small_file.write(b'NOTATBASE')
+            with self.assertRaises(ValueError):
+                load_tablebase(small_path)
+            with open(small_path, 'wb'):
+                pass
+            with self.assertRaises(ValueError):
+                load_tablebase(small_path)
+
+
+    # Test the solver server over a Unix socket
+    def test_solver_server_0(self):
+
+        self.assertEqual( parse_address('8765'), ('tcp', '127.0.0.1', 8765) )
+        self.assertEqual( parse_address('0.0.0.0:80'), ('tcp', '0.0.0.0', 80) )
+        self.assertEqual( parse_address('/tmp/chess.sock'), ('unix', '/tmp/chess.sock') )
+
+        scenarios = [ {'piece': 'KNIGHT', 'position': 'a1', 'mode': 'collect', 'pawns': ['h8', 'b5'], 'id': 1},
+                      {'piece': 'QUEEN', 'position': 'd4'},
+                      {'piece': 'ROOK', 'position': 'a1', 'mode': 'target', 'pawns': ['a5'], 'target': 'h8'},
+                      {'piece': 'ROOK', 'position': 'z9'} ]
+        lines = [json.dumps(scenario) for scenario in scenarios] + ['', '[1]']
+
+        async def run(address):
+            solver_server = SolverServer(workers=1)
+            await solver_server.start(address)
+            try:
+                reader, writer = await asyncio.open_unix_connection(address)
+                writer.write( ''.join(line + '\n' for line in lines).encode() )
+                writer.write_eof()
+                results = [ json.loads(line) for line in (await reader.read()).decode().splitlines() ]
+                writer.close()
+            finally:
+                await solver_server.close()
+            return results
+
+        with tempfile.TemporaryDirectory() as directory:
+            results = asyncio.run( run(os.path.join(directory, 'chess.sock')) )
+
+        # results come back in order, numbered by line, and match batch mode
+        self.assertEqual( [result['line'] for result in results], [1, 2, 3, 4, 6] )
+        self.assertEqual( results[0], json.loads(solve_batch_line(1, lines[0])) )
+        self.assertEqual( results[1]['moves'][:3], ['a1', 'd1', 'g1'] )
+        self.assertEqual( results[2]['min_moves'], 2 )
+        self.assertIn( 'error', results[3] )
+        self.assertIn( 'error', results[4] )
+
+        # a scenario that fails in an unexpected way still gets an error
+        #  result, and the scenarios after it are answered
+        solve_line = chess.solve_scenario_line
+        def failing(line_number, scenario):
+            if scenario.get('id') == 'fail':
+                raise RuntimeError('solver failed')
+            return solve_line(line_number, scenario)
+        lines = [ json.dumps({'piece': 'QUEEN', 'position': 'd4', 'id': 'fail'}), lines[1] ]
+
+        with tempfile.TemporaryDirectory() as directory, unittest.mock.patch('chess.solve_scenario_line', failing):
+            results = asyncio.run( run(os.path.join(directory, 'chess.sock')) )
+        self.assertEqual( results[0], {'error': 'solver failed', 'line': 1} )
+        self.assertEqual( results[1]['moves'][:3], ['a1', 'd1', 'g1'] )
+
+        # scenarios on big boards go to the worker, so an 8x8 query on
+        #  another connection is answered while they are solved
+        big = json.dumps( {'piece': 'KNIGHT', 'position': 'a1', 'mode': 'target', 'board': '200x200',
+                           'pawn_count': 2000, 'seed': 1} )
+
+        async def run_concurrent(address):
+            solver_server = SolverServer(workers=1)
+            await solver_server.start(address)
+            try:
+                big_reader, big_writer = await asyncio.open_unix_connection(address)
+                big_writer.write( (big + '\n').encode() * 5 )
+                big_writer.write_eof()
+                big_results = asyncio.ensure_future( big_reader.read() )
+                await asyncio.sleep(0.05)
+
+                reader, writer = await asyncio.open_unix_connection(address)
+                writer.write( (lines[1] + '\n').encode() )
+                writer.write_eof()
+                result = json.loads( await reader.read() )
+                answered_first = not big_results.done()
+                big_results = (await big_results).decode().splitlines()
+                writer.close()
+                big_writer.close()
+            finally:
+                await solver_server.close()
+            return result, answered_first, big_results
+
+        with tempfile.TemporaryDirectory() as directory:
+            result, answered_first, big_results = asyncio.run( run_concurrent(os.path.join(directory, 'chess.sock')) )
+        self.assertEqual( result['moves'][:3], ['a1', 'd1', 'g1'] )
+        self.assertTrue( answered_first )
+        self.assertEqual( [json.loads(line)['min_moves'] for line in big_results], [json.loads(big_results[0])['min_moves']] * 5 )
+
+
+    # Test the Solver library API
+    def test_Solver_0(self):
+
+        rook = Solver('rook')
+        self.assertEqual( rook.moves('a1', ['a3', 'c1']), ['b1', 'c1', 'a2', 'a3'] )
+        self.assertEqual( rook.collect('a1', ['a8', 'h8']), {'min_moves': 2, 'path': ['a1', 'a8', 'h8']} )
+        self.assertEqual( rook.collect('a1', ['c6', 'c1'], 'pq')['min_moves'], 2 )
+
+        target = rook.target('a1', ['a5'], 'H8')
+        self.assertEqual( (target['target'], target['min_moves'], target['farthest_moves']), ('h8', 2, 2) )
+        self.assertAlmostEqual( target['distance'], 7 * 2 ** 0.5 )
+        target = Solver('QUEEN').target('d4', bidirectional=True)
+        self.assertEqual( (target['target'], target['min_moves']), ('h8', 1) )
+
+        distances = Solver('KNIGHT', '12x10').distance_map('a1')
+        self.assertEqual( (len(distances), distances['a1'], distances['c2'], distances['l10']), (120, 0, 1, 8) )
+
+        for call in ( lambda: Solver('PAWN'), lambda: rook.moves('i1'), lambda: rook.collect('a1', ['a1']),
+                      lambda: rook.collect('a1', ['b2', 'b2']), lambda: rook.target('a1', [], 'a9'),
+                      lambda: rook.collect('a1', ['b2'], 'greedy'), lambda: Solver('ROOK', '12x10').collect('a1', ['b2'], 'pq'),
+                      lambda: rook.moves('e4', ['z9']), lambda: rook.moves('e4', ['e4']), lambda: rook.target('e4', 5),
+                      lambda: rook.collect('e4', 'a1'), lambda: rook.distance_map('e4', None),
+                      lambda: rook.collect('a1', ['a8'], 'anytime', time_budget=float('nan')),
+                      lambda: rook.collect('a1', ['a8'], 'anytime', time_budget=0) ):
+            with self.assertRaises(ValueError):
+                call()
+
+        # one Solver answers the same from many threads, with the tables
+        #  built while they run
+        scenarios = [ (square_name(square), bitboard_to_positions(pawn_mask))
+                      for square, pawn_mask in generate_scenarios(40, 5, seed=11) ]
+        solvers = [ Solver(piece_type) for piece_type in ('QUEEN', 'ROOK', 'KNIGHT') ]
+        def solve(solver, position, pawns):
+            return (solver.collect(position, pawns), solver.target(position, pawns), solver.moves(position, pawns))
+        expected = [ solve(solver, *scenario) for solver in solvers for scenario in scenarios ]
+
+        unload_tablebases()
+        with concurrent.futures.ThreadPoolExecutor(8) as pool:
+            futures = [ pool.submit(solve, solver, *scenario) for solver in solvers for scenario in scenarios ]
+            self.assertEqual( [future.result() for future in futures], expected )
+
+
+    # Test the pieces made from piece specs against a simple move generator
+    def test_piece_specs_0(self):
+
+        def reference_moves(geometry, spec, square, pawns):
+            moves = set()
+            for dx, dy in spec.leaps:
+                x, y = square % geometry.files + dx, square // geometry.files + dy
+                if 0 <= x < geometry.files and 0 <= y < geometry.ranks:
+                    moves.add(y * geometry.files + x)
+            for dx, dy in spec.slides:
+                x, y = square % geometry.files + dx, square // geometry.files + dy
+                while 0 <= x < geometry.files and 0 <= y < geometry.ranks:
+                    moves.add(y * geometry.files + x)
+                    if y * geometry.files + x in pawns:
+                        break
+                    x, y = x + dx, y + dy
+            return moves
+
+        def reference_distances(geometry, spec, square, pawns):
+            distances = [-1] * geometry.size
+            distances[square] = 0
+            layer = [square]
+            while layer:
+                next_layer = []
+                for current in layer:
+                    for target in reference_moves(geometry, spec, current, pawns):
+                        if distances[target] == -1:
+                            distances[target] = distances[current] + 1
+                            next_layer.append(target)
+                layer = next_layer
+            return distances
+
+        self.assertEqual( (Bishop('c1').icon, King('e1').icon, PIECE_CLASSES['AMAZON']('d4').icon), ('B', 'G', 'Z') )
+        self.assertEqual( King('a1').calculate_possible_moves(), ['b1', 'a2', 'b2'] )
+        self.assertEqual( Bishop('c1').calculate_possible_moves(['e3']), ['b2', 'd2', 'a3', 'e3'] )
+        self.assertEqual( len(leaper(1, 3)), 8 )
+
+        for files, ranks in ((8, 8), (3, 3), (7, 5), (12, 10)):
+            geometry = get_geometry(files, ranks)
+            for square, pawn_mask in generate_scenarios(8, min(8, geometry.size - 1), seed=files, size=geometry.size):
+                pawns = set( geometry.squares(pawn_mask) )
+                for piece_type, spec in PIECE_SPECS.items():
+                    moves = reference_moves(geometry, spec, square, pawns)
+                    self.assertEqual( set(geometry.squares(geometry.moves(piece_type, square, pawn_mask))), moves )
+                    self.assertEqual( set(geometry.squares(geometry.fill_moves(piece_type, 1 << square, pawn_mask))), moves )
+
+                    expected = reference_distances(geometry, spec, square, pawns)
+                    self.assertEqual( geometry.distance_map(piece_type, square, pawn_mask), expected )
+                    for target in range(geometry.size):
+                        if expected[target] >= 0:
+                            self.assertLessEqual( geometry.lower_bound(piece_type, square, target), expected[target] )
+
+                    # both exact collectors agree (None if a pawn can't be reached)
+                    astar = astar_collect(piece_type, square, sorted(pawns)[:5], geometry=geometry)
+                    held_karp = held_karp_collect(piece_type, square, sorted(pawns)[:5], geometry=geometry)
+                    self.assertEqual( astar and astar[0], held_karp and held_karp[0] )
+
+        # a bishop keeps to its colour
+        self.assertEqual( Solver('BISHOP').target('a1', [], 'a2')['min_moves'], -1 )
+        for solver in ('astar', 'heldkarp', 'pq'):
+            with self.assertRaises(ValueError):
+                Solver('BISHOP').collect('a1', ['c3', 'a2'], solver)
+
+        # specs need every move's opposite, slides along the eight lines, and
+        #  no move that stays put
+        for leaps, slides in ( ([(1, 2)], []), ([], [(1, 0)]), ([], [(1, 2), (-1, -2)]), ([(0, 0)], []) ):
+            with self.assertRaises(ValueError):
+                PieceSpec('BROKEN', 'X', leaps, slides)
+        with self.assertRaisesRegex(ValueError, 'same square'):
+            PieceSpec('BROKEN', 'X', [(0, 0)])
+
+        # a new piece works everywhere once it is registered
+        try:
+            register_piece('ZEBRA', 'E', leaps=leaper(2, 3))
+            self.assertEqual( Solver('zebra').moves('a1'), ['d3', 'c4'] )
+            self.assertEqual( solve_scenario({'piece': 'ZEBRA', 'position': 'a1', 'mode': 'collect',
+                                              'pawns': ['d3', 'f6']})['min_moves'], 2 )
+        finally:
+            del PIECE_SPECS['ZEBRA'], PIECE_CLASSES['ZEBRA'], MOVE_FUNCTIONS['ZEBRA']
+
+
+    # Test perft counts with both move generators
+    def test_perft_0(self):
+
+        rook = [ ('ROOK', square_index('d4')) ]
+        self.assertEqual( [perft(rook, 0, depth) for depth in range(4)], [1, 14, 14 ** 2, 14 ** 3] )
+
+        # friendly pieces block each other and can't be landed on
+        rooks = [ ('ROOK', square_index('a1')), ('ROOK', square_index('h1')) ]
+        self.assertEqual( perft(rooks, 0, 1), 26 )
+
+        # a captured pawn leaves the board: after taking either pawn the rook
+        #  has 14 moves, as on an empty board
+        pawn_mask = positions_to_bitboard(['a2', 'b1'])
+        self.assertEqual( perft([('ROOK', 0)], pawn_mask, 1), 2 )
+        self.assertEqual( perft([('ROOK', 0)], pawn_mask, 2), 14 + 14 )
+
+        pieces = [ ('QUEEN', square_index('d1')), ('KNIGHT', square_index('g1')), ('BISHOP', square_index('f1')),
+                   ('CAMEL', square_index('e2')) ]
+        pawn_mask = positions_to_bitboard(['c5', 'd5', 'e4', 'g6', 'h3', 'b3'])
+        for depth in range(1, 4):
+            self.assertEqual( perft(pieces, pawn_mask, depth, legacy_moves), perft(pieces, pawn_mask, depth) )
+
+        for pieces, pawn_mask in ( (rooks + [('KNIGHT', 0)], 0), (rook, 1 << square_index('d4')) ):
+            with self.assertRaises(ValueError):
+                perft(pieces, pawn_mask, 1)
+
+
+    # Test incremental distance maps against searching again
+    def test_DistanceMap_0(self):
+
+        for geometry in ( get_geometry(8, 8), get_geometry(5, 7) ):
+            for square, pawn_mask in generate_scenarios(6, 10, seed=4, size=geometry.size):
+                for piece_type in PIECE_SPECS:
+                    stats = new_stats()
+                    distances = DistanceMap(piece_type, square, 0, geometry, stats)
+
+                    # place the pawns one at a time, then take them off in
+                    #  another order, checking every step
+                    pawns = list( geometry.squares(pawn_mask) )
+                    steps = [ (distances.add_blocker, pawn) for pawn in pawns ] + \
+                            [ (distances.remove_blocker, pawn) for pawn in reversed(pawns[::2] + pawns[1::2]) ]
+                    occupancy = 0
+                    for update, pawn in steps:
+                        update(pawn)
+                        occupancy ^= 1 << pawn
+                        self.assertEqual( distances.distances(), geometry.distance_map(piece_type, square, occupancy) )
+                        self.assertEqual( distances.layers, geometry.layers(piece_type, square, occupancy) )
+
+                    # leapers jump over pawns, so nothing is searched again
+                    if PIECE_SPECS[piece_type].slides:
+                        self.assertGreater( stats['pushed'], 0 )
+
+                    distances.set_occupancy(pawn_mask)
+                    self.assertEqual( distances.distances(), geometry.distance_map(piece_type, square, pawn_mask) )
+                    self.assertEqual( distances[square], 0 )
+
+        # distances from a pawn to every pawn, for every set of pawns left
+        pawns = [ square_index(pos) for pos in ('a1', 'a8', 'h8', 'd4', 'd1') ]
+        subsets = pawn_subsets(pawns)
+        for piece_type in ('QUEEN', 'ROOK', 'BISHOP', 'CAMEL'):
+            table = capture_distances(piece_type, pawns, 0)
+            for left in range(1 << len(pawns)):
+                if left & 1:
+                    self.assertIsNone( table[left] )
+                else:
+                    expected = distance_map(piece_type, pawns[0], subsets[left])
+                    self.assertEqual( table[left], [expected[pawn] for pawn in pawns] )
+
+
+    # Test search counters
+    def test_stats_0(self):
+
+        # a distance map expands every reachable square once
+        stats = new_stats()
+        distances = distance_map('ROOK', 0, positions_to_bitboard(['a2', 'b1']), stats=stats)
+        self.assertEqual( distances, distance_map('ROOK', 0, positions_to_bitboard(['a2', 'b1'])) )
+        self.assertEqual( stats['popped'], sum(1 for moves in distances if moves >= 0) )
+        self.assertEqual( stats['pushed'], stats['popped'] - 1 )
+        self.assertEqual( stats['movegen_calls'], stats['popped'] )
+
+        # rook moves reach many squares more than once
+        stats = new_stats()
+        self.assertEqual( BFS(Space(1, 1, 0), Space(8, 8, -1), 'ROOK', ['a5', 'e1'], stats=stats), 3 )
+        self.assertGreater( stats['duplicates'], 0 )
+        self.assertLessEqual( stats['max_frontier'], stats['pushed'] )
+
+        # counters add up over several searches
+        BFS(Space(1, 1, 0), Space(8, 8, -1), 'ROOK', ['a5', 'e1'], stats=stats)
+        self.assertEqual( stats['popped'] % 2, 0 )
+
+        stats = new_stats()
+        start = Space(1, 1, 0, [], ['a8', 'h8'])
+        self.assertEqual( BFS_pq(start, 'ROOK', ['a8', 'h8'], stats), (2, ['a1', 'a8', 'h8']) )
+        self.assertEqual( stats['movegen_calls'], stats['popped'] )
+
+        result = solve_scenario( {'piece': 'queen', 'position': 'a1', 'mode': 'collect', 'pawns': ['c3', 'h8'], 'stats': True} )
+        self.assertEqual( result['min_moves'], 2 )
+        self.assertGreater( result['stats']['popped'], 0 )
+        self.assertEqual( sorted(result['stats']['timings']), ['search', 'setup'] )
+        self.assertNotIn( 'stats', solve_scenario( {'piece': 'queen', 'position': 'a1', 'mode': 'collect', 'pawns': ['c3']} ) )
+
+        # the modes time every phase
+        for mode in (target_mode, collector_mode):
+            stats = new_stats()
+            mode(Rook('b8'), stats=stats)
+            self.assertEqual( sorted(stats['timings']), ['output', 'search', 'setup'] )
+            self.assertGreater( stats['popped'], 0 )
+
+
     # Test Target Mode with every piece type
     def test_target_mode_0(self):
 
@@ -394,5 +1490,36 @@ class TestChess(unittest.TestCase):
             self.assertEqual( run_output2, 1 )
 
 
+    # Test Collector Mode with the exact solvers
+    def test_collector_mode_1(self):
+
+        for solver in ('astar', 'heldkarp'):
+            for test_piece in ( Queen('d5'), Rook('h1'), Knight('b8') ):
+                self.assertEqual( collector_mode(test_piece, solver), 1 )
+
+
+    # Test that SIGTERM stops the anytime solver with its best solution
+    def test_collector_mode_2(self):
+
+        terms = []
+        handler = lambda signal_number, frame: terms.append(signal_number)
+        previous = signal.signal(signal.SIGTERM, handler)
+        try:
+            # 40 pawns keep the search going long after the signal
+            timer = threading.Timer( 0.3, os.kill, (os.getpid(), signal.SIGTERM) )
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                timer.start()
+                collector_mode(Knight('a1'), 'anytime', 40, random.Random(3))
+            timer.join()
+
+            self.assertIn( 'Moves:', output.getvalue() )
+            self.assertEqual( terms, [] )
+            self.assertEqual( signal.getsignal(signal.SIGINT), signal.default_int_handler )
+            self.assertIs( signal.getsignal(signal.SIGTERM), handler )
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+
+
 if __name__ == '__main__':
 	unittest.main()